@@ -1,17 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file, g, Response, stream_with_context
 import os
 import pydicom
 import requests
-from urllib3.filepost import encode_multipart_formdata, choose_boundary
-from azure.identity import ClientSecretCredential
-from io import BytesIO
 from pathlib import Path
 import logging
 from pydicom.uid import generate_uid
-import requests_toolbelt as tb
 import urllib3
 import shutil
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import azure_auth
+import batch_edit
+import bulk_rules
+import catalog
+import config
+import dicom_headers
+import dicomweb
+import header_patch
+import integrity
+import jobs
+import log_setup
+import log_tail
+import metrics
+import preview
+import profiling
+import query_cache
+import tag_render
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Load environment variables
@@ -24,15 +40,64 @@ app.secret_key = os.urandom(24)  # For flash messages
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max request size
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching for development
 
-# Configure logging for the Flask app
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('dicom_editor.log'),
-        logging.StreamHandler()
-    ]
-)
+# Debug mode (with the auto-reloader) when run as a script
+debug_mode = os.getenv('FLASK_DEBUG', '1') == '1'
+
+# Configure logging for the Flask app: records are queued and written by a background thread.
+# Only one process writes and rotates the log file; pool workers and the reloader's watcher do not.
+if log_setup.is_logging_process(reloader=__name__ == "__main__" and debug_mode):
+    log_setup.configure_logging()
+app.add_template_filter(log_tail.record_level, 'log_level')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def start_request_profile():
+    """Profile this request when the session setting is on and the request asks for it"""
+    if profiling.is_requested(request) and get_current_settings().get('PROFILING'):
+        g.profiler = profiling.start()
+        g.profile_started = time.perf_counter()
+        if g.profiler is None:
+            g.profile_skipped = True
+
+def finish_request_profile(outcome=None):
+    """Stop this request's profiler, if any, save it and release the budget slot; returns the file name"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    elapsed = time.perf_counter() - g.profile_started
+    name = profiling.stop(profiler, request.endpoint or 'unmatched', elapsed)
+    logging.info(f"Saved profile of {request.method} {request.path} ({elapsed:.3f}s{outcome or ''}) as {name}")
+    return name
+
+@app.after_request
+def save_request_profile(response):
+    name = finish_request_profile()
+    if name is not None:
+        response.headers[profiling.PROFILE_HEADER] = name
+    elif g.pop('profile_skipped', False):
+        response.headers[profiling.PROFILE_HEADER] = 'skipped: budget spent or another profile running'
+    return response
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    """Runs for every request, so a request that raised past after_request still frees the budget slot"""
+    try:
+        finish_request_profile(f", failed: {error!r}" if error is not None else None)
+    except Exception as e:
+        logging.error(f"Failed to save request profile: {e}")
+
+@app.after_request
+def record_request_duration(response):
+    """Observe each request's handling time by route (not by URL, to keep label sets bounded)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started, request.endpoint or 'unmatched', request.method, str(response.status_code)
+        )
+    return response
 
 # Session-based settings management
 def get_current_settings():
@@ -43,7 +108,8 @@ def get_current_settings():
             'AZURE_DICOM_ENDPOINT': os.getenv("AZURE_DICOM_ENDPOINT"),
             'AZURE_DICOM_CLIENT_ID': os.getenv("AZURE_DICOM_CLIENT_ID"),
             'AZURE_DICOM_SECRET': os.getenv("AZURE_DICOM_SECRET"),
-            'AZURE_TENANT_ID': os.getenv("AZURE_TENANT_ID")
+            'AZURE_TENANT_ID': os.getenv("AZURE_TENANT_ID"),
+            'PROFILING': config.PROFILING_ENABLED
         }
     return session['settings']
 
@@ -85,106 +151,115 @@ def edit_study(study):
     study_path = os.path.join(dicom_root, study)
     dicom_files = get_dicom_files(study_path)
 
-    sample = pydicom.dcmread(dicom_files[0], force=True) if dicom_files else None
+    sample = dicom_headers.read_header(dicom_files[0], dicom_headers.STUDY_FIELDS) if dicom_files else None
 
     fields = {
-        "StudyInstanceUID": getattr(sample, "StudyInstanceUID", ""),
-        "PatientName": getattr(sample, "PatientName", ""),
-        "PatientID": getattr(sample, "PatientID", ""),
-        "PatientBirthDate": getattr(sample, "PatientBirthDate", ""),
-        "AccessionNumber": getattr(sample, "AccessionNumber", ""),
-        "StudyDescription": getattr(sample, "StudyDescription", ""),
-        "ReferringPhysicianName": getattr(sample, "ReferringPhysicianName", ""),
-        "StudyDate": getattr(sample, "StudyDate", ""),
-        "StudyTime": getattr(sample, "StudyTime", ""),
+        field: getattr(sample, field, "")
+        for field in dicom_headers.STUDY_FIELDS
     }
 
-    return render_template("edit_study.html", study=study, fields=fields)
+    # One thumbnail per series; the rest of the study is rendered into the preview cache in the background
+    series_files = {}
+    for file_path in sorted(dicom_files):
+        series_files.setdefault(os.path.dirname(file_path), []).append(file_path)
+    series_previews = [
+        (os.path.basename(folder), os.path.relpath(files[len(files) // 2], dicom_root), len(files))
+        for folder, files in sorted(series_files.items())
+    ]
+    preview.warm(dicom_files)
+
+    return render_template("edit_study.html", study=study, fields=fields, series_previews=series_previews)
 
 @app.route("/save-study/<study>", methods=["POST"])
 def save_study(study):
+    """Show which files the submitted values would change before anything is written"""
     dicom_root = get_dicom_root()
+    plan = batch_edit.plan_study_edits(dicom_root, study, request.form.to_dict())
+    if not plan['files'] and not plan['failed']:
+        flash(f"No changes: all {plan['total']} file(s) of study '{study}' already have these values", "info")
+        return redirect(url_for('edit_study', study=study))
+    return render_template(
+        "study_plan.html", study=study, plan=plan, max_files_shown=batch_edit.MAX_PLANNED_FILES_SHOWN
+    )
+
+@app.route("/save-study/<study>/apply", methods=["POST"])
+def apply_study_plan(study):
+    dicom_root = get_dicom_root()
+    job = jobs.job_manager.submit(
+        'edit', f"Save study '{study}'", edit_study_job, dicom_root, study, request.form.to_dict()
+    )
+    flash(f"[STARTED] Saving study '{study}' in the background (job {job.id})", "info")
+    return redirect(url_for('view_jobs', job=job.id))
+
+def edit_study_job(dicom_root, study, changes, progress=None, cancel=None):
+    """Background job: write study-level edits to the files of a local study that differ"""
     study_path = os.path.join(dicom_root, study)
-    dicom_files = get_dicom_files(study_path)
+    batch_edit.recover_study(study_path)
+    # Planned again here, so files changed since the preview are still covered
+    plan = batch_edit.plan_study_edits(dicom_root, study, changes)
+    if plan['failed']:
+        return False, f"Study '{study}' was not changed: {len(plan['failed'])} file(s) could not be read (see logs)"
+    if not plan['files']:
+        return True, f"Study '{study}' already up to date: no file needed writing"
 
-    for file in dicom_files:
-        ds = pydicom.dcmread(file, force=True)
-        for key, value in request.form.items():
-            if hasattr(ds, key):
-                setattr(ds, key, value)
-        ds.save_as(file)
+    dicom_files = [os.path.join(dicom_root, item['path']) for item in plan['files']]
+    summary = batch_edit.apply_study_edits(
+        dicom_files, plan['changes'], progress=progress, cancel=cancel, study_path=study_path
+    )
+    catalog.invalidate_study(dicom_root, study)
 
-    return redirect(url_for('edit_study', study=study))
+    unchanged = plan['unchanged'] + summary['unchanged']
+    if summary['committed']:
+        return True, f"Saved study '{study}': {summary['updated']} file(s) updated, {unchanged} already up to date"
+    if summary['cancelled']:
+        return False, f"Study '{study}' was not changed: the edit was cancelled"
+    return False, f"Study '{study}' was not changed: {summary['failed']} file(s) could not be edited (see logs)"
 
 @app.route("/edit-file/<path:file_path>")
 def edit_file(file_path):
     dicom_root = get_dicom_root()
     abs_path = os.path.join(dicom_root, file_path)
-    ds = pydicom.dcmread(abs_path, force=True)
+    ds = header_patch.load_deferred(abs_path)
     
-    # Define protected tags that should not be deleted
-    protected_tags = {
-        'SOPClassUID', 'SOPInstanceUID', 'StudyInstanceUID', 'SeriesInstanceUID',
-        'PatientID', 'PatientName', 'Modality', 'TransferSyntaxUID',
-        'MediaStorageSOPClassUID', 'MediaStorageSOPInstanceUID',
-        'ImplementationClassUID', 'SpecificCharacterSet'
-    }
-    
-    fields = []
-    for elem in ds:
-        if elem.keyword:
-            try:
-                # Handle different value types more carefully
-                if isinstance(elem.value, (str, int, float)):
-                    value_str = str(elem.value)
-                elif hasattr(elem.value, '__iter__') and not isinstance(elem.value, (str, bytes)):
-                    # Handle sequences and arrays
-                    try:
-                        value_str = str(elem.value)
-                        if len(value_str) > 1000:  # Truncate very long values for display
-                            value_str = value_str[:1000] + "... [TRUNCATED - Click to edit full value]"
-                    except:
-                        value_str = f"[Complex Value - Type: {type(elem.value).__name__}]"
-                else:
-                    value_str = str(elem.value)
-                
-                # Truncate extremely long values for better UI performance
-                if len(value_str) > 1000:
-                    display_value = value_str[:1000] + "... [TRUNCATED]"
-                else:
-                    display_value = value_str
-                
-                field_data = {
-                    "tag": str(elem.tag),
-                    "keyword": elem.keyword,
-                    "VR": elem.VR,
-                    "VM": elem.VM,
-                    "length": len(str(elem.value)),
-                    "value": display_value,
-                    "original_value": value_str,  # Keep original for form submission
-                    "is_deletable": elem.keyword not in protected_tags
-                }
-                fields.append(field_data)
-                
-            except Exception as e:
-                logging.warning(f"Error processing DICOM tag {elem.keyword}: {e}")
-                # Add a fallback entry for problematic tags
-                fields.append({
-                    "tag": str(elem.tag),
-                    "keyword": elem.keyword or "(unknown)",
-                    "VR": getattr(elem, 'VR', 'UN'),
-                    "VM": getattr(elem, 'VM', '1'),
-                    "length": 0,
-                    "value": "[Error reading value]",
-                    "original_value": "",
-                    "is_deletable": (elem.keyword or "") not in protected_tags
-                })
+    # Lengths come from the element headers; bulk values and sequence items are never stringified
+    fields = tag_render.render_dataset(ds)
     
     # Calculate total tag count
     tag_count = len(fields)
     
     return render_template("edit_file.html", fields=fields, file_path=file_path, tag_count=tag_count)
 
+@app.route("/preview/<path:file_path>")
+def preview_image(file_path):
+    """PNG thumbnail of a file's pixel data (middle frame by default), served from the preview cache"""
+    dicom_root = get_dicom_root()
+    abs_path = os.path.join(dicom_root, file_path)
+    size = min(max(16, request.args.get('size', config.THUMBNAIL_SIZE, type=int)), config.PREVIEW_MAX_SIZE)
+    frame = request.args.get('frame', type=int)
+    try:
+        key, png = preview.get_preview(abs_path, size, frame)
+    except FileNotFoundError:
+        return jsonify({'error': f"DICOM file not found: {file_path}"}), 404
+    except preview.PreviewError as e:
+        logging.warning(f"No preview for '{file_path}': {e}")
+        return jsonify({'error': str(e)}), 415
+    return send_file(png, mimetype='image/png', etag=key)
+
+@app.route("/api/sequence-items/<path:file_path>")
+def sequence_items(file_path):
+    """Items of one (possibly nested) sequence, loaded on demand by the file editor"""
+    dicom_root = get_dicom_root()
+    abs_path = os.path.join(dicom_root, file_path)
+    try:
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = min(max(1, request.args.get('limit', tag_render.DEFAULT_ITEM_LIMIT, type=int)), 500)
+        ds, _ = header_patch.load_header(abs_path)
+        return jsonify(tag_render.render_sequence_items(ds, request.args.get('path', ''), offset, limit))
+    except FileNotFoundError:
+        return jsonify({'error': f"DICOM file not found: {file_path}"}), 404
+    except (KeyError, ValueError, IndexError) as e:
+        return jsonify({'error': str(e)}), 400
+
 
 @app.route("/save-file/<path:file_path>", methods=["POST"])
 def save_file(file_path):
@@ -197,7 +272,7 @@ def save_file(file_path):
             flash(f"DICOM file not found: {file_path}", "error")
             return redirect(url_for('index'))
         
-        ds = pydicom.dcmread(abs_path, force=True)
+        ds, pixel_offset = header_patch.load_header(abs_path)
         changes_made = []
         
         # Process form data more efficiently
@@ -207,8 +282,8 @@ def save_file(file_path):
                     old_value = str(getattr(ds, key, ''))
                     new_value = request.form[key].strip()
                     
-                    # Skip if no actual change
-                    if old_value == new_value:
+                    # Skip if no actual change (padding differences do not count)
+                    if not batch_edit.value_differs(old_value, new_value):
                         continue
                     
                     # Handle large values more carefully
@@ -230,7 +305,8 @@ def save_file(file_path):
         if changes_made:
             # Save with better error handling
             try:
-                ds.save_as(abs_path)
+                header_patch.save_header(ds, abs_path, pixel_offset)
+                catalog.invalidate_study(dicom_root, Path(file_path).parts[0])
                 flash(f"Successfully saved {len(changes_made)} change(s) to DICOM file", "success")
                 logging.info(f"Saved changes to DICOM file '{file_path}': {len(changes_made)} changes made")
                 
@@ -253,58 +329,33 @@ def save_file(file_path):
     
     return redirect(url_for('edit_file', file_path=file_path))
 
-def get_bearer_token():
-    """Get Azure authentication token"""
+def get_bearer_token(azure_settings=None):
+    """Get Azure authentication token (from the session settings unless given)"""
     try:
-        azure_settings = get_azure_settings()
+        azure_settings = azure_settings or get_azure_settings()
         client_id = azure_settings['client_id']
         client_secret = azure_settings['client_secret']
         tenant_id = azure_settings['tenant_id']
         
-        if not all([client_id, client_secret, tenant_id]):
+        if not azure_auth.token_manager.static_token and not all([client_id, client_secret, tenant_id]):
             raise ValueError("Missing Azure credentials in session settings")
             
-        credential = ClientSecretCredential(
-            client_id=client_id,
-            client_secret=client_secret,
-            tenant_id=tenant_id
+        # Credentials and tokens are cached and refreshed ahead of expiry
+        token = azure_auth.token_manager.get_token(
+            tenant_id, client_id, client_secret, azure_settings['endpoint']
         )
-        token = credential.get_token('https://dicom.healthcareapis.azure.com/.default')
-        return f'Bearer {token.token}'
+        return f'Bearer {token}'
     except Exception as e:
         logging.error(f"Failed to get authentication token: {e}")
         raise
 
-def encode_multipart_related(fields, boundary=None):
-    """Encode multipart related content for DICOM STOW-RS"""
-    if boundary is None:
-        boundary = choose_boundary()
-    body, _ = encode_multipart_formdata(fields, boundary)
-    content_type = str('multipart/related; boundary=%s' % boundary)
-    return body, content_type
+def search_cache_principal(azure_settings):
+    """Credentials identity that scopes cached search results"""
+    return (azure_settings.get('tenant_id') or '', azure_settings.get('client_id') or '')
 
-def search_dicom_studies():
-    """Search for studies in the DICOM service"""
-    try:
-        azure_settings = get_azure_settings()
-        base_url = azure_settings['endpoint']
-        if not base_url:
-            raise ValueError("AZURE_DICOM_ENDPOINT not configured in session settings")
-            
-        headers = {"Authorization": get_bearer_token()}
-        url = f'{base_url}/v2/studies'
-        
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            studies = response.json()
-            # Return tuple (success, studies_list)
-            return True, studies if studies else []
-        else:
-            logging.error(f"Failed to search studies. Status code: {response.status_code}")
-            return False, []
-    except Exception as e:
-        logging.error(f"Error searching DICOM studies: {e}")
-        return False, []
+def search_dicom_studies(offset=0, limit=None):
+    """Search for studies in the DICOM service, one page at a time"""
+    return search_studies({}, offset=offset, limit=limit)
 
 def search_study_by_uid(study_instance_uid):
     """Search for a specific study by Study Instance UID in the DICOM service"""
@@ -314,34 +365,33 @@ def search_study_by_uid(study_instance_uid):
         if not base_url:
             raise ValueError("AZURE_DICOM_ENDPOINT not configured in session settings")
             
-        headers = {"Authorization": get_bearer_token()}
-        url = f'{base_url}/v2/studies/{study_instance_uid}'
+        # Authenticate before the cache lookup, so cached results are never served to bad credentials
+        authorization = get_bearer_token(azure_settings)
+        cache_key = query_cache.make_key(
+            base_url, 'study', {'StudyInstanceUID': study_instance_uid}, search_cache_principal(azure_settings)
+        )
+        cached, result = query_cache.study_search_cache.get(cache_key)
+        if cached:
+            return result
+        
+        client = dicomweb.get_client(base_url)
         
         # First try to get study metadata to check if it exists
-        metadata_url = f'{base_url}/v2/studies/{study_instance_uid}/metadata'
+        metadata_url = client.url(f'/v2/studies/{study_instance_uid}/metadata')
         headers_json = {
-            "Authorization": headers["Authorization"],
+            "Authorization": authorization,
             "Accept": "application/dicom+json"
         }
         
-        response = requests.get(metadata_url, headers=headers_json)
+        response = client.get(metadata_url, headers=headers_json)
         if response.status_code == 200:
             # Study exists, parse the metadata
             metadata = response.json()
             if metadata and len(metadata) > 0:
                 # Extract study information from first instance metadata
-                first_instance = metadata[0]
-                study_data = {
-                    'study_instance_uid': study_instance_uid,
-                    'patient_name': first_instance.get('00100010', {}).get('Value', [''])[0],
-                    'patient_id': first_instance.get('00100020', {}).get('Value', [''])[0],
-                    'patient_birth_date': first_instance.get('00100030', {}).get('Value', [''])[0],
-                    'accession_number': first_instance.get('00080050', {}).get('Value', [''])[0],
-                    'study_description': first_instance.get('00081030', {}).get('Value', [''])[0],
-                    'referring_physician_name': first_instance.get('00080090', {}).get('Value', [''])[0],
-                    'study_date': first_instance.get('00080020', {}).get('Value', [''])[0],
-                    'study_time': first_instance.get('00080030', {}).get('Value', [''])[0]
-                }
+                study_data = dicomweb.parse_study_result(metadata[0])
+                study_data['study_instance_uid'] = study_instance_uid
+                query_cache.study_search_cache.set(cache_key, (True, [study_data]))
                 return True, [study_data]
             else:
                 return False, []
@@ -355,45 +405,52 @@ def search_study_by_uid(study_instance_uid):
         logging.error(f"Error searching for study by UID: {e}")
         return False, []
 
-def search_studies(search_params):
-    """Search for studies in the DICOM service using various parameters"""
+def search_studies(search_params, offset=0, limit=None):
+    """Search for studies in the DICOM service using various parameters
+
+    Only the displayed fields are requested; pass `limit` to fetch a single page
+    starting at `offset`. Successful results are cached for QUERY_CACHE_TTL seconds.
+    """
     try:
         azure_settings = get_azure_settings()
         base_url = azure_settings['endpoint']
         if not base_url:
             raise ValueError("AZURE_DICOM_ENDPOINT not configured in session settings")
+        
+        # Authenticate before the cache lookup, so cached results are never served to bad credentials
+        authorization = get_bearer_token(azure_settings)
+        cache_key = query_cache.make_key(
+            base_url, 'studies', dict(search_params, offset=offset, limit=limit), search_cache_principal(azure_settings)
+        )
+        cached, result = query_cache.study_search_cache.get(cache_key)
+        if cached:
+            return result
             
         headers = {
-            "Authorization": get_bearer_token(),
+            "Authorization": authorization,
             "Accept": "application/dicom+json"
         }
         
-        url = f'{base_url}/v2/studies'
+        client = dicomweb.get_client(base_url)
+        url = client.url('/v2/studies')
         
-        logging.info(f"Searching studies with params: {search_params}")
-        response = requests.get(url, headers=headers, params=search_params)
+        params = dict(search_params)
+        params['includefield'] = ','.join(dicomweb.STUDY_RESULT_FIELDS.values())
+        if limit:
+            params['limit'] = limit
+            params['offset'] = offset
         
-        if response.status_code == 200:
-            data = response.json()
-            studies = []
-            
+        logging.info(f"Searching studies with params: {params}")
+        response = client.get(url, headers=headers, params=params)
+        
+        # 204 No Content means the query matched nothing
+        if response.status_code in (200, 204):
             # Parse the response to extract study information
-            for item in data:
-                # Extract DICOM tags from the response
-                study_data = {
-                    'study_instance_uid': item.get('0020000D', {}).get('Value', [''])[0] if '0020000D' in item else '',
-                    'patient_name': item.get('00100010', {}).get('Value', [{}])[0].get('Alphabetic', '') if '00100010' in item else '',
-                    'patient_id': item.get('00100020', {}).get('Value', [''])[0] if '00100020' in item else '',
-                    'patient_birth_date': item.get('00100030', {}).get('Value', [''])[0] if '00100030' in item else '',
-                    'accession_number': item.get('00080050', {}).get('Value', [''])[0] if '00080050' in item else '',
-                    'study_description': item.get('00081030', {}).get('Value', [''])[0] if '00081030' in item else '',
-                    'referring_physician_name': item.get('00080090', {}).get('Value', [{}])[0].get('Alphabetic', '') if '00080090' in item else '',
-                    'study_date': item.get('00080020', {}).get('Value', [''])[0] if '00080020' in item else '',
-                    'study_time': item.get('00080030', {}).get('Value', [''])[0] if '00080030' in item else ''
-                }
-                studies.append(study_data)
+            data = response.json() if response.content else []
+            studies = [dicomweb.parse_study_result(item) for item in data]
             
             logging.info(f"Found {len(studies)} studies")
+            query_cache.study_search_cache.set(cache_key, (True, studies))
             return True, studies
         else:
             logging.error(f"Failed to search studies. Status code: {response.status_code}, Response: {response.text}")
@@ -402,81 +459,114 @@ def search_studies(search_params):
         logging.error(f"Error searching studies: {e}")
         return False, []
 
+# QIDO-RS attributes the study searches filter on
+SEARCH_FILTER_FIELDS = ('StudyInstanceUID', 'PatientName', 'PatientID', 'PatientBirthDate', 'AccessionNumber')
+
+def invalidate_cached_searches(base_url, study_attributes):
+    """Drop cached remote searches whose results could now include an uploaded study
+
+    Every QIDO-RS search of the endpoint is dropped, since wildcard, fuzzy and
+    range queries cannot be matched against the study reliably; UID lookups are
+    dropped only for the study itself.
+    """
+    endpoint = base_url.rstrip('/')
+    
+    def is_affected(key, value):
+        key_endpoint, _, kind, params = key
+        if key_endpoint != endpoint:
+            return False
+        if kind == 'study':
+            return dict(params).get('StudyInstanceUID') == study_attributes.get('StudyInstanceUID')
+        return True
+    
+    removed = query_cache.study_search_cache.invalidate(is_affected)
+    logging.debug(f"Invalidated {removed} cached study search(es) after upload")
+
 def generate_random_study_instance_uid():
     """Generate a new Study Instance UID"""
     return generate_uid(prefix='1.2.528.1.1036.')
 
-def upload_study_to_dicom(study_path):
+def upload_study_to_dicom(study_path, azure_settings, progress=None, cancel=None):
     """Upload a local study to the DICOM service using STOW-RS"""
     try:
-        azure_settings = get_azure_settings()
         base_url = azure_settings.get("endpoint")
         if not base_url:
             raise ValueError("AZURE_DICOM_ENDPOINT not configured")
             
-        headers = {"Authorization": get_bearer_token()}
+        client = dicomweb.get_client(base_url)
+        headers = {"Authorization": get_bearer_token(azure_settings)}
         study_instance_uid = generate_random_study_instance_uid()
-        url = f'{base_url}/v2/studies/{study_instance_uid}'
+        url = client.url(f'/v2/studies/{study_instance_uid}')
         headers['Accept'] = 'application/dicom+json'
         
-        parts = {}
         dicom_files = get_dicom_files(study_path)
-        
-        for file_path in dicom_files:
-            dicom_file = pydicom.dcmread(file_path, force=True)
-            dicom_file.StudyInstanceUID = study_instance_uid
-            
-            with BytesIO() as buffer:
-                dicom_file.save_as(buffer)
-                buffer.seek(0)
-                file_name = os.path.basename(file_path)
-                parts[file_name] = ('dicomfile', buffer.read(), 'application/dicom')
-        
-        body, content_type = encode_multipart_related(fields=parts)
-        headers['Content-Type'] = content_type
-        
-        response = requests.post(url, data=body, headers=headers, verify=True)
-        return response.status_code in [200, 202]
+
+        def assign_study_uid(ds):
+            ds.StudyInstanceUID = study_instance_uid
+
+        # Instances are streamed from disk in batches over concurrent connections
+        report = dicomweb.upload_in_batches(
+            client, url, headers, dicom_files, rewrite=assign_study_uid, progress=progress, cancel=cancel
+        )
+        report['study_instance_uid'] = study_instance_uid
+        if report['uploaded_instances'] and dicom_files:
+            study_attributes = dicom_headers.read_header_values(dicom_files[0], SEARCH_FILTER_FIELDS)
+            study_attributes['StudyInstanceUID'] = study_instance_uid
+            invalidate_cached_searches(base_url, study_attributes)
+        logging.info(
+            f"Uploaded {report['uploaded_instances']}/{report['instances']} instance(s) of '{study_path}' "
+            f"in {report['batches']} batch(es), {report['failed_batches']} failed",
+            extra={'study': os.path.basename(study_path), 'bytes': report['bytes'],
+                   'instances': report['uploaded_instances']}
+        )
+        return report['success'], report
     except Exception as e:
         logging.error(f"Error uploading study to DICOM service: {e}")
-        return False
+        return False, {'error': str(e)}
 
 @app.route("/fetch-dicom-studies")
 def fetch_dicom_studies():
-    """Fetch studies from DICOM service and display them"""
+    """Fetch the first page of studies from DICOM service; further pages load as the list scrolls"""
     try:
-        success, studies = search_dicom_studies()
-        dicom_studies = []
+        page_size = config.QIDO_PAGE_SIZE
+        success, dicom_studies = search_dicom_studies(offset=0, limit=page_size)
         
         if not success:
             flash("Error connecting to DICOM service or retrieving studies.", "error")
             return redirect(url_for('index'))
         
-        for study in studies:
-            study_data = {
-                'study_instance_uid': study.get('0020000D', {}).get('Value', [''])[0],
-                'patient_name': study.get('00100010', {}).get('Value', [''])[0],
-                'patient_id': study.get('00100020', {}).get('Value', [''])[0],
-                'patient_birth_date': study.get('00100030', {}).get('Value', [''])[0],
-                'accession_number': study.get('00080050', {}).get('Value', [''])[0],
-                'study_description': study.get('00081030', {}).get('Value', [''])[0],
-                'referring_physician_name': study.get('00080090', {}).get('Value', [''])[0],
-                'study_date': study.get('00080020', {}).get('Value', [''])[0],
-                'study_time': study.get('00080030', {}).get('Value', [''])[0]
-            }
-            dicom_studies.append(study_data)
-        
         # Add info message if search was successful but no studies found
-        if success and len(studies) == 0:
+        if success and len(dicom_studies) == 0:
             flash("Successfully connected to DICOM service, but no studies were found.", "info")
         
         return render_template("select.html", 
                              studies=get_local_studies_with_metadata(), 
-                             dicom_studies=dicom_studies)
+                             dicom_studies=dicom_studies,
+                             dicom_next_offset=len(dicom_studies) if len(dicom_studies) == page_size else None,
+                             dicom_query={})
     except Exception as e:
         flash(f"Error fetching DICOM studies: {str(e)}", "error")
         return redirect(url_for('index'))
 
+@app.route("/api/dicom-studies")
+def dicom_studies_page():
+    """JSON page of DICOM service studies for incremental loading"""
+    # Always a bounded page: limit=0 would make search_studies send an unpaged query
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', config.QIDO_PAGE_SIZE, type=int), 1), config.QIDO_MAX_PAGE_SIZE)
+    search_params = {
+        key: value for key, value in request.args.items()
+        if key in SEARCH_FILTER_FIELDS or key == 'fuzzymatching'
+    }
+    
+    success, studies = search_studies(search_params, offset=offset, limit=limit)
+    if not success:
+        return jsonify({'error': 'Error connecting to DICOM service or retrieving studies.'}), 502
+    return jsonify({
+        'studies': studies,
+        'next_offset': offset + len(studies) if len(studies) == limit else None
+    })
+
 @app.route("/search-study-by-uid", methods=["POST"])
 def search_study_by_uid_route():
     """Route to search for a specific study by Study Instance UID"""
@@ -546,13 +636,17 @@ def advanced_search_route():
             flash("Invalid search type", "error")
             return redirect(url_for('index'))
         
-        success, studies = search_studies(search_params)
+        page_size = config.QIDO_PAGE_SIZE
+        success, studies = search_studies(search_params, offset=0, limit=page_size)
+        has_more = len(studies) == page_size
         
         if success and studies:
-            flash(f"Found {len(studies)} study/studies matching {flash_field}: {search_value}", "success")
+            flash(f"Found {len(studies)}{'+' if has_more else ''} study/studies matching {flash_field}: {search_value}", "success")
             return render_template("select.html", 
                                  studies=get_local_studies_with_metadata(), 
-                                 dicom_studies=studies)
+                                 dicom_studies=studies,
+                                 dicom_next_offset=len(studies) if has_more else None,
+                                 dicom_query=search_params)
         elif success and not studies:
             flash(f"No studies found matching {flash_field}: {search_value}", "info")
             return redirect(url_for('index'))
@@ -575,38 +669,42 @@ def upload_study(study):
             flash(f"Study '{study}' not found", "error")
             return redirect(url_for('index'))
         
-        # Check if study is valid for upload
-        dicom_files = get_dicom_files(study_path)
-        if dicom_files:
-            try:
-                sample = pydicom.dcmread(dicom_files[0], force=True)
-                metadata = {
-                    'StudyInstanceUID': str(getattr(sample, "StudyInstanceUID", "")).strip(),
-                    'PatientName': str(getattr(sample, "PatientName", "")).strip(),
-                    'PatientID': str(getattr(sample, "PatientID", "")).strip(),
-                    'AccessionNumber': str(getattr(sample, "AccessionNumber", "")).strip()
-                }
-                
-                if not is_study_valid_for_upload(metadata):
-                    flash(f"Study '{study}' cannot be uploaded: missing required fields (Study Instance UID, Patient Name, Patient ID, or Accession Number)", "error")
-                    return redirect(url_for('index'))
-            except Exception as e:
-                flash(f"Error validating study '{study}': {str(e)}", "error")
-                return redirect(url_for('index'))
-        else:
-            flash(f"Study '{study}' has no DICOM files", "error")
+        # Every instance is checked, so inconsistent studies are rejected before anything is sent
+        report = integrity.check_study(study_path)
+        if not report['ok']:
+            for problem in report['problems'][:5]:
+                flash(f"Study '{study}' cannot be uploaded: {problem}", "error")
             return redirect(url_for('index'))
         
-        success = upload_study_to_dicom(study_path)
-        if success:
-            flash(f"Study '{study}' successfully uploaded to DICOM service", "success")
-        else:
-            flash(f"Failed to upload study '{study}' to DICOM service", "error")
+        job = jobs.job_manager.submit(
+            'upload', f"Upload study '{study}'", upload_study_job, study, study_path, get_azure_settings()
+        )
+        flash(f"[STARTED] Uploading study '{study}' to DICOM service in the background (job {job.id})", "info")
+        return redirect(url_for('view_jobs', job=job.id))
     except Exception as e:
         flash(f"Error uploading study: {str(e)}", "error")
     
     return redirect(url_for('index'))
 
+@app.route("/api/integrity/<study>")
+def study_integrity(study):
+    """Full-study consistency report (UIDs and required fields of every instance), cached until the study changes"""
+    study_path = os.path.join(get_dicom_root(), study)
+    if not os.path.isdir(study_path):
+        return jsonify({'error': f"Study '{study}' not found"}), 404
+    return jsonify(integrity.check_study(study_path, use_cache=request.args.get('refresh') != '1'))
+
+def upload_study_job(study, study_path, azure_settings, progress=None, cancel=None):
+    """Background job: upload a local study and summarise the outcome"""
+    success, report = upload_study_to_dicom(study_path, azure_settings, progress, cancel)
+    if success:
+        return True, f"Study '{study}' successfully uploaded to DICOM service ({report['uploaded_instances']} instances in {report['batches']} batch(es))"
+    if report.get('cancelled_batches'):
+        return False, f"Upload of study '{study}' cancelled: {report['uploaded_instances']} of {report['instances']} instances uploaded"
+    if 'batches' in report:
+        return False, f"Failed to upload study '{study}' to DICOM service: {report['failed_batches']} of {report['batches']} batch(es) failed"
+    return False, f"Failed to upload study '{study}' to DICOM service: {report.get('error', 'unknown error')}"
+
 def get_local_studies_with_files():
     """Get local studies with their files (existing functionality)"""
     current_settings = get_current_settings()
@@ -622,155 +720,197 @@ def get_local_studies_with_files():
 
 def is_study_valid_for_upload(study_metadata):
     """Check if a study has the required metadata fields for upload to DICOM service"""
-    required_fields = ['StudyInstanceUID', 'PatientName', 'PatientID', 'AccessionNumber']
-    
-    for field in required_fields:
-        value = study_metadata.get(field, '').strip()
-        if not value or value.lower() == 'n/a':
-            return False
-    
-    return True
+    return not any(integrity.is_missing(study_metadata.get(field, '')) for field in integrity.REQUIRED_FIELDS)
 
 def get_local_studies_with_metadata():
-    """Get local studies with their metadata for display"""
+    """Get local studies with their metadata for display (served from the study catalog)"""
     studies = get_all_studies()
-    studies_with_metadata = {}
     current_settings = get_current_settings()
     dicom_root = current_settings['DICOM_ROOT']
-    
+
+    catalogued = catalog.get_studies(dicom_root, studies)
+    studies_with_metadata = {}
+
     for study in studies:
-        study_path = os.path.join(dicom_root, study)
-        dicom_files = get_dicom_files(study_path)
-        files_list = [
-            os.path.relpath(path, dicom_root)
-            for path in dicom_files
-        ]
-        
-        # Calculate series and image counts
-        series_count = 0
-        image_count = len(dicom_files)
-        
-        # Count unique series by examining the folder structure
-        # Series are typically organized in separate folders
-        series_folders = set()
-        for file_path in dicom_files:
-            # Get the parent directory name (series folder)
-            relative_path = os.path.relpath(file_path, study_path)
-            series_folder = os.path.dirname(relative_path)
-            if series_folder:  # Only count if there's actually a series folder
-                series_folders.add(series_folder)
-        
-        series_count = len(series_folders) if series_folders else 1  # At least 1 series if files exist
-        
-        # Extract metadata from first DICOM file
-        metadata = {
-            'PatientName': '',
-            'PatientID': '',
-            'StudyDescription': '',
-            'AccessionNumber': '',
-            'ReferringPhysicianName': '',
-            'StudyInstanceUID': ''
-        }
-        
-        if dicom_files:
-            try:
-                sample = pydicom.dcmread(dicom_files[0], force=True)
-                metadata['PatientName'] = str(getattr(sample, "PatientName", "")).strip()
-                metadata['PatientID'] = str(getattr(sample, "PatientID", "")).strip()
-                metadata['StudyDescription'] = str(getattr(sample, "StudyDescription", "")).strip()
-                metadata['AccessionNumber'] = str(getattr(sample, "AccessionNumber", "")).strip()
-                metadata['ReferringPhysicianName'] = str(getattr(sample, "ReferringPhysicianName", "")).strip()
-                metadata['StudyInstanceUID'] = str(getattr(sample, "StudyInstanceUID", "")).strip()
-            except Exception as e:
-                logging.warning(f"Failed to read metadata for study {study}: {e}")
-        
-        studies_with_metadata[study] = {
-            'files': files_list,
-            'metadata': metadata,
-            'is_valid_for_upload': is_study_valid_for_upload(metadata),
-            'series_count': series_count,
-            'image_count': image_count
-        }
-    
+        study_data = catalogued.get(study)
+        if study_data is None:
+            continue
+        study_data['is_valid_for_upload'] = is_study_valid_for_upload(study_data['metadata'])
+        studies_with_metadata[study] = study_data
+
     return studies_with_metadata
 
-def retrieve_study_from_dicom(study_instance_uid):
+def retrieve_study_from_dicom(study_instance_uid, azure_settings, dicom_root, progress=None, cancel=None):
     """Download a study from DICOM service to local storage"""
     try:
-        azure_settings = get_azure_settings()
         base_url = azure_settings.get("endpoint")
         if not base_url:
             raise ValueError("AZURE_DICOM_ENDPOINT not configured")
             
-        headers = {"Authorization": get_bearer_token()}
-        url = f'{base_url}/v2/studies/{study_instance_uid}'
+        client = dicomweb.get_client(base_url)
+        headers = {"Authorization": get_bearer_token(azure_settings)}
+        url = client.url(f'/v2/studies/{study_instance_uid}')
         headers['Accept'] = 'multipart/related; type="application/dicom"; transfer-syntax=*'
         
-        logging.debug(f"Retrieving study from URL: {url}")
-        flash("[STARTED] Starting download DICOM study to local. Please be patient.", "info")
-        response = requests.get(url, headers=headers)
+        # Use only Study Instance UID as folder name
+        folder_name = str(study_instance_uid).replace('.', '_')
+        folder_name = sanitize_filename(folder_name)
+        study_folder = os.path.join(dicom_root, folder_name)
+        progress = progress or dicomweb.TransferProgress()
         
-        if response.status_code == 200:
-            # Use only Study Instance UID as folder name
-            folder_name = str(study_instance_uid).replace('.', '_')
-            folder_name = sanitize_filename(folder_name)
-            
-            # Create local study folder
-            current_settings = get_current_settings()
-            study_folder = os.path.join(current_settings['DICOM_ROOT'], folder_name)
+        # Split large studies into per-series (or per-instance) requests fetched in parallel
+        item_urls = []
+        if config.DOWNLOAD_WORKERS > 1:
+            item_urls = list_retrieval_items(client, study_instance_uid, headers["Authorization"])
+        
+        if len(item_urls) > 1:
             os.makedirs(study_folder, exist_ok=True)
+            progress.set_totals(items=len(item_urls))
+            failed = retrieve_items_parallel(client, item_urls, headers, study_folder, progress, cancel)
+            stats = progress.snapshot()
+            if cancel is not None and cancel.is_set():
+                return False, f"Download cancelled after {stats['instances']} files were saved to {folder_name}"
+            if failed:
+                return False, f"Study partially downloaded to {folder_name}: {stats['instances']} files, {len(failed)} of {len(item_urls)} request(s) failed"
+            return True, f"Study downloaded successfully with {stats['instances']} files to {folder_name}"
+        
+        logging.debug(f"Retrieving study from URL: {url}")
+        progress.set_totals(items=1)
+        retrieve_multipart_to_folder(client, url, headers, study_folder, progress, cancel)
+        if cancel is not None and cancel.is_set():
+            return False, f"Download cancelled after {progress.instances} files were saved to {folder_name}"
+        return True, f"Study downloaded successfully with {progress.instances} files to {folder_name}"
             
-            # Get metadata first
-            metadata_url = f'{base_url}/v2/studies/{study_instance_uid}/metadata'
-            metadata_headers = {'Accept': 'application/dicom+json', "Authorization": headers["Authorization"]}
-            metadata_response = requests.get(metadata_url, headers=metadata_headers)
-            
-            if metadata_response.status_code == 200:
-                metadata = metadata_response.json()
-                logging.debug(f"Retrieved metadata for {len(metadata)} instances")
-            else:
-                logging.error(f"Failed to retrieve metadata. Status code: {metadata_response.status_code}")
-                return False, "Failed to retrieve study metadata"
-            
-            # Parse multipart response to extract DICOM files
-            mpd = tb.MultipartDecoder.from_response(response)
-            series_folders = {}
-            file_count = 0
-            
-            for part in mpd.parts:
-                if b'application/dicom' in part.headers[b'Content-Type']:
-                    dicom_file = pydicom.dcmread(BytesIO(part.content), force=True)
-                    
-                    # Create series folder if it doesn't exist
-                    series_uid = getattr(dicom_file, 'SeriesInstanceUID', 'unknown_series')
-                    series_number = getattr(dicom_file, 'SeriesNumber', '00000')
-                    series_folder_name = f"series-{str(series_number).zfill(5)}"
-                    
-                    if series_folder_name not in series_folders:
-                        series_folder_path = os.path.join(study_folder, series_folder_name)
-                        os.makedirs(series_folder_path, exist_ok=True)
-                        series_folders[series_folder_name] = series_folder_path
-                    
-                    # Save DICOM file
-                    instance_number = getattr(dicom_file, 'InstanceNumber', file_count)
-                    file_name = f"image-{str(instance_number).zfill(5)}.dcm"
-                    file_path = os.path.join(series_folders[series_folder_name], file_name)
-                    
-                    dicom_file.save_as(file_path)
-                    file_count += 1
-                    
-                    logging.debug(f"Saved DICOM file: {file_path}")
-            
-            return True, f"Study downloaded successfully with {file_count} files to {folder_name}"
-            
-        else:
-            logging.error(f"Failed to retrieve study. Status code: {response.status_code}")
-            return False, f"Failed to retrieve study from DICOM service (Status: {response.status_code})"
-            
+    except requests.HTTPError as e:
+        status_code = e.response.status_code
+        logging.error(f"Failed to retrieve study. Status code: {status_code}")
+        return False, f"Failed to retrieve study from DICOM service (Status: {status_code})"
     except Exception as e:
         logging.error(f"Error retrieving study from DICOM service: {e}")
         return False, f"Error downloading study: {str(e)}"
 
+def retrieve_multipart_to_folder(client, url, headers, study_folder, progress, cancel=None):
+    """Stream one WADO-RS multipart response into a study folder, part by part
+
+    Stops after the current part once `cancel` is set. If the response fails
+    part-way, the instances it already counted are taken back out of `progress`
+    so that a retry of the same URL does not count them twice.
+    """
+    counted, counted_bytes = 0, 0
+    try:
+        response = client.get(url, headers=headers, stream=True)
+        with response:
+            response.raise_for_status()
+            os.makedirs(study_folder, exist_ok=True)
+            
+            # Each part goes straight to a temp file; only its naming tags are read back
+            boundary = dicomweb.get_boundary(response.headers.get('Content-Type', ''))
+            chunks = response.iter_content(chunk_size=config.DOWNLOAD_CHUNK_SIZE)
+            for part_headers, temp_path in dicomweb.iter_multipart_parts(chunks, boundary, study_folder):
+                if cancel is not None and cancel.is_set():
+                    os.remove(temp_path)
+                    break
+                if 'application/dicom' not in part_headers.get('content-type', ''):
+                    os.remove(temp_path)
+                    continue
+                size = os.path.getsize(temp_path)
+                index = progress.add_instance(size)
+                counted += 1
+                counted_bytes += size
+                metrics.TRANSFER_INSTANCES.inc('download')
+                metrics.TRANSFER_BYTES.inc('download', amount=size)
+                store_retrieved_instance(temp_path, study_folder, index)
+    except Exception:
+        progress.remove_instances(counted, counted_bytes)
+        raise
+
+def list_retrieval_items(client, study_instance_uid, authorization):
+    """List the WADO-RS URLs to fetch a study in parallel: one per series, or one per
+    instance when the study has fewer series than download workers"""
+    headers = {"Authorization": authorization, "Accept": "application/dicom+json"}
+    study_url = client.url(f'/v2/studies/{study_instance_uid}')
+    
+    try:
+        response = client.get(f'{study_url}/series', headers=headers)
+        response.raise_for_status()
+        series_uids = [
+            item['0020000E']['Value'][0]
+            for item in response.json()
+            if item.get('0020000E', {}).get('Value')
+        ]
+    except (requests.RequestException, ValueError) as e:
+        logging.warning(f"Could not list series for parallel download ({e}), using a single request")
+        return []
+    series_urls = [f'{study_url}/series/{series_uid}' for series_uid in series_uids]
+    if len(series_urls) >= config.DOWNLOAD_WORKERS:
+        return series_urls
+    
+    instance_urls = []
+    for series_uid, series_url in zip(series_uids, series_urls):
+        try:
+            response = client.get(f'{series_url}/instances', headers=headers)
+            response.raise_for_status()
+            instance_urls.extend(
+                f'{series_url}/instances/{item["00080018"]["Value"][0]}'
+                for item in response.json()
+                if item.get('00080018', {}).get('Value')
+            )
+        except (requests.RequestException, ValueError):
+            return series_urls
+    return instance_urls
+
+def retrieve_items_parallel(client, item_urls, headers, study_folder, progress, cancel=None):
+    """Fetch WADO-RS URLs over a bounded worker pool, retrying each item; returns failed URLs"""
+    def fetch(item_url):
+        for attempt in range(config.DOWNLOAD_RETRIES + 1):
+            if cancel is not None and cancel.is_set():
+                return False
+            try:
+                retrieve_multipart_to_folder(client, item_url, headers, study_folder, progress, cancel)
+                progress.item_done()
+                stats = progress.snapshot()
+                logging.debug(f"Downloaded {stats['items_done']}/{stats['items_total']} item(s), {stats['instances']} instance(s), {stats['bytes']} bytes")
+                return True
+            except (requests.RequestException, ValueError) as e:
+                response = getattr(e, 'response', None)
+                if response is not None and response.status_code not in dicomweb.RETRYABLE_STATUS_CODES:
+                    logging.error(f"Failed to retrieve {item_url}: {e}")
+                    return False
+                if attempt < config.DOWNLOAD_RETRIES:
+                    delay = dicomweb.retry_delay(attempt, response, config.DOWNLOAD_RETRY_BACKOFF)
+                    logging.warning(f"Retrieving {item_url} failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                else:
+                    logging.error(f"Failed to retrieve {item_url} after {attempt + 1} attempt(s): {e}")
+        return False
+    
+    with ThreadPoolExecutor(max_workers=config.DOWNLOAD_WORKERS) as executor:
+        results = list(executor.map(fetch, item_urls))
+    return [item_url for item_url, ok in zip(item_urls, results) if not ok]
+
+def store_retrieved_instance(temp_path, study_folder, file_count):
+    """Move a retrieved instance into its series folder, named from its header tags"""
+    try:
+        # Only the naming tags are parsed; the part is stored byte-for-byte
+        dicom_file = dicom_headers.read_header(temp_path, ['SeriesNumber', 'InstanceNumber'])
+    except Exception:
+        os.remove(temp_path)
+        raise
+    
+    # Create series folder if it doesn't exist
+    series_number = getattr(dicom_file, 'SeriesNumber', '00000')
+    series_folder_path = os.path.join(study_folder, f"series-{str(series_number).zfill(5)}")
+    os.makedirs(series_folder_path, exist_ok=True)
+    
+    # Save DICOM file
+    instance_number = getattr(dicom_file, 'InstanceNumber', file_count)
+    file_name = f"image-{str(instance_number).zfill(5)}.dcm"
+    file_path = os.path.join(series_folder_path, file_name)
+    os.replace(temp_path, file_path)
+    
+    logging.debug(f"Saved DICOM file: {file_path}")
+    return file_path
+
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename for safe folder creation"""
     invalid_chars = '<>:"/\\|?*'
@@ -782,11 +922,12 @@ def sanitize_filename(filename: str) -> str:
 def download_study(study_instance_uid):
     """Download a study from DICOM service to local storage"""
     try:
-        success, message = retrieve_study_from_dicom(study_instance_uid)
-        if success:
-            flash(message, "success")
-        else:
-            flash(message, "error")
+        job = jobs.job_manager.submit(
+            'download', f"Download study {study_instance_uid}", retrieve_study_from_dicom,
+            study_instance_uid, get_azure_settings(), get_dicom_root()
+        )
+        flash(f"[STARTED] Downloading DICOM study to local in the background (job {job.id})", "info")
+        return redirect(url_for('view_jobs', job=job.id))
     except Exception as e:
         flash(f"Error downloading study: {str(e)}", "error")
     
@@ -885,23 +1026,142 @@ def delete_study(study):
 
 @app.route("/view-logs")
 def view_logs():
-    """Display the application log file"""
+    """Display the most recent records of the application log, optionally filtered by level and text"""
+    level = request.args.get('level', '')
+    text = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', config.LOG_TAIL_LINES)), 1), 10000)
+    except ValueError:
+        limit = config.LOG_TAIL_LINES
     log_content = []
     try:
-        if os.path.exists('dicom_editor.log'):
-            with open('dicom_editor.log', 'r', encoding='utf-8') as f:
-                log_content = f.readlines()
-                # Get last 500 lines to avoid huge pages
-                log_content = log_content[-500:] if len(log_content) > 500 else log_content
-                # Strip newlines for cleaner display
-                log_content = [line.rstrip() for line in log_content]
+        if os.path.exists(config.LOG_FILE):
+            log_content = log_tail.tail(config.LOG_FILE, limit, log_tail.LogFilter(level, text))
         else:
             flash("Log file not found", "warning")
     except Exception as e:
         flash(f"Error reading log file: {str(e)}", "error")
         logging.error(f"Error reading log file: {e}")
     
-    return render_template('logfile.html', log_content=log_content)
+    return render_template('logfile.html', log_content=log_content, profiles=profiling.list_profiles(limit=20),
+                           profile_budget=profiling.budget.remaining(), levels=log_tail.LEVELS,
+                           level=level.upper(), text=text, limit=limit)
+
+@app.route("/logs/stream")
+def stream_logs():
+    """Server-Sent Events stream of new log lines, filtered like the log viewer"""
+    log_filter = log_tail.LogFilter(request.args.get('level'), request.args.get('q'))
+    
+    def events():
+        for line in log_tail.follow(config.LOG_FILE, log_filter):
+            # A comment line keeps idle connections open and surfaces disconnected clients
+            yield ': keep-alive\n\n' if line is None else f"data: {line}\n\n"
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route("/profiles/<name>")
+def download_profile(name):
+    """Download a saved request profile (pstats format, e.g. for snakeviz or flameprof)"""
+    path = profiling.profile_path(name)
+    if path is None:
+        flash(f"Profile '{name}' not found", "error")
+        return redirect(url_for('view_logs'))
+    return send_file(path, as_attachment=True, download_name=name, mimetype='application/octet-stream')
+
+@app.route("/profiles/<name>/summary")
+def profile_summary(name):
+    """Top functions of a saved request profile as plain text"""
+    path = profiling.profile_path(name)
+    if path is None:
+        flash(f"Profile '{name}' not found", "error")
+        return redirect(url_for('view_logs'))
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        sort = 'cumulative'
+    return profiling.summarize(path, sort), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+# Rule set shown when the bulk editing page is first opened
+EXAMPLE_RULE_SET = {
+    "filters": {"Modality": ["CT", "MR"]},
+    "rules": [
+        {"action": "set", "keyword": "PatientName", "value": "ANONYMOUS"},
+        {"action": "delete", "keyword": "PatientBirthDate"},
+        {"action": "hash", "keyword": "PatientID", "salt": "change-me", "length": 16}
+    ]
+}
+
+@app.route("/bulk-edit", methods=["GET", "POST"])
+def bulk_edit():
+    """Run a declarative rule set over the local archive as a background job"""
+    if request.method == "GET":
+        return render_template("bulk_edit.html", rules_text=json.dumps(EXAMPLE_RULE_SET, indent=2), dry_run=True)
+    
+    rules_text = request.form.get('rules', '')
+    dry_run = bool(request.form.get('dry_run'))
+    try:
+        rule_set = bulk_rules.parse_rule_set(rules_text)
+    except ValueError as e:
+        flash(f"Invalid rule set: {e}", "error")
+        return render_template("bulk_edit.html", rules_text=rules_text, dry_run=dry_run)
+    
+    job = jobs.job_manager.submit(
+        'bulk-edit', f"Bulk edit{' (dry run)' if dry_run else ''}: {len(rule_set['rules'])} rule(s)",
+        bulk_edit_job, get_dicom_root(), rule_set, get_all_studies(), dry_run
+    )
+    flash(f"[STARTED] Applying rules in the background (job {job.id})", "info")
+    return redirect(url_for('view_jobs', job=job.id))
+
+def bulk_edit_job(dicom_root, rule_set, studies, dry_run, progress=None, cancel=None):
+    """Background job: run the bulk editing pipeline and summarise its report"""
+    report = bulk_rules.run_pipeline(dicom_root, rule_set, studies, dry_run=dry_run, progress=progress, cancel=cancel)
+    throughput = f"{report['files_per_second']:.1f} files/s, {report['mb_per_second']:.1f} MB/s"
+    verb = "would change" if dry_run else "changed"
+    message = (
+        f"{report['changed']} of {report['matched']} matching file(s) {verb} in "
+        f"{len(report['studies_changed'])} study(ies) ({throughput})"
+    )
+    if report['failed']:
+        message += f"; {report['failed']} failed, e.g. {report['errors'][0]}"
+    return report['failed'] == 0, message
+
+@app.route("/jobs")
+def view_jobs():
+    """Recent background jobs with live progress"""
+    return render_template("jobs.html", jobs=jobs.job_manager.list(), highlight=request.args.get('job'))
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Progress of one background job (polled by the jobs page)"""
+    job = jobs.job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    """Ask a queued or running job to stop"""
+    if not jobs.job_manager.cancel(job_id):
+        return jsonify({'error': f"Job '{job_id}' is not running"}), 409
+    return jsonify(jobs.job_manager.get(job_id))
+
+@app.route("/api/dicomweb-stats")
+def dicomweb_stats():
+    """Connection pool reuse counters for the DICOMweb clients and search cache counters"""
+    return jsonify({
+        'clients': dicomweb.get_client_stats(),
+        'query_cache': query_cache.study_search_cache.stats()
+    })
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request, pydicom, transfer, token and cache metrics in the Prometheus text format"""
+    if not metrics.enabled:
+        return "Metrics are disabled (METRICS_ENABLED=false)\n", 404, {'Content-Type': 'text/plain'}
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
 
 @app.route("/view-settings")
 def view_settings():
@@ -919,7 +1179,8 @@ def update_settings():
             'AZURE_TENANT_ID': request.form.get('AZURE_TENANT_ID', '').strip(),
             'AZURE_DICOM_ENDPOINT': request.form.get('AZURE_DICOM_ENDPOINT', '').strip(),
             'AZURE_DICOM_CLIENT_ID': request.form.get('AZURE_DICOM_CLIENT_ID', '').strip(),
-            'AZURE_DICOM_SECRET': request.form.get('AZURE_DICOM_SECRET', '').strip()
+            'AZURE_DICOM_SECRET': request.form.get('AZURE_DICOM_SECRET', '').strip(),
+            'PROFILING': bool(request.form.get('PROFILING'))
         }
         
         # Validate required fields
@@ -975,20 +1236,12 @@ def delete_tag(file_path):
             flash("No tag specified for deletion", "error")
             return redirect(url_for('edit_file', file_path=file_path))
         
-        # Define protected tags that should not be deleted
-        protected_tags = {
-            'SOPClassUID', 'SOPInstanceUID', 'StudyInstanceUID', 'SeriesInstanceUID',
-            'PatientID', 'PatientName', 'Modality', 'TransferSyntaxUID',
-            'MediaStorageSOPClassUID', 'MediaStorageSOPInstanceUID',
-            'ImplementationClassUID', 'SpecificCharacterSet'
-        }
-        
-        if tag_keyword in protected_tags:
+        if tag_keyword in tag_render.PROTECTED_TAGS:
             flash(f"Tag '{tag_keyword}' is protected and cannot be deleted", "error")
             return redirect(url_for('edit_file', file_path=file_path))
         
-        # Load and modify the DICOM file
-        ds = pydicom.dcmread(abs_path, force=True)
+        # Load and modify the DICOM header (pixel data is copied across untouched)
+        ds, pixel_offset = header_patch.load_header(abs_path)
         
         if not hasattr(ds, tag_keyword):
             flash(f"Tag '{tag_keyword}' not found in DICOM file", "warning")
@@ -998,7 +1251,8 @@ def delete_tag(file_path):
         delattr(ds, tag_keyword)
         
         # Save the modified file
-        ds.save_as(abs_path)
+        header_patch.save_header(ds, abs_path, pixel_offset)
+        catalog.invalidate_study(dicom_root, Path(file_path).parts[0])
         
         flash(f"Successfully deleted DICOM tag '{tag_keyword}'", "success")
         logging.info(f"Deleted DICOM tag '{tag_keyword}' from file: {file_path}")
@@ -1009,58 +1263,7 @@ def delete_tag(file_path):
     
     return redirect(url_for('edit_file', file_path=file_path))
 
-def search_study_by_uid(study_instance_uid):
-    """Search for a specific study by Study Instance UID in the DICOM service"""
-    try:
-        azure_settings = get_azure_settings()
-        base_url = azure_settings['endpoint']
-        if not base_url:
-            raise ValueError("AZURE_DICOM_ENDPOINT not configured in session settings")
-            
-        headers = {"Authorization": get_bearer_token()}
-        url = f'{base_url}/v2/studies/{study_instance_uid}'
-        
-        # First try to get study metadata to check if it exists
-        metadata_url = f'{base_url}/v2/studies/{study_instance_uid}/metadata'
-        headers_json = {
-            "Authorization": headers["Authorization"],
-            "Accept": "application/dicom+json"
-        }
-        
-        response = requests.get(metadata_url, headers=headers_json)
-        if response.status_code == 200:
-            # Study exists, parse the metadata
-            metadata = response.json()
-            if metadata and len(metadata) > 0:
-                # Extract study information from first instance metadata
-                first_instance = metadata[0]
-                study_data = {
-                    'study_instance_uid': study_instance_uid,
-                    'patient_name': first_instance.get('00100010', {}).get('Value', [''])[0],
-                    'patient_id': first_instance.get('00100020', {}).get('Value', [''])[0],
-                    'patient_birth_date': first_instance.get('00100030', {}).get('Value', [''])[0],
-                    'accession_number': first_instance.get('00080050', {}).get('Value', [''])[0],
-                    'study_description': first_instance.get('00081030', {}).get('Value', [''])[0],
-                    'referring_physician_name': first_instance.get('00080090', {}).get('Value', [''])[0],
-                    'study_date': first_instance.get('00080020', {}).get('Value', [''])[0],
-                    'study_time': first_instance.get('00080030', {}).get('Value', [''])[0]
-                }
-                return True, [study_data]
-            else:
-                return False, []
-        elif response.status_code == 404:
-            logging.info(f"Study with UID '{study_instance_uid}' not found in DICOM service")
-            return False, []
-        else:
-            logging.error(f"Failed to search for study. Status code: {response.status_code}")
-            return False, []
-    except Exception as e:
-        logging.error(f"Error searching for study by UID: {e}")
-        return False, []
-
 if __name__ == "__main__":
-    # Debug mode configuration
-    debug_mode = os.getenv('FLASK_DEBUG', '1') == '1'
     port = int(os.getenv('FLASK_RUN_PORT', 5001))
     host = os.getenv('FLASK_RUN_HOST', '127.0.0.1')
     
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+from azure.identity import ClientSecretCredential
+
+import config
+import metrics
+
+DICOM_SCOPE = 'https://dicom.healthcareapis.azure.com/.default'
+
+
+class _CacheEntry:
+    def __init__(self, client_secret):
+        self.lock = threading.Lock()
+        self.client_secret = client_secret
+        self.credential = None
+        self.token = None
+
+
+class TokenManager:
+    """Caches credentials and access tokens per (tenant, client_id, endpoint)
+
+    Tokens are refreshed `refresh_margin` seconds before they expire. Each key has
+    its own lock, so concurrent requests for the same service wait for a single
+    refresh instead of all fetching a token. When `static_token` is set it is
+    returned as is and Azure AD is never contacted.
+    """
+
+    def __init__(self, scope=DICOM_SCOPE, refresh_margin=None, static_token=None):
+        self.scope = scope
+        self.refresh_margin = config.TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.static_token = config.DICOM_STATIC_TOKEN if static_token is None else static_token
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key, client_secret):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.client_secret != client_secret:
+                # New key or rotated secret: start from a fresh credential
+                entry = _CacheEntry(client_secret)
+                self._entries[key] = entry
+            return entry
+
+    def get_token(self, tenant_id, client_id, client_secret, endpoint=None):
+        """Return a valid access token string, fetching a new one only when needed"""
+        if self.static_token:
+            return self.static_token
+        entry = self._get_entry((tenant_id, client_id, endpoint), client_secret)
+        with entry.lock:
+            if entry.token is None or entry.token.expires_on - self.refresh_margin <= time.time():
+                if entry.credential is None:
+                    entry.credential = ClientSecretCredential(
+                        client_id=client_id,
+                        client_secret=client_secret,
+                        tenant_id=tenant_id
+                    )
+                with metrics.TOKEN_FETCH_SECONDS.time():
+                    entry.token = entry.credential.get_token(self.scope)
+                metrics.CACHE_REQUESTS.inc('token', 'miss')
+                logging.debug(f"Fetched new access token for client '{client_id}' (expires at {entry.token.expires_on})")
+            else:
+                metrics.CACHE_REQUESTS.inc('token', 'hit')
+            return entry.token.token
+
+    def clear(self):
+        """Forget all cached credentials and tokens"""
+        with self._lock:
+            self._entries.clear()
+
+
+token_manager = TokenManager()
@@ -0,0 +1,335 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+from pydicom.datadict import tag_for_keyword
+
+import catalog
+import config
+import dicom_headers
+import header_patch
+
+# Files listed individually in a change plan; the rest are only counted
+MAX_PLANNED_FILES_SHOWN = 200
+
+# Lists the files being moved into place; it exists only while a commit is in progress
+COMMIT_JOURNAL = '.dicom_edit_journal.json'
+
+# Temp files older than this (seconds) are left over from an interrupted edit
+STALE_TEMP_AGE = 3600
+
+# One commit or recovery at a time per study directory
+_commit_locks = {}
+_commit_locks_guard = threading.Lock()
+
+
+def value_differs(current, new):
+    """Whether writing `new` would change a value, ignoring DICOM space padding"""
+    return str(current).strip() != str(new).strip()
+
+
+def _stage_file(file_path, changes):
+    """Write an edited copy of one file next to it; the original is left untouched"""
+    try:
+        ds, pixel_offset = header_patch.load_header(file_path)
+        changed = []
+        for key, value in changes.items():
+            if hasattr(ds, key) and value_differs(getattr(ds, key), value):
+                setattr(ds, key, value)
+                changed.append(key)
+
+        if not changed:
+            return {'path': file_path, 'status': 'unchanged', 'changed': []}
+
+        temp_path = header_patch.write_temp(ds, file_path, pixel_offset)
+        return {'path': file_path, 'status': 'staged', 'changed': changed, 'temp_path': temp_path}
+    except Exception as e:
+        return {'path': file_path, 'status': 'failed', 'changed': [], 'error': str(e)}
+
+
+def _stage_chunk(file_paths, changes):
+    return [_stage_file(file_path, changes) for file_path in file_paths]
+
+
+def _cancelled(file_paths):
+    return [{'path': file_path, 'status': 'cancelled', 'changed': []} for file_path in file_paths]
+
+
+def _stage_all(dicom_files, changes, max_workers, progress=None, cancel=None):
+    """Stage every file, in a process pool when the batch is large enough to pay for it
+
+    Files are handed out in chunks; once `cancel` is set, chunks that have not
+    been staged yet are reported as cancelled.
+    """
+    inline = max_workers <= 1 or len(dicom_files) < config.BATCH_EDIT_MIN_FILES
+    chunksize = 1 if inline else max(1, len(dicom_files) // (max_workers * 4))
+    chunks = [dicom_files[start:start + chunksize] for start in range(0, len(dicom_files), chunksize)]
+    results = []
+
+    def collect(chunk_results):
+        results.extend(chunk_results)
+        if progress is not None:
+            progress.add_instances(len(chunk_results), 0)
+
+    if inline:
+        for chunk in chunks:
+            collect(_cancelled(chunk) if cancel is not None and cancel.is_set() else _stage_chunk(chunk, changes))
+        return results
+
+    # Spawned workers do not inherit the Flask app's threads or locks
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [executor.submit(_stage_chunk, chunk, changes) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            if cancel is not None and cancel.is_set():
+                for pending in futures:
+                    pending.cancel()
+            try:
+                collect(future.result())
+            except CancelledError:
+                collect(_cancelled(chunk))
+    return results
+
+
+def _header_differences(file_path, changes):
+    """`{keyword: (old, new)}` for the changes that would alter this file, from a header-only read"""
+    ds = dicom_headers.read_header(file_path, list(changes))
+    return {
+        key: (str(getattr(ds, key)).strip(), value)
+        for key, value in changes.items()
+        if hasattr(ds, key) and value_differs(getattr(ds, key), value)
+    }
+
+
+def plan_study_edits(dicom_root, study, changes):
+    """Work out which files of a study a set of attribute values would actually change
+
+    Current values come from the catalog index. A file's header is read only
+    when the index cannot decide: for attributes it does not hold, and for empty
+    indexed values, which may mean the attribute is absent (absent attributes
+    are never added). Returns a plan with the files to write and, per attribute,
+    how many files change and from which values.
+    """
+    changes = {
+        key: str(value).strip() for key, value in changes.items()
+        if tag_for_keyword(key) is not None
+    }
+    rows = catalog.get_instances(dicom_root, [study])
+    files = []
+    header_reads = 0
+    failed = []
+    old_values = {key: Counter() for key in changes}
+
+    for row in rows:
+        differences = {}
+        to_read = {}
+        for key, value in changes.items():
+            if key not in catalog.INSTANCE_FIELDS:
+                to_read[key] = value
+            elif not value_differs(row[key] or '', value):
+                continue
+            elif row[key]:
+                differences[key] = (row[key], value)
+            else:
+                to_read[key] = value
+
+        if to_read:
+            header_reads += 1
+            try:
+                differences.update(_header_differences(os.path.join(dicom_root, row['path']), to_read))
+            except Exception as e:
+                logging.warning(f"Failed to read header of '{row['path']}' for change planning: {e}")
+                failed.append(f"{row['path']}: {e}")
+                continue
+
+        if differences:
+            files.append({'path': row['path'], 'size': row['size'], 'changes': differences})
+            for key, (old, _) in differences.items():
+                old_values[key][old] += 1
+
+    plan = {
+        'study': study,
+        'changes': changes,
+        'total': len(rows),
+        'files': files,
+        'unchanged': len(rows) - len(files) - len(failed),
+        'failed': failed,
+        'bytes': sum(item['size'] for item in files),
+        'header_reads': header_reads,
+        'fields': [
+            {'keyword': key, 'new': changes[key], 'files': sum(counter.values()),
+             'old_values': counter.most_common(5)}
+            for key, counter in old_values.items() if counter
+        ]
+    }
+    logging.info(
+        f"Change plan for study '{study}': {len(files)} of {len(rows)} file(s) to write, "
+        f"{header_reads} header(s) read"
+    )
+    return plan
+
+
+def _commit_lock(directory):
+    with _commit_locks_guard:
+        return _commit_locks.setdefault(os.path.abspath(directory), threading.Lock())
+
+
+def _backup_path(file_path):
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.orig")
+
+
+def _keep_original(file_path):
+    """Keep the current file as a backup: a hard link, or a copy where links are not supported"""
+    backup = _backup_path(file_path)
+    if os.path.lexists(backup):
+        os.remove(backup)
+    try:
+        os.link(file_path, backup)
+    except OSError:
+        shutil.copy2(file_path, backup)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def recover_study(study_path):
+    """Undo a commit that was interrupted (e.g. by a crash) and delete its leftover files
+
+    If the commit journal is still there, every original kept as a backup is
+    moved back, so the study returns to its state before that edit. Backups
+    without a journal and temp files older than STALE_TEMP_AGE are deleted.
+    """
+    with _commit_lock(study_path):
+        journal_path = os.path.join(study_path, COMMIT_JOURNAL)
+        try:
+            with open(journal_path) as fp:
+                file_paths = json.load(fp)
+        except FileNotFoundError:
+            file_paths = None
+        except ValueError:
+            file_paths = []  # the crash came before the journal was complete, so nothing was replaced
+        if file_paths is not None:
+            restored = 0
+            for file_path in file_paths:
+                backup = _backup_path(file_path)
+                if os.path.exists(backup):
+                    os.replace(backup, file_path)
+                    restored += 1
+            os.remove(journal_path)
+            logging.warning(f"Rolled back an interrupted edit of '{study_path}': {restored} file(s) restored")
+
+        stale_before = time.time() - STALE_TEMP_AGE
+        for root, _, files in os.walk(study_path):
+            for file in files:
+                if not file.startswith('.'):
+                    continue
+                path = os.path.join(root, file)
+                if file.endswith('.dcm.orig'):
+                    _remove_quietly(path)
+                elif file.endswith('.tmp'):
+                    try:
+                        if os.path.getmtime(path) < stale_before:
+                            os.remove(path)
+                    except OSError:
+                        pass
+
+
+def _commit(staged, journal_path):
+    """Move staged files over their originals; if any move fails, put every original back"""
+    with open(journal_path, 'w') as fp:
+        json.dump([result['path'] for result in staged], fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    replaced = []
+    try:
+        for result in staged:
+            _keep_original(result['path'])
+            os.replace(result['temp_path'], result['path'])
+            replaced.append(result)
+    except Exception:
+        for result in replaced:
+            os.replace(_backup_path(result['path']), result['path'])
+        for result in staged:
+            _remove_quietly(result['temp_path'])
+            _remove_quietly(_backup_path(result['path']))
+        os.remove(journal_path)
+        raise
+
+    # The journal going away is the commit point; backups are only cleanup from here on
+    os.remove(journal_path)
+    for result in staged:
+        _remove_quietly(_backup_path(result['path']))
+
+
+def apply_study_edits(dicom_files, changes, max_workers=None, progress=None, cancel=None, study_path=None):
+    """Apply the same attribute values to every file of a study
+
+    All edited files are first written to temporary files. Only when every file
+    was staged successfully are they moved over the originals with os.replace,
+    so a failure or cancellation leaves the study exactly as it was. The
+    originals are kept until every move has succeeded and are restored if one
+    fails; a commit cut short by a crash is undone by `recover_study` (the
+    journal lives in `study_path`, by default the files' common directory).
+    Returns a summary dict with a per-file `results` list.
+    """
+    if max_workers is None:
+        max_workers = config.BATCH_EDIT_WORKERS or os.cpu_count() or 1
+    if progress is not None:
+        progress.set_totals(instances=len(dicom_files))
+    if study_path is None and dicom_files:
+        study_path = os.path.commonpath([os.path.dirname(file_path) for file_path in dicom_files])
+
+    results = _stage_all(dicom_files, changes, max_workers, progress, cancel)
+    failed = [result for result in results if result['status'] == 'failed']
+    cancelled = cancel is not None and cancel.is_set()
+    staged = [result for result in results if result['status'] == 'staged']
+
+    if not failed and not cancelled and staged:
+        try:
+            with _commit_lock(study_path):
+                _commit(staged, os.path.join(study_path, COMMIT_JOURNAL))
+        except Exception as e:
+            logging.error(f"Failed to move edited files into place, originals restored: {e}")
+            for result in staged:
+                del result['temp_path']
+                result['status'] = 'failed'
+                result['error'] = f"Commit failed: {e}"
+            failed = staged
+        else:
+            for result in staged:
+                del result['temp_path']
+                result['status'] = 'updated'
+
+    if failed or cancelled:
+        for result in results:
+            if result['status'] == 'staged':
+                _remove_quietly(result.pop('temp_path'))
+                result['status'] = 'rolled_back'
+        for result in failed:
+            logging.error(f"Failed to edit DICOM file '{result['path']}': {result['error']}")
+
+    summary = {
+        'results': results,
+        'committed': not failed and not cancelled,
+        'cancelled': cancelled,
+        'updated': sum(1 for result in results if result['status'] == 'updated'),
+        'unchanged': sum(1 for result in results if result['status'] == 'unchanged'),
+        'failed': len(failed)
+    }
+    logging.info(
+        f"Batch edit of {len(results)} file(s): {summary['updated']} updated, "
+        f"{summary['unchanged']} unchanged, {summary['failed']} failed"
+    )
+    return summary
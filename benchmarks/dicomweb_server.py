@@ -0,0 +1,527 @@
+"""A local DICOMweb stand-in serving STOW-RS, QIDO-RS and WADO-RS over a directory
+
+Only the endpoints the editor uses are implemented, under /v2 like the Azure
+DICOM service. Instances are stored as <root>/<study>/<series>/<instance>.dcm.
+Latency, bandwidth and error injection make it usable for throughput and
+resilience measurements::
+
+    python -m benchmarks.dicomweb_server ./remote --port 8042 --latency 0.05 --bandwidth 20000000
+    DICOM_STATIC_TOKEN=local-token AZURE_DICOM_ENDPOINT=http://127.0.0.1:8042 python app.py
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import dicom_headers
+import dicomweb
+
+DEFAULT_TOKEN = 'local-token'
+
+# Header attributes kept in the in-memory index for QIDO-RS and metadata responses
+INDEXED_FIELDS = {
+    'StudyInstanceUID': ('0020000D', 'UI'),
+    'SeriesInstanceUID': ('0020000E', 'UI'),
+    'SOPInstanceUID': ('00080018', 'UI'),
+    'SOPClassUID': ('00080016', 'UI'),
+    'SeriesNumber': ('00200011', 'IS'),
+    'InstanceNumber': ('00200013', 'IS'),
+    'Modality': ('00080060', 'CS'),
+    'PatientName': ('00100010', 'PN'),
+    'PatientID': ('00100020', 'LO'),
+    'PatientBirthDate': ('00100030', 'DA'),
+    'AccessionNumber': ('00080050', 'SH'),
+    'StudyDescription': ('00081030', 'LO'),
+    'ReferringPhysicianName': ('00080090', 'PN'),
+    'StudyDate': ('00080020', 'DA'),
+    'StudyTime': ('00080030', 'TM')
+}
+
+STUDY_LEVEL_FIELDS = [
+    'StudyInstanceUID', 'PatientName', 'PatientID', 'PatientBirthDate', 'AccessionNumber',
+    'StudyDescription', 'ReferringPhysicianName', 'StudyDate', 'StudyTime'
+]
+SERIES_LEVEL_FIELDS = ['SeriesInstanceUID', 'SeriesNumber', 'Modality']
+INSTANCE_LEVEL_FIELDS = ['SOPInstanceUID', 'SOPClassUID', 'InstanceNumber']
+
+ROUTE = re.compile(
+    r'^/v2/studies(?:/(?P<study>[^/]+)(?:/(?P<resource>metadata|series)'
+    r'(?:/(?P<series>[^/]+)(?:/(?P<instances>instances)(?:/(?P<instance>[^/]+))?)?)?)?)?/?$'
+)
+
+# Bytes per read/write when streaming request and response bodies
+IO_CHUNK_SIZE = 256 * 1024
+
+
+def to_dicom_json(attributes, fields):
+    """DICOM JSON object for the given indexed attributes (empty values are sent without a Value)"""
+    result = {}
+    for field in fields:
+        tag, vr = INDEXED_FIELDS[field]
+        value = attributes.get(field, '')
+        if value == '':
+            result[tag] = {'vr': vr}
+        elif vr == 'PN':
+            result[tag] = {'vr': vr, 'Value': [{'Alphabetic': value}]}
+        elif vr == 'IS':
+            result[tag] = {'vr': vr, 'Value': [int(value)] if value.lstrip('-').isdigit() else [value]}
+        else:
+            result[tag] = {'vr': vr, 'Value': [value]}
+    return result
+
+
+class InstanceStore:
+    """Instances on disk plus an in-memory index of study -> series -> instance attributes"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.incoming = os.path.join(self.root, '.incoming')
+        self._lock = threading.Lock()
+        self._studies = {}
+        os.makedirs(self.incoming, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        count = 0
+        for folder, _, files in os.walk(self.root):
+            if folder.startswith(self.incoming):
+                continue
+            for name in files:
+                if name.endswith('.dcm'):
+                    path = os.path.join(folder, name)
+                    try:
+                        self._index(path, dicom_headers.read_header_values(path, list(INDEXED_FIELDS)))
+                        count += 1
+                    except Exception as e:
+                        logging.warning(f"Stand-in skipped unreadable instance '{path}': {e}")
+        logging.info(f"DICOMweb stand-in loaded {count} instance(s) from '{self.root}'")
+
+    def _index(self, path, attributes):
+        with self._lock:
+            series = self._studies.setdefault(attributes['StudyInstanceUID'], {})
+            instances = series.setdefault(attributes['SeriesInstanceUID'], {})
+            instances[attributes['SOPInstanceUID']] = (path, attributes)
+
+    def store(self, temp_path, study_uid=None):
+        """Move a received part into the store; returns its attributes or raises ValueError"""
+        try:
+            attributes = dicom_headers.read_header_values(temp_path, list(INDEXED_FIELDS))
+            uids = [attributes[field] for field in ('StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID')]
+            if not all(uids):
+                raise ValueError("Instance is missing a Study, Series or SOP Instance UID")
+            if study_uid and attributes['StudyInstanceUID'] != study_uid:
+                raise ValueError(f"Instance belongs to study {attributes['StudyInstanceUID']}, not {study_uid}")
+        except Exception:
+            os.remove(temp_path)
+            raise
+        folder = os.path.join(self.root, uids[0], uids[1])
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{uids[2]}.dcm")
+        os.replace(temp_path, path)
+        self._index(path, attributes)
+        return attributes
+
+    def studies(self):
+        """First instance's attributes of every study"""
+        with self._lock:
+            return [
+                next(iter(next(iter(series.values())).values()))[1]
+                for series in self._studies.values() if series
+            ]
+
+    def instances(self, study_uid, series_uid=None, instance_uid=None):
+        """`(path, attributes)` of the matching instances, ordered by series and instance number"""
+        with self._lock:
+            series = self._studies.get(study_uid, {})
+            selected = [series.get(series_uid, {})] if series_uid else list(series.values())
+            found = [
+                entry for instances in selected for uid, entry in instances.items()
+                if instance_uid is None or uid == instance_uid
+            ]
+
+        def order(entry):
+            attributes = entry[1]
+            return (attributes['SeriesNumber'].zfill(8), attributes['SeriesInstanceUID'],
+                    attributes['InstanceNumber'].zfill(8))
+        return sorted(found, key=order)
+
+    def series(self, study_uid):
+        with self._lock:
+            return [
+                next(iter(instances.values()))[1]
+                for instances in self._studies.get(study_uid, {}).values() if instances
+            ]
+
+
+class DicomWebStandIn:
+    """Threaded HTTP server around an InstanceStore with injectable latency, bandwidth and errors
+
+    `latency` (+ up to `jitter`) seconds are added before every response,
+    `bandwidth` caps bytes per second per connection in each direction (0 is
+    unlimited) and a fraction `error_rate` of requests fails with `error_status`.
+    """
+
+    def __init__(self, root, host='127.0.0.1', port=0, token=DEFAULT_TOKEN, latency=0.0, jitter=0.0,
+                 bandwidth=0, error_rate=0.0, error_status=503, seed=None):
+        self.store = InstanceStore(root)
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': {}, 'errors_injected': 0, 'bytes_in': 0, 'bytes_out': 0,
+                       'instances_stored': 0, 'instances_rejected': 0, 'durations': {}}
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.standin = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a background thread; returns the base URL"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='dicomweb-standin', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def should_fail(self):
+        with self._random_lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._random_lock:
+                extra = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+            time.sleep(self.latency + extra)
+
+    def record(self, kind, duration, bytes_in=0, bytes_out=0, injected=False, stored=0, rejected=0):
+        with self._stats_lock:
+            stats = self._stats
+            stats['requests'][kind] = stats['requests'].get(kind, 0) + 1
+            stats['durations'].setdefault(kind, []).append(duration)
+            stats['bytes_in'] += bytes_in
+            stats['bytes_out'] += bytes_out
+            stats['errors_injected'] += injected
+            stats['instances_stored'] += stored
+            stats['instances_rejected'] += rejected
+
+    def stats(self):
+        """Counters plus per-request-kind p50/p95 durations in seconds"""
+        with self._stats_lock:
+            stats = {key: value for key, value in self._stats.items() if key != 'durations'}
+            stats['requests'] = dict(stats['requests'])
+            stats['latency'] = {
+                kind: {'p50': percentile(durations, 50), 'p95': percentile(durations, 95)}
+                for kind, durations in self._stats['durations'].items()
+            }
+        return stats
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are separate writes; without this, Nagle's algorithm adds ~40ms per response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        logging.debug(f"DICOMweb stand-in: {self.address_string()} {format % args}")
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def _throttle(self, size, started):
+        """Sleep so that `size` bytes since `started` do not exceed the configured bandwidth"""
+        bandwidth = self.standin.bandwidth
+        if bandwidth:
+            ahead = size / bandwidth - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def _iter_body(self):
+        """Yield the request body, decoding chunked transfer encoding, at the configured bandwidth"""
+        started, received = time.monotonic(), 0
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                remaining = size
+                while remaining:
+                    data = self.rfile.read(min(remaining, IO_CHUNK_SIZE))
+                    if not data:
+                        raise ValueError("Request body ended unexpectedly")
+                    remaining -= len(data)
+                    received += len(data)
+                    self.bytes_in = received
+                    self._throttle(received, started)
+                    yield data
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0) or 0)
+            while remaining:
+                data = self.rfile.read(min(remaining, IO_CHUNK_SIZE))
+                if not data:
+                    raise ValueError("Request body ended unexpectedly")
+                remaining -= len(data)
+                received += len(data)
+                self.bytes_in = received
+                self._throttle(received, started)
+                yield data
+
+    def _send(self, status, body=b'', content_type='application/dicom+json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        self.bytes_out = len(body)
+
+    def _send_items(self, items, not_found):
+        if items:
+            self._send(200, items)
+        else:
+            self._send(404, {'error': not_found})
+
+    def _handle(self, method):
+        self.bytes_in = self.bytes_out = 0
+        started = time.monotonic()
+        kind, injected, stored, rejected = 'unknown', False, 0, 0
+        try:
+            url = urlsplit(self.path)
+            match = ROUTE.match(url.path)
+            if match is None:
+                self._send(404, {'error': f"Unknown path {url.path}"})
+                return
+            kind = 'store' if method == 'POST' else self._kind(match)
+
+            self.standin.delay()
+            if self.standin.token and self.headers.get('Authorization') != f"Bearer {self.standin.token}":
+                self._send(401, {'error': 'Invalid bearer token'})
+                self.close_connection = True
+                return
+            if self.standin.should_fail():
+                injected = True
+                # The body is not read, so the connection cannot be reused
+                self._send(self.standin.error_status, {'error': 'Injected failure'}, headers={'Retry-After': '0'})
+                self.close_connection = True
+                return
+
+            if method == 'POST':
+                stored, rejected = self._stow(match)
+            else:
+                self._get(match, parse_qs(url.query))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception as e:
+            logging.exception("DICOMweb stand-in request failed")
+            self.close_connection = True
+            try:
+                self._send(500, {'error': str(e)})
+            except OSError:
+                pass
+        finally:
+            self.standin.record(kind, time.monotonic() - started, self.bytes_in, self.bytes_out,
+                                injected, stored, rejected)
+
+    @staticmethod
+    def _kind(match):
+        """Request kind used for the per-kind counters and latencies"""
+        if match['study'] is None:
+            return 'search'
+        if match['resource'] == 'metadata':
+            return 'metadata'
+        if match['resource'] == 'series' and match['series'] is None:
+            return 'series-list'
+        if match['instances'] and match['instance'] is None:
+            return 'instance-list'
+        if match['instance']:
+            return 'instance'
+        return 'series' if match['series'] else 'study'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _stow(self, match):
+        """STOW-RS: store every application/dicom part of a multipart/related body"""
+        boundary = dicomweb.get_boundary(self.headers.get('Content-Type', ''))
+        stored, failed = [], []
+        body = self._iter_body()
+        for part_headers, temp_path in dicomweb.iter_multipart_parts(body, boundary, self.standin.store.incoming):
+            if 'application/dicom' not in part_headers.get('content-type', 'application/dicom'):
+                os.remove(temp_path)
+                continue
+            try:
+                stored.append(self.standin.store.store(temp_path, match['study']))
+            except Exception as e:
+                failed.append(str(e))
+        # The parser stops at the closing delimiter; the rest must be read before the connection is reused
+        for _ in body:
+            pass
+
+        result = {'00081199': {'vr': 'SQ', 'Value': [
+            to_dicom_json(attributes, ['SOPClassUID', 'SOPInstanceUID']) for attributes in stored
+        ]}}
+        if failed:
+            result['00081198'] = {'vr': 'SQ', 'Value': [{'00081197': {'vr': 'US', 'Value': [272]}} for _ in failed]}
+        status = 200 if not failed else (202 if stored else 409)
+        self._send(status, result)
+        return len(stored), len(failed)
+
+    def _get(self, match, query):
+        store = self.standin.store
+        kind = self._kind(match)
+        if kind == 'search':
+            self._qido(query)
+        elif kind == 'metadata':
+            fields = STUDY_LEVEL_FIELDS + SERIES_LEVEL_FIELDS + INSTANCE_LEVEL_FIELDS
+            items = [to_dicom_json(attributes, fields) for _, attributes in store.instances(match['study'])]
+            self._send_items(items, f"Study {match['study']} not found")
+        elif kind == 'series-list':
+            items = [to_dicom_json(attributes, SERIES_LEVEL_FIELDS) for attributes in store.series(match['study'])]
+            self._send_items(items, f"Study {match['study']} not found")
+        elif kind == 'instance-list':
+            items = [
+                to_dicom_json(attributes, SERIES_LEVEL_FIELDS + INSTANCE_LEVEL_FIELDS)
+                for _, attributes in store.instances(match['study'], match['series'])
+            ]
+            self._send_items(items, f"Series {match['series']} not found")
+        else:
+            self._wado(store.instances(match['study'], match['series'], match['instance']))
+
+    def _qido(self, query):
+        """QIDO-RS study search: exact, wildcard or (PatientName) fuzzy prefix matching, with paging"""
+        params = {name: values[0] for name, values in query.items()}
+        fuzzy = params.get('fuzzymatching', '').lower() == 'true'
+        filters = {name: value for name, value in params.items() if name in STUDY_LEVEL_FIELDS and value}
+
+        def matches(attributes):
+            for name, expected in filters.items():
+                value = attributes.get(name, '')
+                if '*' in expected or '?' in expected:
+                    if not fnmatch.fnmatchcase(value.upper(), expected.upper()):
+                        return False
+                elif name == 'PatientName' and fuzzy:
+                    words = re.split(r'[\^ ]+', value.upper())
+                    if not any(word.startswith(expected.upper()) for word in words):
+                        return False
+                elif value != expected:
+                    return False
+            return True
+
+        studies = sorted(
+            (attributes for attributes in self.standin.store.studies() if matches(attributes)),
+            key=lambda attributes: (attributes['StudyDate'], attributes['StudyInstanceUID'])
+        )
+        offset = int(params.get('offset', 0) or 0)
+        limit = int(params.get('limit', 0) or 0)
+        page = studies[offset:offset + limit] if limit else studies[offset:]
+        if not page:
+            self._send(204)
+            return
+        self._send(200, [to_dicom_json(attributes, STUDY_LEVEL_FIELDS) for attributes in page])
+
+    def _wado(self, instances):
+        """WADO-RS: stream the matching instances as multipart/related with a known length"""
+        if not instances:
+            self._send(404, {'error': 'Not found'})
+            return
+        boundary = f"standin-{os.urandom(8).hex()}"
+        part_header = f'--{boundary}\r\nContent-Type: application/dicom\r\n\r\n'.encode()
+        closing = f'--{boundary}--\r\n'.encode()
+        length = sum(len(part_header) + os.path.getsize(path) + 2 for path, _ in instances) + len(closing)
+
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/related; type="application/dicom"; boundary={boundary}')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+
+        started, sent = time.monotonic(), 0
+        for path, _ in instances:
+            self.wfile.write(part_header)
+            with open(path, 'rb') as fp:
+                while True:
+                    data = fp.read(IO_CHUNK_SIZE)
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    sent += len(data)
+                    self.bytes_out = sent
+                    self._throttle(sent, started)
+            self.wfile.write(b'\r\n')
+        self.wfile.write(closing)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a directory as a local DICOMweb (STOW/QIDO/WADO-RS) service")
+    parser.add_argument('root', help="directory holding the stored instances")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8042)
+    parser.add_argument('--token', default=DEFAULT_TOKEN, help="bearer token to require ('' accepts any)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added before every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds, at random")
+    parser.add_argument('--bandwidth', type=float, default=0, help="bytes per second per connection (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="status code of injected failures")
+    parser.add_argument('--seed', type=int, default=None, help="seed for jitter and error injection")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = DicomWebStandIn(
+        args.root, args.host, args.port, args.token, args.latency, args.jitter,
+        args.bandwidth, args.error_rate, args.error_status, args.seed
+    )
+    print(f"DICOMweb stand-in on {server.base_url} (token: {args.token or 'any'})", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        shutil.rmtree(server.store.incoming, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Drive concurrent uploads, downloads and searches through the app's DICOMweb code
+
+By default a DicomWebStandIn is started in-process over a temporary directory,
+with the requested latency, bandwidth and error injection; --url targets an
+already running stand-in instead. The app's own functions are called
+(upload_study_to_dicom, retrieve_study_from_dicom, search_studies,
+search_study_by_uid), so batching, retries and streaming are all exercised::
+
+    python -m benchmarks.load --concurrency 4 --iterations 8 --latency 0.02 --bandwidth 50000000 --error-rate 0.02
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import synthetic
+from benchmarks.dicomweb_server import DEFAULT_TOKEN, DicomWebStandIn, percentile
+from benchmarks.run import git_commit, peak_rss_bytes
+
+
+def folder_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path) for name in files
+    )
+
+
+def run_scenario(name, operation, iterations, concurrency):
+    """Run `operation(i)` for i in range(iterations) on `concurrency` threads
+
+    Each call returns `(ok, bytes)`; latencies are measured per call.
+    """
+    latencies = []
+    failures = 0
+    transferred = 0
+    lock = threading.Lock()
+
+    def timed(index):
+        nonlocal failures, transferred
+        started = time.perf_counter()
+        try:
+            ok, size = operation(index)
+        except Exception as e:
+            logging.error(f"{name} #{index} raised: {e}")
+            ok, size = False, 0
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            transferred += size
+            failures += not ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(iterations)))
+    wall = time.perf_counter() - started
+
+    result = {
+        'name': name,
+        'operations': iterations,
+        'failures': failures,
+        'concurrency': concurrency,
+        'wall_seconds': wall,
+        'ops_per_second': iterations / wall if wall > 0 else None,
+        'bytes': transferred,
+        'mb_per_second': transferred / (1024 * 1024) / wall if wall > 0 else None,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_max': max(latencies) if latencies else None,
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+    print(f"{name:10s} {iterations:5d} ops {failures:3d} failed  {result['mb_per_second'] or 0:8.1f} MB/s  "
+          f"p50 {result['latency_p50'] * 1000:8.1f} ms  p95 {result['latency_p95'] * 1000:8.1f} ms", flush=True)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the app's DICOMweb transfers against a local stand-in")
+    parser.add_argument('--url', help="base URL of a running stand-in (default: start one in-process)")
+    parser.add_argument('--token', default=DEFAULT_TOKEN, help="bearer token the stand-in expects")
+    parser.add_argument('--series', type=int, default=2, help="series in the uploaded study")
+    parser.add_argument('--instances', type=int, default=25, help="instances per series")
+    parser.add_argument('--size', type=int, default=256, help="rows and columns of each frame")
+    parser.add_argument('--concurrency', type=int, default=4, help="transfers run at once")
+    parser.add_argument('--iterations', type=int, default=8, help="operations per scenario")
+    parser.add_argument('--searches', type=int, default=100, help="search operations")
+    parser.add_argument('--latency', type=float, default=0.0, help="stand-in: seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="stand-in: random extra latency up to this")
+    parser.add_argument('--bandwidth', type=float, default=0, help="stand-in: bytes/s per connection (0 = unlimited)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="stand-in: fraction of failed requests")
+    parser.add_argument('--seed', type=int, default=0, help="seed for error injection and jitter")
+    parser.add_argument('--output', default='load_results.json', help="where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='dicom-load-')
+    dicom_root = os.path.join(workdir, 'dicoms')
+    os.environ['DICOM_ROOT'] = dicom_root
+    server = None
+    try:
+        paths = synthetic.generate_study(dicom_root, 'LOAD_STUDY', args.series, args.instances, args.size, args.size)
+        study_path = os.path.join(dicom_root, 'LOAD_STUDY')
+        print(f"Generated {len(paths)} instance(s), {folder_size(study_path) / (1024 * 1024):.1f} MB")
+
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            server = DicomWebStandIn(
+                os.path.join(workdir, 'remote'), token=args.token, latency=args.latency, jitter=args.jitter,
+                bandwidth=args.bandwidth, error_rate=args.error_rate, seed=args.seed
+            )
+            base_url = server.start()
+        print(f"DICOMweb stand-in at {base_url}")
+
+        import app as app_module
+        import azure_auth
+        import query_cache
+        logging.getLogger().setLevel(logging.WARNING)
+        # Stubbed token provider, and no cached searches so that every search reaches the server
+        azure_auth.token_manager.static_token = args.token
+        query_cache.study_search_cache.ttl = 0
+        azure_settings = {'endpoint': base_url, 'client_id': '', 'client_secret': '', 'tenant_id': ''}
+        session_settings = {'DICOM_ROOT': dicom_root, 'AZURE_DICOM_ENDPOINT': base_url}
+
+        uploaded = []
+        uploaded_lock = threading.Lock()
+        study_bytes = folder_size(study_path)
+
+        def upload(index):
+            success, report = app_module.upload_study_to_dicom(study_path, azure_settings)
+            if success:
+                with uploaded_lock:
+                    uploaded.append(report['study_instance_uid'])
+            return success, report.get('bytes', 0)
+
+        def download(index):
+            target = os.path.join(workdir, 'downloads', str(index))
+            os.makedirs(target, exist_ok=True)
+            try:
+                success, _ = app_module.retrieve_study_from_dicom(
+                    uploaded[index % len(uploaded)], azure_settings, target
+                )
+                return success, folder_size(target)
+            finally:
+                shutil.rmtree(target, ignore_errors=True)
+
+        patient_id = app_module.dicom_headers.read_header_values(paths[0], ['PatientID'])['PatientID']
+
+        def search(index):
+            with app_module.app.test_request_context():
+                app_module.session['settings'] = session_settings
+                if index % 3 == 0:
+                    found, studies = app_module.search_studies({}, offset=0, limit=50)
+                elif index % 3 == 1:
+                    found, studies = app_module.search_studies({'PatientID': patient_id, 'fuzzymatching': 'true'})
+                else:
+                    found, studies = app_module.search_study_by_uid(uploaded[index % len(uploaded)])
+            return found and bool(studies), 0
+
+        results = [run_scenario('upload', upload, args.iterations, args.concurrency)]
+        if uploaded:
+            results.append(run_scenario('download', download, args.iterations, args.concurrency))
+            results.append(run_scenario('search', search, args.searches, args.concurrency))
+        else:
+            print("No study was uploaded; skipping downloads and searches")
+
+        report = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_commit': git_commit(),
+            'parameters': {
+                'series': args.series, 'instances': args.instances, 'size': args.size,
+                'study_bytes': study_bytes, 'concurrency': args.concurrency, 'iterations': args.iterations,
+                'searches': args.searches, 'latency': args.latency, 'jitter': args.jitter,
+                'bandwidth': args.bandwidth, 'error_rate': args.error_rate, 'external_server': bool(args.url)
+            },
+            'results': results,
+            'server': server.stats() if server is not None else None,
+            'clients': app_module.dicomweb.get_client_stats()
+        }
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print(f"\nResults written to {args.output}")
+        return 1 if any(result['failures'] for result in results) else 0
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,281 @@
+"""Time the app's hot paths against synthetic studies and save the results as JSON
+
+Run from the repository root::
+
+    python -m benchmarks.run --series 4 --instances 50 --frames 8 --compressed
+    python -m benchmarks.run --output new.json --compare old.json
+
+Studies are generated in a temporary DICOM root that is removed afterwards
+(unless --keep is given). Routes are driven through Flask's test client, so
+timings include request handling and template rendering but no network.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks import synthetic
+
+# Regressions beyond this ratio are flagged by --compare
+REGRESSION_THRESHOLD = 1.2
+
+
+def peak_rss_bytes():
+    """High-water resident set size of this process and its finished worker processes"""
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+
+def measure(name, fn, repeat, setup=None):
+    """Run `fn(run)` `repeat` times; it returns `(operations, bytes)` for one run"""
+    runs = []
+    operations, size = 0, 0
+    for run in range(repeat):
+        if setup is not None:
+            setup(run)
+        started = time.perf_counter()
+        operations, size = fn(run)
+        runs.append(time.perf_counter() - started)
+    wall = statistics.median(runs)
+    result = {
+        'name': name,
+        'repeat': repeat,
+        'wall_seconds': wall,
+        'min_seconds': min(runs),
+        'max_seconds': max(runs),
+        'runs': runs,
+        'operations': operations,
+        'ops_per_second': operations / wall if wall > 0 else None,
+        'bytes': size,
+        'mb_per_second': size / (1024 * 1024) / wall if wall > 0 and size else None,
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+    print(f"{name:40s} {wall * 1000:10.1f} ms  {result['ops_per_second'] or 0:10.1f} ops/s  "
+          f"{result['mb_per_second'] or 0:8.1f} MB/s", flush=True)
+    return result
+
+
+def run_benchmarks(app_module, dicom_root, studies, args):
+    """Benchmark every hot path; `studies` maps a variant name to `(study folder, file paths)`"""
+    import batch_edit
+    import catalog
+    import config
+    import dicomweb
+
+    client = app_module.app.test_client()
+    results = []
+
+    def study_list(run):
+        with app_module.app.test_request_context():
+            listed = app_module.get_local_studies_with_metadata()
+        return len(listed), 0
+
+    def drop_catalog(run):
+        for suffix in ('', '-wal', '-shm'):
+            path = catalog.get_catalog_path(dicom_root) + suffix
+            if os.path.exists(path):
+                os.remove(path)
+
+    results.append(measure('study_list_cold', study_list, args.repeat, setup=drop_catalog))
+    results.append(measure('study_list_warm', study_list, args.repeat))
+
+    for variant, (study, paths) in studies.items():
+        sample = [os.path.relpath(path, dicom_root) for path in paths[:args.files]]
+        sample_bytes = sum(os.path.getsize(path) for path in paths[:args.files])
+
+        def edit_file(run):
+            for rel_path in sample:
+                response = client.get(f"/edit-file/{rel_path}")
+                assert response.status_code == 200, response.status_code
+            return len(sample), sample_bytes
+
+        def save_file(run):
+            for rel_path in sample:
+                client.post(f"/save-file/{rel_path}", data={'StudyDescription': f"Benchmark save {run}"})
+            return len(sample), sample_bytes
+
+        def restore_station_name(run):
+            for path in paths[:args.files]:
+                ds, pixel_offset = app_module.header_patch.load_header(path)
+                if 'StationName' not in ds:
+                    ds.StationName = 'BENCH01'
+                    app_module.header_patch.save_header(ds, path, pixel_offset)
+
+        def delete_tag(run):
+            for rel_path in sample:
+                client.post(f"/delete-tag/{rel_path}", data={'tag_keyword': 'StationName'})
+            return len(sample), sample_bytes
+
+        study_bytes = sum(os.path.getsize(path) for path in paths)
+
+        def save_study_plan(run):
+            response = client.post(f"/save-study/{study}", data={'StudyDescription': f"Benchmark plan {run}"})
+            assert response.status_code == 200, response.status_code
+            return len(paths), 0
+
+        def save_study(run):
+            success, message = app_module.edit_study_job(
+                dicom_root, study, {'StudyDescription': f"Benchmark study {run}"}
+            )
+            assert success, message
+            return len(paths), study_bytes
+
+        def save_study_noop(run):
+            # Resubmits the values written by the last save_study run, so nothing needs writing
+            plan = batch_edit.plan_study_edits(
+                dicom_root, study, {'StudyDescription': f"Benchmark study {args.repeat - 1}"}
+            )
+            assert not plan['files'], len(plan['files'])
+            return plan['total'], 0
+
+        body_path = os.path.join(args.workdir, f"{variant}.multipart")
+        boundary = 'benchmark-boundary-0123456789'
+
+        def multipart_encode(run):
+            size = 0
+            with open(body_path, 'wb') as out:
+                for chunk in dicomweb.iter_multipart_related(paths, boundary):
+                    out.write(chunk)
+                    size += len(chunk)
+            return len(paths), size
+
+        def multipart_decode(run):
+            parts_dir = os.path.join(args.workdir, 'parts')
+            os.makedirs(parts_dir, exist_ok=True)
+            count = 0
+            chunks = dicomweb.iter_file_range(body_path, 0, config.DOWNLOAD_CHUNK_SIZE)
+            for _, part_path in dicomweb.iter_multipart_parts(chunks, boundary, parts_dir):
+                os.remove(part_path)
+                count += 1
+            return count, os.path.getsize(body_path)
+
+        results.append(measure(f"edit_file[{variant}]", edit_file, args.repeat))
+        results.append(measure(f"save_file[{variant}]", save_file, args.repeat))
+        results.append(measure(f"delete_tag[{variant}]", delete_tag, args.repeat, setup=restore_station_name))
+        results.append(measure(f"save_study_plan[{variant}]", save_study_plan, args.repeat))
+        results.append(measure(f"save_study[{variant}]", save_study, args.repeat))
+        results.append(measure(f"save_study_noop[{variant}]", save_study_noop, args.repeat))
+        results.append(measure(f"multipart_encode[{variant}]", multipart_encode, args.repeat))
+        results.append(measure(f"multipart_decode[{variant}]", multipart_decode, args.repeat))
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, previous_path):
+    """Print each benchmark's median against a previous results file; returns the number of regressions"""
+    with open(previous_path) as fp:
+        previous_report = json.load(fp)
+    previous = {result['name']: result for result in previous_report['results']}
+    regressions = 0
+    print(f"\nCompared with {previous_path}:")
+    if previous_report.get('parameters') != report['parameters']:
+        print(f"Warning: parameters differ ({previous_report.get('parameters')}), timings are not comparable")
+    results = report['results']
+    for result in results:
+        old = previous.get(result['name'])
+        if old is None or not old['wall_seconds']:
+            continue
+        ratio = result['wall_seconds'] / old['wall_seconds']
+        flag = '  REGRESSION' if ratio > REGRESSION_THRESHOLD else ''
+        regressions += bool(flag)
+        print(f"{result['name']:40s} {old['wall_seconds'] * 1000:10.1f} ms -> "
+              f"{result['wall_seconds'] * 1000:10.1f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DICOM editor's hot paths on synthetic studies")
+    parser.add_argument('--series', type=int, default=3, help="series per study")
+    parser.add_argument('--instances', type=int, default=20, help="instances per series")
+    parser.add_argument('--size', type=int, default=256, help="rows and columns of each frame")
+    parser.add_argument('--frames', type=int, default=1, help="also benchmark a multiframe study with this many frames")
+    parser.add_argument('--compressed', action='store_true', help="also benchmark an RLE Lossless study")
+    parser.add_argument('--files', type=int, default=10, help="files used by the per-file benchmarks")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark (the median is reported)")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the JSON results")
+    parser.add_argument('--compare', help="previous results file to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the generated studies")
+    args = parser.parse_args(argv)
+
+    args.workdir = tempfile.mkdtemp(prefix='dicom-bench-')
+    dicom_root = os.path.join(args.workdir, 'dicoms')
+    os.environ['DICOM_ROOT'] = dicom_root
+
+    variants = {'plain': {}}
+    if args.frames > 1:
+        variants['multiframe'] = {'frames': args.frames}
+    if args.compressed:
+        variants['compressed'] = {'compressed': True}
+
+    try:
+        studies = {}
+        for seed, (variant, options) in enumerate(variants.items()):
+            started = time.perf_counter()
+            name = f"BENCH_{variant.upper()}"
+            paths = synthetic.generate_study(
+                dicom_root, name, args.series, args.instances, args.size, args.size, seed=seed, **options
+            )
+            studies[variant] = (name, paths)
+            print(f"Generated {variant} study: {len(paths)} instance(s) in {time.perf_counter() - started:.1f}s")
+
+        import app as app_module
+        # Per-request debug logging would otherwise dominate the timings
+        logging.getLogger().setLevel(logging.WARNING)
+
+        results = run_benchmarks(app_module, dicom_root, studies, args)
+    finally:
+        if args.keep:
+            print(f"Studies kept in {dicom_root}")
+        else:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {
+            'series': args.series, 'instances': args.instances, 'size': args.size, 'frames': args.frames,
+            'compressed': args.compressed, 'files': args.files, 'repeat': args.repeat
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        return 1 if compare(report, args.compare) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
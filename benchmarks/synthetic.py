@@ -0,0 +1,127 @@
+import argparse
+import os
+
+import numpy as np
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, PYDICOM_IMPLEMENTATION_UID, RLELossless, generate_uid
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+MULTIFRAME_GRAYSCALE_WORD_SC = '1.2.840.10008.5.1.4.1.1.7.3'
+
+
+def _pixels(rng, frames, rows, columns):
+    """12-bit frames: a smooth gradient with noise, so compressed variants stay realistic in size"""
+    gradient = np.add.outer(np.arange(rows), np.arange(columns)) * (3000 / max(rows + columns, 1))
+    noise = rng.integers(0, 64, size=(frames, rows, columns))
+    return (gradient[np.newaxis] + noise + 500).astype(np.uint16)
+
+
+def make_instance(study, series, index, rng, rows=256, columns=256, frames=1, compressed=False):
+    """Build one synthetic instance with the attributes the app reads, edits and validates"""
+    multiframe = frames > 1
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MULTIFRAME_GRAYSCALE_WORD_SC if multiframe else CT_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SpecificCharacterSet = 'ISO_IR 100'
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study['StudyInstanceUID']
+    ds.SeriesInstanceUID = series['SeriesInstanceUID']
+    ds.PatientName = study['PatientName']
+    ds.PatientID = study['PatientID']
+    ds.PatientBirthDate = '19700101'
+    ds.AccessionNumber = study['AccessionNumber']
+    ds.StudyDescription = study['StudyDescription']
+    ds.StudyDate = '20240101'
+    ds.StudyTime = '120000'
+    ds.ReferringPhysicianName = 'REFERRER^SYNTHETIC'
+    ds.StationName = 'BENCH01'
+    ds.Modality = 'CT' if not multiframe else 'OT'
+    ds.SeriesNumber = series['SeriesNumber']
+    ds.InstanceNumber = index + 1
+    ds.ImageComments = 'Synthetic benchmark instance. ' * 8
+
+    # A small sequence, so the tag table has something to collapse
+    references = []
+    for _ in range(3):
+        item = Dataset()
+        item.ReferencedSOPClassUID = ds.SOPClassUID
+        item.ReferencedSOPInstanceUID = generate_uid()
+        references.append(item)
+    ds.ReferencedImageSequence = references
+
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.RescaleIntercept = -1024
+    ds.RescaleSlope = 1
+    ds.WindowCenter = 40
+    ds.WindowWidth = 400
+    if multiframe:
+        ds.NumberOfFrames = frames
+
+    pixels = _pixels(rng, frames, rows, columns)
+    if compressed:
+        ds.compress(RLELossless, pixels if multiframe else pixels[0])
+    else:
+        ds.PixelData = pixels.tobytes()
+    return ds
+
+
+def generate_study(root, name, series_count=3, instances=20, rows=256, columns=256,
+                   frames=1, compressed=False, seed=0):
+    """Write a study folder laid out like the sample data (series-NNNNN/image-NNNNN.dcm)
+
+    Returns the list of written file paths.
+    """
+    rng = np.random.default_rng(seed)
+    study = {
+        'StudyInstanceUID': generate_uid(),
+        'PatientName': f"SYNTHETIC^{name}",
+        'PatientID': f"BENCH-{seed:04d}",
+        'AccessionNumber': f"ACC{seed:06d}",
+        'StudyDescription': f"Synthetic benchmark study {name}"
+    }
+    paths = []
+    for series_index in range(series_count):
+        series = {'SeriesInstanceUID': generate_uid(), 'SeriesNumber': series_index + 1}
+        folder = os.path.join(root, name, f"series-{series_index:05d}")
+        os.makedirs(folder, exist_ok=True)
+        for index in range(instances):
+            ds = make_instance(study, series, index, rng, rows, columns, frames, compressed)
+            path = os.path.join(folder, f"image-{index:05d}.dcm")
+            ds.save_as(path, write_like_original=False)
+            paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic DICOM study for benchmarking")
+    parser.add_argument('root', help="DICOM root folder to write the study into")
+    parser.add_argument('--name', default='SYNTHETIC_STUDY', help="study folder name")
+    parser.add_argument('--series', type=int, default=3, help="number of series")
+    parser.add_argument('--instances', type=int, default=20, help="instances per series")
+    parser.add_argument('--size', type=int, default=256, help="rows and columns of each frame")
+    parser.add_argument('--frames', type=int, default=1, help="frames per instance (>1 writes multiframe files)")
+    parser.add_argument('--compressed', action='store_true', help="encode pixel data as RLE Lossless")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for pixel data and identifiers")
+    args = parser.parse_args(argv)
+
+    paths = generate_study(args.root, args.name, args.series, args.instances, args.size, args.size,
+                           args.frames, args.compressed, args.seed)
+    print(f"Wrote {len(paths)} instance(s) to {os.path.join(args.root, args.name)}")
+
+
+if __name__ == '__main__':
+    main()
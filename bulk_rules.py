@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.multival import MultiValue
+
+import catalog
+import config
+import header_patch
+import tag_render
+
+ACTIONS = ('set', 'delete', 'regex', 'hash')
+
+# VRs whose values can be written as free text by set/regex rules
+TEXT_VRS = {
+    'AE', 'AS', 'CS', 'DA', 'DS', 'DT', 'IS', 'LO', 'LT', 'PN',
+    'SH', 'ST', 'TM', 'UC', 'UI', 'UR', 'UT'
+}
+
+# VRs that can hold a hashed value (UIDs are hashed into a 2.25 UID)
+HASHABLE_VRS = {'AE', 'CS', 'LO', 'LT', 'PN', 'SH', 'ST', 'UC', 'UI', 'UT'}
+
+# Maximum value lengths (PS3.5 6.2) of the hashable VRs; hashes are never longer than 64 characters
+VR_MAX_LENGTHS = {'AE': 16, 'CS': 16, 'SH': 16, 'LO': 64, 'PN': 64}
+MAX_HASH_LENGTH = 64
+
+# Per-file errors kept in a report
+MAX_REPORTED_ERRORS = 20
+
+
+def parse_rule_set(spec):
+    """Validate a rule set given as a dict or JSON text and return it normalised
+
+    Example::
+
+        {
+            "studies": ["STUDY_A", "STUDY_B"],
+            "filters": {"Modality": ["CT", "MR"], "StudyDescription": {"regex": "^HEAD"}},
+            "rules": [
+                {"action": "set", "keyword": "PatientName", "value": "ANONYMOUS"},
+                {"action": "delete", "keyword": "PatientBirthDate"},
+                {"action": "regex", "keyword": "StudyDescription", "pattern": "\\s+", "replacement": " "},
+                {"action": "hash", "keyword": "PatientID", "salt": "project-x", "length": 16}
+            ]
+        }
+
+    `studies` is optional (default: every local study). Filters match catalogued
+    instance attributes exactly, against any of a list, or by regular expression.
+    Raises ValueError describing the first problem found.
+    """
+    if isinstance(spec, (str, bytes)):
+        spec = json.loads(spec)
+    if not isinstance(spec, dict):
+        raise ValueError("Rule set must be a JSON object")
+
+    rules = spec.get('rules')
+    if not isinstance(rules, list) or not rules:
+        raise ValueError("Rule set needs a non-empty 'rules' list")
+    parsed_rules = [_parse_rule(rule, index) for index, rule in enumerate(rules, start=1)]
+
+    filters = spec.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise ValueError("'filters' must be an object of attribute conditions")
+    for field, condition in filters.items():
+        if field not in catalog.INSTANCE_FIELDS:
+            raise ValueError(f"Cannot filter on '{field}'; supported fields: {', '.join(catalog.INSTANCE_FIELDS)}")
+        if isinstance(condition, dict):
+            if set(condition) != {'regex'}:
+                raise ValueError(f"Filter on '{field}' must be a value, a list of values or {{\"regex\": ...}}")
+            _compile(condition['regex'], f"filter on '{field}'")
+        elif isinstance(condition, list):
+            if not all(isinstance(value, str) for value in condition):
+                raise ValueError(f"Filter on '{field}' must list string values")
+        elif not isinstance(condition, str):
+            raise ValueError(f"Filter on '{field}' must be a value, a list of values or {{\"regex\": ...}}")
+
+    studies = spec.get('studies')
+    if studies is not None and (not isinstance(studies, list) or not all(isinstance(s, str) for s in studies)):
+        raise ValueError("'studies' must be a list of study folder names")
+
+    return {'rules': parsed_rules, 'filters': filters, 'studies': studies}
+
+
+def _compile(pattern, where):
+    try:
+        return re.compile(pattern)
+    except (re.error, TypeError) as e:
+        raise ValueError(f"Invalid regular expression in {where}: {e}") from e
+
+
+def _parse_rule(rule, index):
+    where = f"rule {index}"
+    if not isinstance(rule, dict):
+        raise ValueError(f"{where} must be an object")
+    action = rule.get('action')
+    if action not in ACTIONS:
+        raise ValueError(f"{where}: action must be one of {', '.join(ACTIONS)}")
+    keyword = rule.get('keyword')
+    if not isinstance(keyword, str) or tag_for_keyword(keyword) is None:
+        raise ValueError(f"{where}: unknown DICOM keyword '{keyword}'")
+    vr = dictionary_VR(tag_for_keyword(keyword))
+
+    parsed = {'action': action, 'keyword': keyword, 'VR': vr}
+    if action == 'delete':
+        if keyword in tag_render.PROTECTED_TAGS:
+            raise ValueError(f"{where}: '{keyword}' is protected and cannot be deleted")
+        return parsed
+
+    if vr not in (HASHABLE_VRS if action == 'hash' else TEXT_VRS):
+        raise ValueError(f"{where}: cannot {action} '{keyword}' (VR {vr})")
+    if action == 'set':
+        if not isinstance(rule.get('value'), str):
+            raise ValueError(f"{where}: 'set' needs a string 'value'")
+        parsed['value'] = rule['value']
+    elif action == 'regex':
+        _compile(rule.get('pattern'), where)
+        parsed['pattern'] = rule['pattern']
+        parsed['replacement'] = rule.get('replacement', '')
+        if not isinstance(parsed['replacement'], str):
+            raise ValueError(f"{where}: 'replacement' must be a string")
+    else:
+        parsed['salt'] = str(rule.get('salt', ''))
+        length = rule.get('length', 16)
+        max_length = VR_MAX_LENGTHS.get(vr, MAX_HASH_LENGTH)
+        if not isinstance(length, int) or isinstance(length, bool) or not 1 <= length <= max_length:
+            raise ValueError(f"{where}: 'length' must be between 1 and {max_length} for '{keyword}' (VR {vr})")
+        parsed['length'] = length
+    return parsed
+
+
+def _matches(value, condition):
+    if isinstance(condition, dict):
+        return re.search(condition['regex'], value) is not None
+    if isinstance(condition, list):
+        return value in condition
+    return value == condition
+
+
+def select_instances(dicom_root, rule_set, studies):
+    """Catalogued instances of `studies` that pass the rule set's study and attribute filters"""
+    if rule_set['studies'] is not None:
+        wanted = set(rule_set['studies'])
+        studies = [study for study in studies if study in wanted]
+    filters = rule_set['filters']
+    return [
+        row for row in catalog.get_instances(dicom_root, studies)
+        if all(_matches((row[field] or '').strip(), condition) for field, condition in filters.items())
+    ]
+
+
+def hash_value(value, rule):
+    """Keyed, deterministic pseudonym for a value, so equal inputs map to equal outputs"""
+    digest = hmac.new(rule['salt'].encode(), value.encode(), hashlib.sha256).hexdigest()
+    if rule['VR'] == 'UI':
+        return f"2.25.{int(digest[:32], 16)}"
+    return digest[:rule['length']].upper() if rule['VR'] == 'CS' else digest[:rule['length']]
+
+
+def _transform(value, rule):
+    """Result of a regex or hash rule for a single value; empty values stay empty"""
+    if value == '':
+        return value
+    if rule['action'] == 'regex':
+        return re.sub(rule['pattern'], rule['replacement'], value)
+    return hash_value(value, rule)
+
+
+def apply_rules(ds, rules):
+    """Apply rules to a dataset in order; returns the keywords whose value changed"""
+    changed = []
+    for rule in rules:
+        keyword = rule['keyword']
+        present = keyword in ds
+        if rule['action'] == 'delete':
+            if present:
+                delattr(ds, keyword)
+                changed.append(keyword)
+            continue
+
+        if rule['action'] == 'set':
+            old = str(ds.data_element(keyword).value) if present else None
+            new = rule['value']
+        elif not present:
+            continue
+        else:
+            # Multi-valued elements are rewritten value by value, keeping their multiplicity
+            value = ds.data_element(keyword).value
+            multi_valued = isinstance(value, MultiValue)
+            old = [str(item) for item in value] if multi_valued else str(value)
+            if old == '' or old == []:
+                continue
+            new = [_transform(item, rule) for item in old] if multi_valued else _transform(old, rule)
+
+        if new != old:
+            setattr(ds, keyword, new)
+            changed.append(keyword)
+    return changed
+
+
+def _process_file(file_path, rules, dry_run):
+    """Apply the rules to one file, replacing it atomically unless this is a dry run"""
+    try:
+        size = os.path.getsize(file_path)
+        ds, pixel_offset = header_patch.load_header(file_path)
+        changed = apply_rules(ds, rules)
+        if changed and not dry_run:
+            header_patch.save_header(ds, file_path, pixel_offset)
+        return {'path': file_path, 'status': 'changed' if changed else 'unchanged', 'changed': changed, 'bytes': size}
+    except Exception as e:
+        return {'path': file_path, 'status': 'failed', 'changed': [], 'bytes': 0, 'error': str(e)}
+
+
+def _process_chunk(file_paths, rules, dry_run):
+    return [_process_file(file_path, rules, dry_run) for file_path in file_paths]
+
+
+def _iter_results(file_paths, rules, dry_run, max_workers, cancel=None):
+    """Yield per-file results as they complete, keeping only a few chunks in flight
+
+    Once `cancel` is set no further chunks are started.
+    """
+    if max_workers <= 1 or len(file_paths) < config.BATCH_EDIT_MIN_FILES:
+        for file_path in file_paths:
+            if cancel is not None and cancel.is_set():
+                return
+            yield _process_file(file_path, rules, dry_run)
+        return
+
+    chunksize = max(1, min(64, len(file_paths) // (max_workers * 4)))
+    chunks = (file_paths[start:start + chunksize] for start in range(0, len(file_paths), chunksize))
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        in_flight = deque()
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                break
+            in_flight.append(executor.submit(_process_chunk, chunk, rules, dry_run))
+            if len(in_flight) >= max_workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def run_pipeline(dicom_root, rule_set, studies, dry_run=False, max_workers=None, progress=None, cancel=None):
+    """Apply a parsed rule set to every matching file of the local archive
+
+    Each file is rewritten atomically (header only, pixel data spliced across).
+    A dry run reads headers and counts what would change without writing.
+    Returns a report with counts, per-keyword change totals and throughput.
+    """
+    if max_workers is None:
+        max_workers = config.BATCH_EDIT_WORKERS or os.cpu_count() or 1
+
+    rows = select_instances(dicom_root, rule_set, studies)
+    file_paths = [os.path.join(dicom_root, row['path']) for row in rows]
+    study_of = {file_path: row['study'] for file_path, row in zip(file_paths, rows)}
+    if progress is not None:
+        progress.set_totals(instances=len(file_paths), bytes=sum(row['size'] for row in rows))
+
+    report = {
+        'dry_run': dry_run,
+        'matched': len(file_paths),
+        'changed': 0,
+        'unchanged': 0,
+        'failed': 0,
+        'bytes': 0,
+        'changes_by_keyword': Counter(),
+        'studies_changed': set(),
+        'errors': []
+    }
+    started = time.monotonic()
+    for result in _iter_results(file_paths, rule_set['rules'], dry_run, max_workers, cancel):
+        report[result['status']] += 1
+        report['bytes'] += result['bytes']
+        report['changes_by_keyword'].update(result['changed'])
+        if result['status'] == 'changed':
+            report['studies_changed'].add(study_of[result['path']])
+        elif result['status'] == 'failed' and len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append(f"{os.path.relpath(result['path'], dicom_root)}: {result['error']}")
+        if progress is not None:
+            progress.add_instances(1, result['bytes'])
+    elapsed = time.monotonic() - started
+
+    if not dry_run:
+        for study in report['studies_changed']:
+            catalog.invalidate_study(dicom_root, study)
+
+    processed = report['changed'] + report['unchanged'] + report['failed']
+    report.update(
+        cancelled=report['matched'] - processed,
+        changes_by_keyword=dict(report['changes_by_keyword']),
+        studies_changed=sorted(report['studies_changed']),
+        elapsed=elapsed,
+        files_per_second=processed / elapsed if elapsed > 0 else 0.0,
+        mb_per_second=report['bytes'] / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+    )
+    logging.info(
+        f"Bulk edit{' (dry run)' if dry_run else ''}: {report['matched']} matched, {report['changed']} changed, "
+        f"{report['failed']} failed in {elapsed:.1f}s ({report['files_per_second']:.1f} files/s, "
+        f"{report['mb_per_second']:.1f} MB/s)"
+    )
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a bulk tag editing rule set to a local DICOM archive")
+    parser.add_argument('rules', help="path to a JSON rule set")
+    parser.add_argument('--root', default=os.getenv("DICOM_ROOT", "./dicoms"), help="DICOM root folder")
+    parser.add_argument('--dry-run', action='store_true', help="only count the files that would change")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open(args.rules) as fp:
+        rule_set = parse_rule_set(fp.read())
+    studies = [d for d in os.listdir(args.root) if os.path.isdir(os.path.join(args.root, d))]
+    report = run_pipeline(args.root, rule_set, studies, dry_run=args.dry_run, max_workers=args.workers)
+    print(json.dumps(report, indent=2))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
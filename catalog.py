@@ -0,0 +1,287 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import hashlib
+
+import config
+import dicom_headers
+import metrics
+
+# Header fields kept per instance in the catalog
+INSTANCE_FIELDS = [
+    'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID',
+    'SeriesNumber', 'InstanceNumber', 'Modality',
+    'PatientName', 'PatientID', 'StudyDescription',
+    'AccessionNumber', 'ReferringPhysicianName',
+    'PatientBirthDate', 'StudyDate', 'StudyTime'
+]
+
+# Study-level metadata shown in the browser (taken from the first instance)
+STUDY_FIELDS = [
+    'PatientName', 'PatientID', 'StudyDescription',
+    'AccessionNumber', 'ReferringPhysicianName', 'StudyInstanceUID'
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    study TEXT PRIMARY KEY,
+    signature TEXT NOT NULL,
+    stale INTEGER NOT NULL DEFAULT 0,
+    series_count INTEGER NOT NULL,
+    image_count INTEGER NOT NULL,
+    scanned_at REAL NOT NULL,
+    PatientName TEXT, PatientID TEXT, StudyDescription TEXT,
+    AccessionNumber TEXT, ReferringPhysicianName TEXT, StudyInstanceUID TEXT
+);
+CREATE TABLE IF NOT EXISTS series (
+    study TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    SeriesInstanceUID TEXT, SeriesNumber TEXT, Modality TEXT,
+    instance_count INTEGER NOT NULL,
+    PRIMARY KEY (study, folder)
+);
+CREATE TABLE IF NOT EXISTS instances (
+    path TEXT PRIMARY KEY,
+    study TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    StudyInstanceUID TEXT, SeriesInstanceUID TEXT, SOPInstanceUID TEXT,
+    SeriesNumber TEXT, InstanceNumber TEXT, Modality TEXT,
+    PatientName TEXT, PatientID TEXT, StudyDescription TEXT,
+    AccessionNumber TEXT, ReferringPhysicianName TEXT,
+    PatientBirthDate TEXT, StudyDate TEXT, StudyTime TEXT
+);
+CREATE INDEX IF NOT EXISTS instances_study ON instances (study, position);
+"""
+
+# Bumped whenever SCHEMA changes; older catalogs are dropped and rebuilt from disk
+SCHEMA_VERSION = 2
+
+# Serialises refreshes within this process; SQLite handles other processes
+_refresh_lock = threading.Lock()
+
+
+def get_catalog_path(dicom_root):
+    """Path of the catalog database for a DICOM root"""
+    return os.path.join(dicom_root, config.CATALOG_FILENAME)
+
+
+def connect(dicom_root):
+    """Open the catalog, falling back to an in-memory database if DICOM_ROOT is read-only"""
+    try:
+        conn = sqlite3.connect(get_catalog_path(dicom_root), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+    except sqlite3.Error as e:
+        logging.warning(f"Study catalog unavailable under '{dicom_root}', using in-memory index: {e}")
+        conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS instances; DROP TABLE IF EXISTS series; DROP TABLE IF EXISTS studies;")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def study_signature(study_path):
+    """Fingerprint a study from its directory mtimes and the size and mtime of each instance
+
+    Files rewritten in place (same name, no directory change) alter the signature too.
+    """
+    entries = []
+    stack = [study_path]
+    while stack:
+        current = stack.pop()
+        try:
+            entries.append((os.path.relpath(current, study_path), os.stat(current).st_mtime_ns))
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.dcm'):
+                        stat = entry.stat()
+                        entries.append((os.path.relpath(entry.path, study_path), stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            continue
+    entries.sort()
+    return hashlib.sha1(repr(entries).encode()).hexdigest()
+
+
+def read_instance_fields(file_path):
+    """Read the catalogued header fields of a single instance"""
+    return dicom_headers.read_header_values(file_path, INSTANCE_FIELDS)
+
+
+def _list_instances(study_path):
+    """List DICOM files of a study in os.walk order (same order as get_dicom_files)"""
+    for root, _, files in os.walk(study_path):
+        for file in files:
+            if file.endswith('.dcm'):
+                yield os.path.join(root, file)
+
+
+def _rescan_study(conn, dicom_root, study, signature):
+    """Re-index one study, only re-reading instances whose size or mtime changed"""
+    study_path = os.path.join(dicom_root, study)
+    known = {
+        row['path']: row
+        for row in conn.execute("SELECT * FROM instances WHERE study = ?", (study,))
+    }
+
+    rows = []
+    read_count = 0
+    for position, file_path in enumerate(_list_instances(study_path)):
+        rel_path = os.path.relpath(file_path, dicom_root)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+
+        previous = known.pop(rel_path, None)
+        if previous is not None and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+            fields = {field: previous[field] for field in INSTANCE_FIELDS}
+        else:
+            try:
+                fields = read_instance_fields(file_path)
+            except Exception as e:
+                logging.warning(f"Failed to read metadata for {rel_path}: {e}")
+                fields = {field: '' for field in INSTANCE_FIELDS}
+            read_count += 1
+
+        folder = os.path.dirname(os.path.relpath(file_path, study_path))
+        rows.append((rel_path, study, folder, position, stat.st_mtime_ns, stat.st_size,
+                     *[fields[field] for field in INSTANCE_FIELDS]))
+
+    # Group series by folder, like the folder-based count used by the browser
+    series = {}
+    for row in rows:
+        folder = row[2]
+        if folder not in series:
+            series[folder] = [row[7], row[9], row[11], 0]  # SeriesInstanceUID, SeriesNumber, Modality
+        series[folder][3] += 1
+
+    series_folders = [folder for folder in series if folder]
+    series_count = len(series_folders) if series_folders else 1  # At least 1 series if files exist
+
+    first = dict(zip(INSTANCE_FIELDS, rows[0][6:])) if rows else {field: '' for field in INSTANCE_FIELDS}
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM instances WHERE study = ?", (study,))
+        conn.execute("DELETE FROM series WHERE study = ?", (study,))
+        placeholders = ", ".join("?" * (6 + len(INSTANCE_FIELDS)))
+        conn.executemany(
+            f"INSERT INTO instances (path, study, folder, position, mtime_ns, size, {', '.join(INSTANCE_FIELDS)}) "
+            f"VALUES ({placeholders})",
+            rows
+        )
+        conn.executemany(
+            "INSERT INTO series (study, folder, SeriesInstanceUID, SeriesNumber, Modality, instance_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(study, folder, *values) for folder, values in series.items()]
+        )
+        conn.execute(
+            f"INSERT OR REPLACE INTO studies (study, signature, stale, series_count, image_count, scanned_at, "
+            f"{', '.join(STUDY_FIELDS)}) VALUES (?, ?, 0, ?, ?, ?, {', '.join('?' * len(STUDY_FIELDS))})",
+            (study, signature, series_count, len(rows), time.time(),
+             *[first[field] for field in STUDY_FIELDS])
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    logging.debug(f"Catalog rescanned study '{study}': {len(rows)} instances, {read_count} headers read")
+
+
+def refresh_catalog(conn, dicom_root, studies, prune=False):
+    """Bring the catalog up to date for the given study folders
+
+    With `prune`, `studies` is the complete list of study folders on disk and
+    indexed studies missing from it are dropped; otherwise other studies are
+    left untouched.
+    """
+    with _refresh_lock:
+        indexed = {
+            row['study']: row
+            for row in conn.execute("SELECT study, signature, stale FROM studies")
+        }
+
+        for study in studies:
+            signature = study_signature(os.path.join(dicom_root, study))
+            row = indexed.pop(study, None)
+            if row is None or row['stale'] or row['signature'] != signature:
+                metrics.CACHE_REQUESTS.inc('catalog', 'miss')
+                _rescan_study(conn, dicom_root, study, signature)
+            else:
+                metrics.CACHE_REQUESTS.inc('catalog', 'hit')
+
+        # Drop studies that no longer exist on disk
+        if prune and indexed:
+            conn.execute("BEGIN IMMEDIATE")
+            for study in indexed:
+                conn.execute("DELETE FROM instances WHERE study = ?", (study,))
+                conn.execute("DELETE FROM series WHERE study = ?", (study,))
+                conn.execute("DELETE FROM studies WHERE study = ?", (study,))
+            conn.execute("COMMIT")
+
+
+def get_studies(dicom_root, studies):
+    """Return catalogued study rows and their file lists, refreshing changed studies first
+
+    `studies` must list every study folder under `dicom_root`; the others are dropped.
+    """
+    conn = connect(dicom_root)
+    try:
+        refresh_catalog(conn, dicom_root, studies, prune=True)
+
+        files = {}
+        for row in conn.execute("SELECT study, path FROM instances ORDER BY study, position"):
+            files.setdefault(row['study'], []).append(row['path'])
+
+        result = {}
+        for row in conn.execute("SELECT * FROM studies"):
+            result[row['study']] = {
+                'files': files.get(row['study'], []),
+                'metadata': {field: row[field] or '' for field in STUDY_FIELDS},
+                'series_count': row['series_count'],
+                'image_count': row['image_count']
+            }
+        return result
+    finally:
+        conn.close()
+
+
+def get_instances(dicom_root, studies):
+    """Return catalogued instance rows (path, study, size and INSTANCE_FIELDS) for the given studies
+
+    Only these studies are refreshed; the rest of the catalog is left as it is.
+    """
+    conn = connect(dicom_root)
+    try:
+        refresh_catalog(conn, dicom_root, studies)
+        wanted = set(studies)
+        return [
+            dict(row)
+            for row in conn.execute(
+                f"SELECT path, study, size, {', '.join(INSTANCE_FIELDS)} FROM instances ORDER BY study, position"
+            )
+            if row['study'] in wanted
+        ]
+    finally:
+        conn.close()
+
+
+def invalidate_study(dicom_root, study):
+    """Mark a study for rescanning after files were modified in place"""
+    try:
+        conn = connect(dicom_root)
+        try:
+            conn.execute("UPDATE studies SET stale = 1 WHERE study = ?", (study,))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logging.warning(f"Failed to invalidate catalog entry for study '{study}': {e}")
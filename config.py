@@ -8,3 +8,90 @@ AZURE_DICOM_ENDPOINT = os.getenv("AZURE_DICOM_ENDPOINT")
 AZURE_DICOM_CLIENT_ID = os.getenv("AZURE_DICOM_CLIENT_ID")
 AZURE_DICOM_SECRET = os.getenv("AZURE_DICOM_SECRET")
 AZURE_TENANT_ID = os.getenv("AZURE_TENANT_ID")
+
+# Study catalog (SQLite index kept under DICOM_ROOT)
+CATALOG_FILENAME = os.getenv("CATALOG_FILENAME", ".dicom_catalog.sqlite")
+
+# Batch study edits (0 = one worker process per CPU)
+BATCH_EDIT_WORKERS = int(os.getenv("BATCH_EDIT_WORKERS", "0"))
+BATCH_EDIT_MIN_FILES = int(os.getenv("BATCH_EDIT_MIN_FILES", "16"))
+
+# STOW-RS upload streaming buffer (bytes read from disk per chunk)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# STOW-RS upload batching, concurrency and retries
+UPLOAD_BATCH_MAX_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "100"))
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_RETRIES = int(os.getenv("UPLOAD_RETRIES", "3"))
+UPLOAD_RETRY_BACKOFF = float(os.getenv("UPLOAD_RETRY_BACKOFF", "1.0"))
+
+# WADO-RS download streaming chunk size in bytes
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Parallel WADO-RS downloads (1 = a single study-level request)
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_RETRY_BACKOFF = float(os.getenv("DOWNLOAD_RETRY_BACKOFF", "1.0"))
+
+# Azure access tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+
+# Fixed bearer token used instead of Azure AD (for the local DICOMweb stand-in or pre-issued tokens)
+DICOM_STATIC_TOKEN = os.getenv("DICOM_STATIC_TOKEN", "")
+
+# Shared DICOMweb HTTP session: pool size, timeouts (seconds) and transport retries
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+
+# QIDO-RS study search paging
+QIDO_PAGE_SIZE = int(os.getenv("QIDO_PAGE_SIZE", "50"))
+QIDO_MAX_PAGE_SIZE = int(os.getenv("QIDO_MAX_PAGE_SIZE", "200"))
+
+# Remote study search cache: entries kept and seconds before they expire (0 disables)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "60"))
+
+# Background jobs (uploads, downloads, study edits): concurrent jobs, job table location
+# and how many instances between progress writes to the table
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", ".dicom_jobs.sqlite")
+JOB_PROGRESS_SAVE_EVERY = int(os.getenv("JOB_PROGRESS_SAVE_EVERY", "100"))
+
+# Header values larger than this many bytes are left on disk until read (0 reads everything)
+DEFER_SIZE = int(os.getenv("DEFER_SIZE", str(64 * 1024)))
+
+# Image previews: thumbnail size in pixels, disk cache location and cap, background render threads
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", "1024"))
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", ".dicom_previews")
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "4"))
+
+# Pre-upload integrity scan: worker processes (0 = one per CPU) and minimum files before using the pool
+INTEGRITY_WORKERS = int(os.getenv("INTEGRITY_WORKERS", "0"))
+INTEGRITY_MIN_FILES = int(os.getenv("INTEGRITY_MIN_FILES", "500"))
+
+# Prometheus-style /metrics endpoint and in-process counters
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Per-request profiling: default for the session setting, where profiles are saved, how many are kept,
+# and the budget of profiles allowed per window (seconds)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".dicom_profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_BUDGET = int(os.getenv("PROFILE_BUDGET", "10"))
+PROFILE_BUDGET_WINDOW = float(os.getenv("PROFILE_BUDGET_WINDOW", "3600"))
+
+# Application log file, lines shown by the log viewer and how often the live stream checks for new lines
+LOG_FILE = os.getenv("LOG_FILE", "dicom_editor.log")
+LOG_TAIL_LINES = int(os.getenv("LOG_TAIL_LINES", "500"))
+LOG_STREAM_POLL_INTERVAL = float(os.getenv("LOG_STREAM_POLL_INTERVAL", "0.5"))
+
+# Logging: level, size-based rotation of LOG_FILE and one JSON object per record instead of plain text
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
@@ -0,0 +1,31 @@
+import pydicom
+
+import metrics
+
+# Attributes used to identify a study in the browser, the study editor and upload checks
+STUDY_FIELDS = [
+    'StudyInstanceUID', 'PatientName', 'PatientID', 'PatientBirthDate',
+    'AccessionNumber', 'StudyDescription', 'ReferringPhysicianName',
+    'StudyDate', 'StudyTime'
+]
+
+
+def read_header(source, tags=None):
+    """Read a DICOM header without pixel data, optionally limited to specific tags
+
+    `source` can be a file path or a binary file-like object. When `tags` is given
+    only those elements are parsed; other values are skipped rather than read.
+    """
+    with metrics.PYDICOM_SECONDS.time('dcmread', 'header'):
+        return pydicom.dcmread(
+            source,
+            stop_before_pixels=True,
+            force=True,
+            specific_tags=list(tags) if tags else None
+        )
+
+
+def read_header_values(source, keywords):
+    """Read the given keywords from a DICOM header as stripped strings"""
+    ds = read_header(source, keywords)
+    return {keyword: str(getattr(ds, keyword, "")).strip() for keyword in keywords}
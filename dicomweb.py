@@ -0,0 +1,461 @@
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.filepost import choose_boundary
+from urllib3.util.retry import Retry
+
+import config
+import header_patch
+import metrics
+
+# Responses worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# DICOM JSON tags of the study attributes shown in the study list
+STUDY_RESULT_FIELDS = {
+    'study_instance_uid': '0020000D',
+    'patient_name': '00100010',
+    'patient_id': '00100020',
+    'patient_birth_date': '00100030',
+    'accession_number': '00080050',
+    'study_description': '00081030',
+    'referring_physician_name': '00080090',
+    'study_date': '00080020',
+    'study_time': '00080030'
+}
+
+
+def _first_value(item, tag):
+    """First value of a DICOM JSON attribute; person names use their Alphabetic form"""
+    values = item.get(tag, {}).get('Value') or ['']
+    value = values[0]
+    if isinstance(value, dict):
+        return value.get('Alphabetic', '')
+    return value
+
+
+def parse_study_result(item):
+    """Convert a QIDO-RS/metadata DICOM JSON object into a study dict for display"""
+    return {key: _first_value(item, tag) for key, tag in STUDY_RESULT_FIELDS.items()}
+
+
+class DicomWebClient:
+    """Pooled, keep-alive HTTP session for one DICOMweb service
+
+    Idempotent requests are retried at the transport level on connection errors
+    and gateway failures. Callers that stream request bodies do their own retries.
+    """
+
+    def __init__(self, base_url, pool_size=None, connect_timeout=None, read_timeout=None, retries=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (
+            config.HTTP_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            config.HTTP_READ_TIMEOUT if read_timeout is None else read_timeout
+        )
+        pool_size = pool_size or config.HTTP_POOL_SIZE
+        retry = Retry(
+            total=config.HTTP_RETRIES if retries is None else retries,
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=['GET', 'HEAD', 'OPTIONS'],
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def url(self, path):
+        """Absolute URL for a path relative to the service root (e.g. '/v2/studies')"""
+        return f'{self.base_url}{path}'
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Connection reuse counters summed over the session's connection pools"""
+        requests_sent, connections_opened = 0, 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+        return {
+            'requests': requests_sent,
+            'connections_opened': connections_opened,
+            'connections_reused': max(0, requests_sent - connections_opened)
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url):
+    """Return the shared client for a DICOMweb endpoint, creating it on first use"""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = DicomWebClient(base_url)
+            _clients[base_url] = client
+        return client
+
+
+def get_client_stats():
+    """Connection reuse counters for every DICOMweb client, keyed by endpoint"""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {base_url: client.stats() for base_url, client in clients.items()}
+
+
+def _client_metrics(field):
+    return lambda: {(base_url,): stats[field] for base_url, stats in get_client_stats().items()}
+
+
+metrics.register_collector(
+    'dicom_editor_dicomweb_requests_total', 'HTTP requests sent to each DICOMweb endpoint',
+    'counter', ('endpoint',), _client_metrics('requests')
+)
+metrics.register_collector(
+    'dicom_editor_dicomweb_connections_opened_total', 'HTTP connections opened to each DICOMweb endpoint',
+    'counter', ('endpoint',), _client_metrics('connections_opened')
+)
+
+
+def multipart_related_content_type(boundary):
+    """Content-Type header for a STOW-RS multipart/related request body"""
+    return f'multipart/related; type="application/dicom"; boundary={boundary}'
+
+
+def iter_file_range(file_path, offset=0, chunk_size=None):
+    """Yield the bytes of a file from `offset` to the end in chunks of `chunk_size`"""
+    chunk_size = chunk_size or config.UPLOAD_CHUNK_SIZE
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_instance(file_path, rewrite=None, chunk_size=None):
+    """Yield one instance from disk, applying `rewrite(ds)` to its header first if given
+
+    Only the header of a rewritten instance is held in memory; its pixel data is
+    streamed from the original file.
+    """
+    if rewrite is None:
+        yield from iter_file_range(file_path, 0, chunk_size)
+        return
+
+    ds, pixel_offset = header_patch.load_header(file_path)
+    rewrite(ds)
+    yield header_patch.encode_header(ds)
+    # Deflated files are read and re-encoded in full, so there is no tail to stream
+    if pixel_offset is not None:
+        yield from iter_file_range(file_path, pixel_offset, chunk_size)
+
+
+def iter_multipart_related(file_paths, boundary, rewrite=None, chunk_size=None):
+    """Yield a multipart/related body for `file_paths` without materialising it in memory"""
+    for file_path in file_paths:
+        yield f'--{boundary}\r\nContent-Type: application/dicom\r\n\r\n'.encode()
+        yield from iter_instance(file_path, rewrite, chunk_size)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def make_batches(file_paths, max_files=None, max_bytes=None):
+    """Split files into batches bounded by instance count and total size"""
+    max_files = max_files or config.UPLOAD_BATCH_MAX_FILES
+    max_bytes = max_bytes or config.UPLOAD_BATCH_MAX_BYTES
+    batches = []
+    batch, batch_bytes = [], 0
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        if batch and (len(batch) >= max_files or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(file_path)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def retry_delay(attempt, response=None, backoff=None):
+    """Exponential backoff with jitter, honouring a numeric Retry-After header"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return float(retry_after)
+    backoff = config.UPLOAD_RETRY_BACKOFF if backoff is None else backoff
+    return backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+def post_batch(client, url, headers, batch, rewrite=None):
+    """POST one batch as a streamed STOW-RS request, retrying transient failures"""
+    status_code, error = None, None
+    for attempt in range(config.UPLOAD_RETRIES + 1):
+        boundary = choose_boundary()
+        batch_headers = dict(headers)
+        batch_headers['Content-Type'] = multipart_related_content_type(boundary)
+        response = None
+        try:
+            response = client.post(
+                url,
+                data=iter_multipart_related(batch, boundary, rewrite=rewrite),
+                headers=batch_headers
+            )
+            status_code = response.status_code
+            if status_code in (200, 202):
+                return {'ok': True, 'status_code': status_code, 'attempts': attempt + 1, 'error': None}
+            error = f"Status code: {status_code}"
+            if status_code not in RETRYABLE_STATUS_CODES:
+                break
+        except requests.RequestException as e:
+            error = str(e)
+
+        if attempt < config.UPLOAD_RETRIES:
+            delay = retry_delay(attempt, response)
+            logging.warning(f"STOW-RS batch of {len(batch)} instance(s) failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    return {'ok': False, 'status_code': status_code, 'attempts': attempt + 1, 'error': error}
+
+
+def upload_in_batches(client, url, headers, file_paths, rewrite=None, progress=None, cancel=None):
+    """Upload files as size/count-bounded batches over concurrent connections
+
+    `progress` (a TransferProgress) is updated as batches complete. Once the
+    `cancel` event is set, batches that have not started yet are skipped.
+    Returns a report merged over all batches.
+    """
+    batches = make_batches(file_paths)
+    report = {
+        'batches': len(batches),
+        'failed_batches': 0,
+        'cancelled_batches': 0,
+        'instances': len(file_paths),
+        'uploaded_instances': 0,
+        'bytes': 0,
+        'errors': []
+    }
+    if progress is not None:
+        progress.set_totals(
+            items=len(batches),
+            instances=len(file_paths),
+            bytes=sum(os.path.getsize(file_path) for file_path in file_paths)
+        )
+
+    def upload(batch):
+        if cancel is not None and cancel.is_set():
+            return None
+        return post_batch(client, url, headers, batch, rewrite)
+
+    with ThreadPoolExecutor(max_workers=max(1, config.UPLOAD_CONCURRENCY)) as executor:
+        futures = {executor.submit(upload, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            result = future.result()
+            if result is None:
+                report['cancelled_batches'] += 1
+            elif result['ok']:
+                batch_bytes = sum(os.path.getsize(file_path) for file_path in batch)
+                report['uploaded_instances'] += len(batch)
+                report['bytes'] += batch_bytes
+                metrics.TRANSFER_INSTANCES.inc('upload', amount=len(batch))
+                metrics.TRANSFER_BYTES.inc('upload', amount=batch_bytes)
+                if progress is not None:
+                    progress.add_instances(len(batch), batch_bytes)
+                    progress.item_done()
+            else:
+                report['failed_batches'] += 1
+                report['errors'].append(result['error'])
+                logging.error(
+                    f"STOW-RS batch of {len(batch)} instance(s) failed after "
+                    f"{result['attempts']} attempt(s): {result['error']}"
+                )
+
+    report['success'] = report['failed_batches'] == 0 and report['cancelled_batches'] == 0
+    return report
+
+
+class TransferProgress:
+    """Thread-safe instance/byte counters shared by the workers of one transfer"""
+
+    def __init__(self, items_total=0, on_progress=None, every=None):
+        """`on_progress()` is called (outside the lock) each time another `every` instances are counted"""
+        self._lock = threading.Lock()
+        self.on_progress = on_progress
+        self.every = every
+        self.started = time.monotonic()
+        self.items_total = items_total
+        self.items_done = 0
+        self.instances_total = 0
+        self.instances = 0
+        self.bytes_total = 0
+        self.bytes = 0
+        # Sequence numbers keep increasing when counts are rolled back, so they stay unique
+        self._sequence = 0
+
+    def set_totals(self, items=None, instances=None, bytes=None):
+        """Record the expected amount of work, where it is known up front"""
+        with self._lock:
+            if items is not None:
+                self.items_total = items
+            if instances is not None:
+                self.instances_total = instances
+            if bytes is not None:
+                self.bytes_total = bytes
+
+    def add_instance(self, size):
+        """Count one stored instance and return its sequence number"""
+        with self._lock:
+            index = self._sequence
+            self._sequence += 1
+            before = self.instances
+            self.instances += 1
+            self.bytes += size
+        self._notify(before, before + 1)
+        return index
+
+    def add_instances(self, count, size):
+        with self._lock:
+            before = self.instances
+            self.instances += count
+            self.bytes += size
+        self._notify(before, before + count)
+
+    def remove_instances(self, count, size):
+        """Take back instances counted by an attempt that is about to be retried"""
+        with self._lock:
+            self.instances -= count
+            self.bytes -= size
+
+    def _notify(self, before, after):
+        if self.on_progress is not None and self.every and before // self.every != after // self.every:
+            self.on_progress()
+
+    def item_done(self):
+        with self._lock:
+            self.items_done += 1
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                'items_done': self.items_done,
+                'items_total': self.items_total,
+                'instances': self.instances,
+                'instances_total': self.instances_total,
+                'bytes': self.bytes,
+                'bytes_total': self.bytes_total,
+                'elapsed': elapsed,
+                'bytes_per_second': self.bytes / elapsed if elapsed > 0 else 0.0
+            }
+
+
+def get_boundary(content_type):
+    """Extract the boundary parameter from a multipart Content-Type header"""
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'boundary':
+            return value.strip('"')
+    raise ValueError(f"No boundary in Content-Type: {content_type}")
+
+
+def _parse_part_headers(block):
+    """Parse a part's header block into a dict with lower-case names"""
+    headers = {}
+    for line in block.decode('latin-1').split('\r\n'):
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def iter_multipart_parts(chunks, boundary, directory):
+    """Parse a streamed multipart body, writing each part straight to a temp file
+
+    Yields `(headers, temp_path)` as each part completes. The caller owns the
+    temp file and must move or delete it. At most one chunk plus the delimiter
+    length is buffered, whatever the size of the parts.
+    """
+    delimiter = b'\r\n--' + boundary.encode('latin-1')
+    keep = len(delimiter) - 1
+    buffer = bytearray(b'\r\n')  # lets the first boundary match the same delimiter
+    chunks = iter(chunks)
+    state = 'preamble'
+    out, temp_path, headers = None, None, None
+
+    def fill():
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Multipart stream ended unexpectedly")
+        buffer.extend(chunk)
+
+    try:
+        while True:
+            if state == 'preamble':
+                index = buffer.find(delimiter)
+                if index < 0:
+                    del buffer[:-keep]
+                    fill()
+                    continue
+                del buffer[:index + len(delimiter)]
+                state = 'delimiter'
+
+            elif state == 'delimiter':
+                if len(buffer) < 2:
+                    fill()
+                    continue
+                if buffer[:2] == b'--':
+                    return  # closing delimiter
+                state = 'headers'
+
+            elif state == 'headers':
+                index = buffer.find(b'\r\n\r\n')
+                if index < 0:
+                    fill()
+                    continue
+                headers = _parse_part_headers(bytes(buffer[:index]))
+                del buffer[:index + 4]
+                fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+                out = os.fdopen(fd, 'wb')
+                state = 'body'
+
+            elif state == 'body':
+                index = buffer.find(delimiter)
+                if index >= 0:
+                    out.write(buffer[:index])
+                    del buffer[:index + len(delimiter)]
+                    out.close()
+                    completed, out, temp_path = temp_path, None, None
+                    yield headers, completed
+                    state = 'delimiter'
+                else:
+                    if len(buffer) > keep:
+                        out.write(buffer[:-keep])
+                        del buffer[:-keep]
+                    fill()
+    finally:
+        if out is not None:
+            out.close()
+            os.remove(temp_path)
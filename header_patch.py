@@ -0,0 +1,219 @@
+import os
+import shutil
+import struct
+import tempfile
+from io import BytesIO
+
+import pydicom
+from pydicom.dataelem import RawDataElement
+from pydicom.tag import Tag
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+
+import config
+import metrics
+
+# Chunk size for the userspace copy fallback
+COPY_CHUNK_SIZE = 1024 * 1024
+
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Explicit VRs encoded with a 2-byte reserved field and a 4-byte length
+EXTENDED_LENGTH_VRS = {'OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'SQ', 'UC', 'UN', 'UR', 'UT'}
+
+
+def load_header(file_path, defer_size=None):
+    """Read a file's header up to PixelData
+
+    Returns `(ds, pixel_offset)` where `pixel_offset` is the byte offset of the
+    PixelData element (or the end of the file if there is none). Header values
+    larger than `defer_size` (default DEFER_SIZE) stay on disk until accessed.
+    Deflated files cannot be spliced, so they are read in full and
+    `pixel_offset` is None.
+    """
+    if defer_size is None:
+        defer_size = config.DEFER_SIZE or None
+    with open(file_path, 'rb') as fp, metrics.PYDICOM_SECONDS.time('dcmread', 'header'):
+        ds = pydicom.dcmread(fp, stop_before_pixels=True, force=True, defer_size=defer_size)
+        pixel_offset = fp.tell()
+
+    transfer_syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    if transfer_syntax == DeflatedExplicitVRLittleEndian:
+        with metrics.PYDICOM_SECONDS.time('dcmread', 'full'):
+            return pydicom.dcmread(file_path, force=True), None
+    return ds, pixel_offset
+
+
+def _skip_items(fp, endian, end):
+    """Skip the items of an undefined-length value; returns the bytes skipped, or None
+    if an item itself has undefined length"""
+    start = fp.tell()
+    while fp.tell() + 8 <= end:
+        group, element, length = struct.unpack(endian + 'HHL', fp.read(8))
+        if (group, element) == (0xFFFE, 0xE0DD):
+            return fp.tell() - start
+        if length == UNDEFINED_LENGTH:
+            return None
+        fp.seek(length, os.SEEK_CUR)
+    return None
+
+
+def _element_headers(fp, endian, implicit, end):
+    """Yield `(tag, vr, length, value_tell)` for each element from the current position to `end`
+
+    The caller moves `fp` past each value before asking for the next element.
+    """
+    while fp.tell() + 8 <= end:
+        group, element = struct.unpack(endian + 'HH', fp.read(4))
+        vr = None
+        if implicit:
+            length, = struct.unpack(endian + 'L', fp.read(4))
+        else:
+            vr = fp.read(2).decode('ascii', 'replace')
+            if vr in EXTENDED_LENGTH_VRS:
+                length, = struct.unpack(endian + '2xL', fp.read(6))
+            else:
+                length, = struct.unpack(endian + 'H', fp.read(2))
+        yield Tag(group, element), vr, length, fp.tell()
+
+
+def defer_trailing_elements(ds, file_path, pixel_offset):
+    """Add PixelData and any later elements to `ds` as deferred (unread) elements
+
+    Only element headers are read. Values, including encapsulated pixel data,
+    are loaded from the file by pydicom if and when they are accessed.
+    """
+    endian = '<' if ds.is_little_endian else '>'
+    implicit = ds.is_implicit_VR
+    with open(file_path, 'rb') as fp:
+        end = os.fstat(fp.fileno()).st_size
+        fp.seek(pixel_offset)
+        for tag, vr, length, value_tell in _element_headers(fp, endian, implicit, end):
+            if length == UNDEFINED_LENGTH:
+                skipped = _skip_items(fp, endian, end)
+                if skipped is None:
+                    break
+                # Undefined-length values cannot be re-read lazily, so keep the size only
+                ds[tag] = RawDataElement(tag, vr, skipped, b'', value_tell, implicit, ds.is_little_endian)
+                continue
+
+            ds[tag] = RawDataElement(
+                tag, vr, length, None if length else b'', value_tell, implicit, ds.is_little_endian
+            )
+            fp.seek(length, os.SEEK_CUR)
+    return ds
+
+
+def check_trailing_elements(ds, src, pixel_offset, end):
+    """Raise ValueError if PixelData or a later element of `src` runs past `end`
+
+    Walks element headers only, so a truncated source is caught before its
+    tail is copied into a shorter file.
+    """
+    endian = '<' if ds.is_little_endian else '>'
+    src.seek(pixel_offset)
+    for tag, _, length, _ in _element_headers(src, endian, ds.is_implicit_VR, end):
+        if length == UNDEFINED_LENGTH:
+            if _skip_items(src, endian, end) is None:
+                if src.tell() + 8 <= end:
+                    return  # an item of undefined length: not walked any further
+                raise ValueError(f"Element {tag} has no sequence delimiter before the end of the file")
+        else:
+            src.seek(length, os.SEEK_CUR)
+    if src.tell() != end:
+        raise ValueError(f"File is truncated: its last element is incomplete at byte {end}")
+
+
+def load_deferred(file_path):
+    """Open a file for display with every large value, pixel data included, left on disk"""
+    ds, pixel_offset = load_header(file_path)
+    if pixel_offset is not None:
+        defer_trailing_elements(ds, file_path, pixel_offset)
+    return ds
+
+
+def encode_header(ds):
+    """Encode a header-only dataset exactly like the original file (preamble, meta, encoding)"""
+    with BytesIO() as buffer, metrics.PYDICOM_SECONDS.time('dcmwrite', 'header'):
+        pydicom.dcmwrite(buffer, ds, write_like_original=True)
+        return buffer.getvalue()
+
+
+def _splice(src, dst, offset, count):
+    """Append `count` bytes of `src` starting at `offset` to `dst`, in-kernel where possible
+
+    Raises ValueError if `src` ends before `count` bytes were copied.
+    """
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    remaining = count
+
+    if remaining > 0 and hasattr(os, 'copy_file_range'):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, remaining, offset_src=offset)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass  # e.g. cross-filesystem on older kernels; fall through
+
+    if remaining > 0 and hasattr(os, 'sendfile'):
+        try:
+            while remaining > 0:
+                copied = os.sendfile(dst_fd, src_fd, offset, remaining)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass
+
+    while remaining > 0:
+        chunk = os.pread(src_fd, min(remaining, COPY_CHUNK_SIZE), offset)
+        if not chunk:
+            break
+        written = 0
+        while written < len(chunk):
+            written += os.write(dst_fd, chunk[written:])
+        offset += len(chunk)
+        remaining -= len(chunk)
+
+    if remaining > 0:
+        raise ValueError(f"Source ended {remaining} bytes short of the expected pixel data")
+
+
+def write_temp(ds, file_path, pixel_offset):
+    """Write the modified header plus the original pixel payload to a temp file next to `file_path`
+
+    Returns the temp file path; the caller moves it into place with os.replace.
+    Raises ValueError, leaving no temp file, if the source is truncated.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(file_path),
+        prefix=f".{os.path.basename(file_path)}.",
+        suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            if pixel_offset is None:
+                with metrics.PYDICOM_SECONDS.time('dcmwrite', 'full'):
+                    pydicom.dcmwrite(dst, ds, write_like_original=True)
+            else:
+                with open(file_path, 'rb') as src:
+                    size = os.fstat(src.fileno()).st_size
+                    check_trailing_elements(ds, src, pixel_offset, size)
+                    dst.write(encode_header(ds))
+                    dst.flush()
+                    _splice(src, dst, pixel_offset, size - pixel_offset)
+            dst.flush()
+            os.fsync(dst.fileno())
+        shutil.copymode(file_path, temp_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def save_header(ds, file_path, pixel_offset):
+    """Atomically replace `file_path` with the modified header and its untouched pixel data"""
+    os.replace(write_temp(ds, file_path, pixel_offset), file_path)
@@ -0,0 +1,188 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import catalog
+import config
+import dicom_headers
+import metrics
+
+# Study-level attributes the DICOM service needs on every instance
+REQUIRED_FIELDS = ['StudyInstanceUID', 'PatientName', 'PatientID', 'AccessionNumber']
+
+# Instance-level identifiers STOW-RS rejects an instance without
+INSTANCE_UID_FIELDS = ['SOPInstanceUID', 'SOPClassUID']
+
+SCAN_FIELDS = REQUIRED_FIELDS + INSTANCE_UID_FIELDS + ['SeriesInstanceUID']
+
+# Attributes that must have a single value across the whole study
+CONSISTENT_FIELDS = ['StudyInstanceUID', 'PatientID']
+
+# Example paths (and problem lines) kept per kind of problem in a report
+MAX_EXAMPLES = 5
+
+
+def is_missing(value):
+    """Empty values and the 'n/a' placeholder count as missing"""
+    value = (value or '').strip()
+    return not value or value.lower() == 'n/a'
+
+
+def list_instances(study_path):
+    """Every .dcm file under a study folder, sorted"""
+    return sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(study_path)
+        for file in files
+        if file.endswith('.dcm')
+    )
+
+
+def _scan_file(file_path):
+    """Header values of one instance as a tuple in SCAN_FIELDS order, or an error string"""
+    try:
+        values = dicom_headers.read_header_values(file_path, SCAN_FIELDS)
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return tuple(values[field] for field in SCAN_FIELDS)
+
+
+def _scan_chunk(file_paths):
+    return [_scan_file(file_path) for file_path in file_paths]
+
+
+def scan_headers(file_paths, max_workers=None):
+    """Read the scanned attributes of every file, in a process pool for large studies
+
+    Results come back in `file_paths` order.
+    """
+    if max_workers is None:
+        max_workers = config.INTEGRITY_WORKERS or os.cpu_count() or 1
+    if max_workers <= 1 or len(file_paths) < config.INTEGRITY_MIN_FILES:
+        return _scan_chunk(file_paths)
+
+    chunksize = max(1, min(256, len(file_paths) // (max_workers * 4)))
+    chunks = [file_paths[start:start + chunksize] for start in range(0, len(file_paths), chunksize)]
+    context = multiprocessing.get_context('spawn')
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        for chunk_results in executor.map(_scan_chunk, chunks):
+            results.extend(chunk_results)
+    return results
+
+
+def build_report(study, rel_paths, results):
+    """Check scanned headers for unreadable files, missing fields, mixed study attributes and duplicate instances"""
+    # One column per attribute; paths are referred to by index
+    unreadable = []
+    columns = {field: [] for field in SCAN_FIELDS}
+    rows = []
+    for index, result in enumerate(results):
+        if isinstance(result, str):
+            unreadable.append((index, result))
+            continue
+        rows.append(index)
+        for field, value in zip(SCAN_FIELDS, result):
+            columns[field].append(value)
+
+    problems = []
+    if not rel_paths:
+        problems.append("Study has no DICOM files")
+    if unreadable:
+        examples = ', '.join(f"{rel_paths[index]} ({error})" for index, error in unreadable[:MAX_EXAMPLES])
+        problems.append(f"{len(unreadable)} file(s) could not be read: {examples}")
+
+    missing = {}
+    for field in REQUIRED_FIELDS + INSTANCE_UID_FIELDS:
+        positions = [position for position, value in enumerate(columns[field]) if is_missing(value)]
+        if positions:
+            missing[field] = len(positions)
+            examples = ', '.join(rel_paths[rows[position]] for position in positions[:MAX_EXAMPLES])
+            problems.append(f"{field} missing in {len(positions)} file(s), e.g. {examples}")
+
+    distinct = {}
+    for field in CONSISTENT_FIELDS:
+        counts = Counter(value for value in columns[field] if not is_missing(value))
+        distinct[field] = len(counts)
+        if len(counts) > 1:
+            values = ', '.join(f"{value} ({count})" for value, count in counts.most_common(MAX_EXAMPLES))
+            problems.append(f"{len(counts)} different {field} values in one study: {values}")
+
+    first_seen = {}
+    duplicates = []
+    for position, uid in enumerate(columns['SOPInstanceUID']):
+        if is_missing(uid):
+            continue
+        if uid in first_seen:
+            duplicates.append((uid, first_seen[uid], position))
+        else:
+            first_seen[uid] = position
+    if duplicates:
+        examples = ', '.join(
+            f"{rel_paths[rows[first]]} = {rel_paths[rows[second]]}" for _, first, second in duplicates[:MAX_EXAMPLES]
+        )
+        problems.append(f"{len(duplicates)} duplicate SOPInstanceUID(s): {examples}")
+
+    return {
+        'study': study,
+        'ok': not problems,
+        'problems': problems,
+        'instances': len(rel_paths),
+        'unreadable': len(unreadable),
+        'missing': missing,
+        'distinct': distinct,
+        'series': len(set(columns['SeriesInstanceUID'])),
+        'duplicate_sop_instances': len(duplicates)
+    }
+
+
+class VerdictCache:
+    """Integrity reports per study folder, valid while the folder's directory signature is unchanged"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, study_path, signature):
+        with self._lock:
+            entry = self._entries.get(study_path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        return None
+
+    def put(self, study_path, signature, report):
+        with self._lock:
+            self._entries[study_path] = (signature, report)
+
+
+verdict_cache = VerdictCache()
+
+
+def check_study(study_path, max_workers=None, use_cache=True):
+    """Scan every instance of a local study and report whether it is consistent enough to upload"""
+    study_path = os.path.abspath(study_path)
+    signature = catalog.study_signature(study_path)
+    if use_cache:
+        cached = verdict_cache.get(study_path, signature)
+        if cached is not None:
+            metrics.CACHE_REQUESTS.inc('integrity', 'hit')
+            return dict(cached, cached=True)
+        metrics.CACHE_REQUESTS.inc('integrity', 'miss')
+
+    started = time.monotonic()
+    file_paths = list_instances(study_path)
+    results = scan_headers(file_paths, max_workers)
+    report = build_report(
+        os.path.basename(study_path), [os.path.relpath(path, study_path) for path in file_paths], results
+    )
+    report['elapsed'] = time.monotonic() - started
+    verdict_cache.put(study_path, signature, report)
+    logging.info(
+        f"Integrity scan of '{study_path}': {report['instances']} instance(s) in {report['elapsed']:.2f}s, "
+        f"{len(report['problems'])} problem(s)"
+    )
+    return dict(report, cached=False)
@@ -0,0 +1,217 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import dicomweb
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    instances INTEGER NOT NULL DEFAULT 0,
+    instances_total INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    bytes_total INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+"""
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class Job:
+    """A unit of background work with live progress counters and a cancel flag"""
+
+    def __init__(self, kind, title):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.title = title
+        self.status = 'queued'
+        self.message = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = dicomweb.TransferProgress(every=config.JOB_PROGRESS_SAVE_EVERY)
+        self.cancel_event = threading.Event()
+
+    def eta(self, stats):
+        """Seconds left, extrapolated from bytes, instances or items done so far"""
+        if self.status != 'running':
+            return None
+        for done, total in (
+            (stats['bytes'], stats['bytes_total']),
+            (stats['instances'], stats['instances_total']),
+            (stats['items_done'], stats['items_total'])
+        ):
+            if total and done:
+                return stats['elapsed'] * (total - done) / done
+        return None
+
+    def to_dict(self):
+        stats = self.progress.snapshot()
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'title': self.title,
+            'status': self.status,
+            'message': self.message,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cancel_requested': self.cancel_event.is_set(),
+            'instances': stats['instances'],
+            'instances_total': stats['instances_total'],
+            'bytes': stats['bytes'],
+            'bytes_total': stats['bytes_total'],
+            'items_done': stats['items_done'],
+            'items_total': stats['items_total'],
+            'bytes_per_second': stats['bytes_per_second'] if self.status == 'running' else None,
+            'eta_seconds': self.eta(stats)
+        }
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool and records them in a SQLite table
+
+    Job functions are called as `fn(*args, progress=..., cancel=...)` and return
+    `(success, message)`. They run outside any Flask request, so everything they
+    need (settings, paths) must be passed in as arguments.
+    """
+
+    def __init__(self, db_path=None, max_workers=None):
+        self.db_path = db_path or config.JOB_DB_PATH
+        self.max_workers = max_workers or config.JOB_WORKERS
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            try:
+                conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.Error as e:
+                logging.warning(f"Job table unavailable at '{self.db_path}', keeping jobs in memory: {e}")
+                conn = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(SCHEMA)
+            # Jobs from a previous process cannot be resumed
+            conn.execute(
+                "UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status IN (?, ?)",
+                (time.time(), *ACTIVE_STATUSES)
+            )
+            self._conn = conn
+        return self._conn
+
+    def _save(self, job):
+        stats = job.progress.snapshot()
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO jobs (id, kind, title, status, message, created_at, started_at, "
+                "finished_at, instances, instances_total, bytes, bytes_total) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.title, job.status, job.message, job.created_at, job.started_at,
+                 job.finished_at, stats['instances'], stats['instances_total'], stats['bytes'], stats['bytes_total'])
+            )
+
+    def submit(self, kind, title, fn, *args):
+        """Queue `fn(*args)` as a background job and return the Job"""
+        job = Job(kind, title)
+        # Counts are written every JOB_PROGRESS_SAVE_EVERY instances, so they survive a restart
+        job.progress.on_progress = lambda: self._save(job)
+        with self._lock:
+            self._jobs[job.id] = job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            executor = self._executor
+        self._save(job)
+        executor.submit(self._run, job, fn, args)
+        logging.info(f"Queued job {job.id}: {title}")
+        return job
+
+    def _run(self, job, fn, args):
+        with self._lock:
+            # A job cancelled while queued has already been recorded as cancelled
+            if job.status != 'queued':
+                return
+            job.status = 'running'
+        job.started_at = time.time()
+        job.progress.started = time.monotonic()
+        self._save(job)
+        try:
+            success, message = fn(*args, progress=job.progress, cancel=job.cancel_event)
+            if job.cancel_event.is_set():
+                job.status = 'cancelled'
+            else:
+                job.status = 'succeeded' if success else 'failed'
+            job.message = message
+        except Exception as e:
+            logging.exception(f"Job {job.id} ({job.title}) crashed")
+            job.status = 'failed'
+            job.message = f"Error: {e}"
+        job.finished_at = time.time()
+        self._save(job)
+        # Finished jobs are served from the table from now on
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        stats = job.progress.snapshot()
+        logging.info(
+            f"Job {job.id} {job.status}: {job.message}",
+            extra={'job': job.id, 'kind': job.kind, 'duration': job.finished_at - job.started_at,
+                   'bytes': stats['bytes'], 'instances': stats['instances']}
+        )
+
+    def cancel(self, job_id):
+        """Ask a job to stop; returns False if it is unknown or already finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return False
+            job.cancel_event.set()
+            # A queued job is cancelled at once rather than when a worker picks it up
+            cancelled_while_queued = job.status == 'queued'
+            if cancelled_while_queued:
+                job.status = 'cancelled'
+                job.finished_at = time.time()
+                self._jobs.pop(job_id, None)
+        if cancelled_while_queued:
+            self._save(job)
+            logging.info(f"Job {job_id} cancelled before it started")
+        else:
+            logging.info(f"Cancellation requested for job {job_id}")
+        return True
+
+    def get(self, job_id):
+        """Live state of a job from this process, or its last recorded state"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record.update(cancel_requested=False, items_done=0, items_total=0, bytes_per_second=None, eta_seconds=None)
+        return record
+
+    def list(self, limit=50):
+        """Most recent jobs first"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self.get(row['id']) for row in rows]
+
+
+job_manager = JobManager()
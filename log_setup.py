@@ -0,0 +1,134 @@
+import atexit
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import has_request_context, request
+
+import config
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Attributes passed with `extra=` (or added by RequestContextFilter) that JSON records carry
+STRUCTURED_FIELDS = ('route', 'method', 'study', 'job', 'kind', 'duration', 'bytes', 'instances')
+
+_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records logged while handling a request with its route and study
+
+    Runs on the logging thread's caller, before the record is queued, so the
+    Flask request is still available.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            if not hasattr(record, 'route'):
+                record.route = request.endpoint
+                record.method = request.method
+            if not hasattr(record, 'study') and request.view_args:
+                study = request.view_args.get('study')
+                if study is None and 'file_path' in request.view_args:
+                    study = request.view_args['file_path'].split('/', 1)[0]
+                if study is not None:
+                    record.study = study
+        return True
+
+
+class RecordQueueHandler(QueueHandler):
+    """Queues records with their message merged and traceback rendered, but not yet formatted"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any structured fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def is_logging_process(reloader=False):
+    """Whether this process should own the log file
+
+    Spawned pool workers re-import the app and must not open their own handler
+    on LOG_FILE; with the debug `reloader`, only the child that serves requests
+    (WERKZEUG_RUN_MAIN set) does, not the watcher process that restarts it.
+    """
+    if multiprocessing.parent_process() is not None:
+        return False
+    return not reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+
+
+def configure_logging(log_file=None, level=None, json_format=None):
+    """Route every record through a queue to a rotating file handler and the console
+
+    Request threads only put records on an unbounded queue; a QueueListener
+    thread formats them and does the file and console writes. Returns the listener.
+    """
+    global _listener
+    log_file = log_file or config.LOG_FILE
+    level = level or config.LOG_LEVEL
+    json_format = config.LOG_JSON if json_format is None else json_format
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = RecordQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+import time
+
+import config
+
+# Bytes read per step when walking the log file backwards
+BLOCK_SIZE = 64 * 1024
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+# First line of a record written with the app's log format; other lines (tracebacks) continue it
+RECORD_START = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - (DEBUG|INFO|WARNING|ERROR|CRITICAL) - ')
+
+# A JSON record (LOG_JSON), always a single line
+JSON_RECORD = re.compile(r'^\{"time": "[^"]*", "level": "(DEBUG|INFO|WARNING|ERROR|CRITICAL)"')
+
+
+def record_level(line):
+    """Level name if `line` starts a log record, else None"""
+    match = RECORD_START.match(line) or JSON_RECORD.match(line)
+    return match.group(1) if match else None
+
+
+class LogFilter:
+    """Matches records at or above `level` that contain `text` (case-insensitive)"""
+
+    def __init__(self, level=None, text=None):
+        level = (level or '').upper()
+        self.min_level = logging.getLevelName(level) if level in LEVELS else None
+        self.text = (text or '').strip().lower() or None
+
+    @property
+    def active(self):
+        return self.min_level is not None or self.text is not None
+
+    def matches(self, record_lines):
+        if self.min_level is not None:
+            level = record_level(record_lines[0])
+            if level is None or logging.getLevelName(level) < self.min_level:
+                return False
+        if self.text is not None:
+            return any(self.text in line.lower() for line in record_lines)
+        return True
+
+
+def _reverse_lines(fp, end, block_size=BLOCK_SIZE):
+    """Yield the lines of `fp` before byte offset `end`, last line first"""
+    position = end
+    remainder = b''
+    while position > 0:
+        step = min(block_size, position)
+        position -= step
+        fp.seek(position)
+        block = fp.read(step) + remainder
+        lines = block.split(b'\n')
+        # The first piece may be the tail of a line that starts in an earlier block
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line.decode('utf-8', errors='replace').rstrip('\r')
+    if remainder:
+        yield remainder.decode('utf-8', errors='replace').rstrip('\r')
+
+
+def tail(path=None, limit=None, log_filter=None):
+    """The last `limit` matching records of a log file, oldest first, as a list of lines
+
+    The file is read backwards block by block and reading stops once enough
+    records are found, so the cost follows the lines returned (and the lines
+    skipped by a filter), not the size of the file. Multi-line records such as
+    tracebacks are kept together and count as one record.
+    """
+    path = path or config.LOG_FILE
+    limit = limit or config.LOG_TAIL_LINES
+    log_filter = log_filter or LogFilter()
+    records = []
+    pending = []
+    with open(path, 'rb') as fp:
+        end = os.fstat(fp.fileno()).st_size
+        for line in _reverse_lines(fp, end):
+            if not line and not pending and not records:
+                continue  # trailing newline
+            pending.append(line)
+            if record_level(line) is None:
+                continue
+            record = pending[::-1]
+            pending = []
+            if log_filter.matches(record):
+                records.append(record)
+                if len(records) >= limit:
+                    break
+    return [line for record in reversed(records) for line in record]
+
+
+def _shown(record_lines, log_filter):
+    """The lines of a complete record that pass the filter, or none
+
+    Lines before the first record start (the tail of a record cut off where
+    following began) are only shown when nothing is filtered.
+    """
+    if record_level(record_lines[0]) is None:
+        return [] if log_filter.active else record_lines
+    return record_lines if log_filter.matches(record_lines) else []
+
+
+def follow(path=None, log_filter=None, poll_interval=None, heartbeat=15.0, stop=None):
+    """Yield new lines appended to a log file, starting from its current end
+
+    Only the file size is polled; new bytes are read from the last offset.
+    A shrunk or replaced file (after rotation) is read again from the start.
+    Lines are held until their record is complete (the next record starts, or
+    a poll finds nothing new) so the filter sees whole records, as in `tail`.
+    Yields None every `heartbeat` seconds without new lines so callers can
+    detect a dropped client. Runs until `stop()` returns true.
+    """
+    path = path or config.LOG_FILE
+    log_filter = log_filter or LogFilter()
+    poll_interval = config.LOG_STREAM_POLL_INTERVAL if poll_interval is None else poll_interval
+    stop = stop or (lambda: False)
+    fp = None
+    offset, inode = 0, None
+    buffer = b''
+    record = []
+    last_sent = time.monotonic()
+    try:
+        while not stop():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            complete = []
+            if stat is not None and (fp is None or stat.st_ino != inode or stat.st_size < offset):
+                if fp is not None:
+                    fp.close()
+                    offset = 0  # rotated or truncated: the new file is read from the start
+                    if record:
+                        complete.extend(_shown(record, log_filter))
+                else:
+                    offset = stat.st_size
+                fp = open(path, 'rb')
+                inode, buffer, record = stat.st_ino, b'', []
+
+            if stat is not None and stat.st_size > offset:
+                fp.seek(offset)
+                data = fp.read(stat.st_size - offset)
+                offset += len(data)
+                lines = (buffer + data).split(b'\n')
+                buffer = lines.pop()
+                for raw in lines:
+                    line = raw.decode('utf-8', errors='replace').rstrip('\r')
+                    if record and record_level(line) is not None:
+                        complete.extend(_shown(record, log_filter))
+                        record = []
+                    record.append(line)
+            elif record and not buffer:
+                # Nothing was appended for a whole poll: the last record is finished
+                complete.extend(_shown(record, log_filter))
+                record = []
+
+            if complete:
+                last_sent = time.monotonic()
+                yield from complete
+            elif time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield None
+            time.sleep(poll_interval)
+    finally:
+        if fp is not None:
+            fp.close()
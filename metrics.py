@@ -0,0 +1,218 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from a cached header read up to a large transfer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+enabled = config.METRICS_ENABLED
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for metrics whose values live in one shard per thread
+
+    Only the owning thread writes to its shard, so recording takes no lock;
+    collection copies every shard and sums them. Shards of finished threads
+    are folded into `_retired` whenever a shard is added or collected, so the
+    list stays bounded by the live threads even if nothing scrapes.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        """Fold the shards of finished threads into `_retired`; call with `_lock` held"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for labels, values in shard.copy().items():
+                    self._retired[labels] = self._merge(self._retired.get(labels), values)
+        self._shards = live
+
+    def _merge(self, total, values):
+        raise NotImplementedError
+
+    def collect(self):
+        """Label values mapped to the value summed over every thread"""
+        with self._lock:
+            self._retire_dead_shards()
+            totals = {labels: self._merge(None, values) for labels, values in self._retired.items()}
+            for _, shard in self._shards:
+                for labels, values in shard.copy().items():
+                    totals[labels] = self._merge(totals.get(labels), values)
+        return totals
+
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set"""
+
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, total, value):
+        return value if total is None else total + value
+
+    def render(self):
+        for labels, value in sorted(self.collect().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        if not enabled:
+            return
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            # One slot per bucket plus +Inf, then sum
+            values = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of the `with` block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _merge(self, total, values):
+        values = list(values)
+        return values if total is None else [a + b for a, b in zip(total, values)]
+
+    def render(self):
+        for labels, values in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(values[-1])}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+def register_collector(name, documentation, metric_type, labelnames, fn):
+    """Expose values computed at scrape time; `fn()` returns a dict of label tuples to values"""
+    with _registry_lock:
+        _collectors.append((name, documentation, metric_type, tuple(labelnames), fn))
+
+
+def render():
+    """Every metric in the Prometheus text exposition format (0.0.4)"""
+    lines = []
+    with _registry_lock:
+        registered = list(_metrics)
+        collectors = list(_collectors)
+    for metric in registered:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    for name, documentation, metric_type, labelnames, fn in collectors:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in sorted(fn().items()):
+            lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'dicom_editor_request_duration_seconds', 'Time spent handling HTTP requests, by route',
+    ('endpoint', 'method', 'status')
+)
+PYDICOM_SECONDS = Histogram(
+    'dicom_editor_pydicom_seconds', 'Time spent in pydicom dcmread/dcmwrite',
+    ('call', 'scope')
+)
+TRANSFER_BYTES = Counter(
+    'dicom_editor_transfer_bytes_total', 'DICOM bytes moved to or from the DICOM service',
+    ('direction',)
+)
+TRANSFER_INSTANCES = Counter(
+    'dicom_editor_transfer_instances_total', 'DICOM instances moved to or from the DICOM service',
+    ('direction',)
+)
+TOKEN_FETCH_SECONDS = Histogram(
+    'dicom_editor_token_fetch_seconds', 'Time spent fetching Azure AD access tokens'
+)
+CACHE_REQUESTS = Counter(
+    'dicom_editor_cache_requests_total', 'Cache lookups, by cache and hit or miss',
+    ('cache', 'result')
+)
+
+
+def _cache_hit_ratios():
+    lookups = {}
+    for (cache, result), count in CACHE_REQUESTS.collect().items():
+        hits, total = lookups.get(cache, (0, 0))
+        lookups[cache] = (hits + (count if result == 'hit' else 0), total + count)
+    return {(cache,): hits / total for cache, (hits, total) in lookups.items() if total}
+
+
+register_collector(
+    'dicom_editor_cache_hit_ratio', 'Fraction of cache lookups served from the cache since start',
+    'gauge', ('cache',), _cache_hit_ratios
+)
@@ -0,0 +1,286 @@
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pydicom
+from pydicom.pixel_data_handlers.util import apply_modality_lut, convert_color_space
+from pydicom.uid import ExplicitVRBigEndian
+
+import config
+import header_patch
+import metrics
+
+# Uncompressed frames of these bit depths are read straight from disk, one frame at a time
+NATIVE_BITS = {8: 'u1', 16: 'u2', 32: 'u4'}
+
+
+class PreviewError(Exception):
+    """The file has no pixel data, or none that can be decoded here"""
+
+
+def _value_offset(ds, pixel_offset):
+    """Offset of the PixelData value, after its element header"""
+    return pixel_offset + (8 if ds.is_implicit_VR else 12)
+
+
+def _read_native_frame(ds, file_path, pixel_offset, index):
+    """Read one frame of uncompressed little-endian pixel data without loading the others"""
+    samples = getattr(ds, 'SamplesPerPixel', 1)
+    bits_allocated = getattr(ds, 'BitsAllocated', None)
+    if samples != 1 or bits_allocated not in NATIVE_BITS or 'Columns' not in ds:
+        return None
+    # BitsStored is Type 1, but files without it still decode as if every allocated bit were used
+    bits_stored = getattr(ds, 'BitsStored', None) or bits_allocated
+    dtype = np.dtype(NATIVE_BITS[bits_allocated])
+    if getattr(ds, 'PixelRepresentation', 0) == 1:
+        dtype = np.dtype(dtype.str.replace('u', 'i'))
+    dtype = dtype.newbyteorder('<')
+    frame_size = ds.Rows * ds.Columns * dtype.itemsize
+    with open(file_path, 'rb') as fp:
+        fp.seek(_value_offset(ds, pixel_offset) + index * frame_size)
+        data = fp.read(frame_size)
+    if len(data) != frame_size:
+        return None
+    frame = np.frombuffer(data, dtype=dtype).reshape(ds.Rows, ds.Columns)
+    if bits_stored < bits_allocated:
+        # Mask unused high bits, sign-extending signed data
+        shift = bits_allocated - bits_stored
+        frame = (frame << shift) >> shift if dtype.kind == 'i' else frame & ((1 << bits_stored) - 1)
+    return frame
+
+
+def load_frame(file_path, frame=None):
+    """Return `(ds, pixels)` for one frame; multiframe files default to the middle frame"""
+    ds, pixel_offset = header_patch.load_header(file_path)
+    frames = int(getattr(ds, 'NumberOfFrames', 1) or 1)
+    index = frames // 2 if frame is None else min(max(int(frame), 0), frames - 1)
+
+    transfer_syntax = getattr(getattr(ds, 'file_meta', None), 'TransferSyntaxUID', None)
+    pixels = None
+    if pixel_offset is not None and transfer_syntax is not None and not transfer_syntax.is_compressed \
+            and transfer_syntax != ExplicitVRBigEndian and 'Rows' in ds:
+        pixels = _read_native_frame(ds, file_path, pixel_offset, index)
+
+    if pixels is None:
+        with metrics.PYDICOM_SECONDS.time('dcmread', 'full'):
+            ds = pydicom.dcmread(file_path, force=True)
+        if 'PixelData' not in ds:
+            raise PreviewError("File has no pixel data")
+        try:
+            pixels = ds.pixel_array
+        except Exception as e:
+            raise PreviewError(f"Cannot decode pixel data: {e}") from e
+        if frames > 1:
+            pixels = pixels[index]
+    return ds, pixels
+
+
+def _first(value):
+    if isinstance(value, pydicom.multival.MultiValue):
+        return float(value[0]) if len(value) else None
+    return float(value) if value not in (None, '') else None
+
+
+def window_to_uint8(ds, pixels):
+    """Apply rescale and VOI windowing (vectorised) and scale to 8 bits"""
+    if pixels.ndim == 3:
+        # Colour images are shown as stored, converted to RGB when needed
+        photometric = str(getattr(ds, 'PhotometricInterpretation', 'RGB'))
+        if photometric.startswith('YBR'):
+            pixels = convert_color_space(pixels, photometric, 'RGB')
+        if pixels.dtype != np.uint8:
+            pixels = (pixels.astype(np.float32) * (255.0 / max(float(pixels.max()), 1.0))).astype(np.uint8)
+        return pixels
+
+    values = apply_modality_lut(pixels, ds).astype(np.float32, copy=False)
+    center = _first(getattr(ds, 'WindowCenter', None))
+    width = _first(getattr(ds, 'WindowWidth', None))
+    if center is None or width is None or width < 1:
+        low, high = float(values.min()), float(values.max())
+        center, width = (low + high) / 2, max(high - low, 1.0)
+
+    # Linear VOI function from PS3.3 C.11.2.1.2
+    scaled = ((values - (center - 0.5)) / max(width - 1, 1.0) + 0.5) * 255.0
+    result = np.clip(scaled, 0, 255).astype(np.uint8)
+    if getattr(ds, 'PhotometricInterpretation', '') == 'MONOCHROME1':
+        result = 255 - result
+    return result
+
+
+def downsample(pixels, max_size):
+    """Shrink by an integer factor so neither side exceeds `max_size`, averaging each block"""
+    height, width = pixels.shape[:2]
+    factor = -(-max(height, width) // max_size)
+    if factor <= 1:
+        return pixels
+    height, width = height // factor * factor, width // factor * factor
+    blocks = pixels[:height, :width].reshape(height // factor, factor, width // factor, factor, *pixels.shape[2:])
+    return blocks.mean(axis=(1, 3)).astype(np.uint8)
+
+
+def encode_png(pixels):
+    """Encode an 8-bit greyscale or RGB array as PNG using only zlib"""
+    height, width = pixels.shape[:2]
+    color_type = 2 if pixels.ndim == 3 else 0
+    # Each scanline is prefixed with filter type 0 (none)
+    raw = np.zeros((height, 1 + pixels[0].size), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, -1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def render_png(file_path, max_size, frame=None):
+    ds, pixels = load_frame(file_path, frame)
+    return encode_png(downsample(window_to_uint8(ds, pixels), max_size))
+
+
+class PreviewCache:
+    """PNG files on disk keyed by source path, mtime and render options, evicted
+    least recently used first once the directory exceeds `max_bytes`"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None
+
+    def key(self, file_path, max_size, frame=None):
+        stat = os.stat(file_path)
+        source = f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}|{max_size}|{frame}"
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def open(self, key):
+        """Open a cached preview for reading, marked as recently used, or return None
+
+        The file is opened under the lock eviction holds, so it cannot be removed
+        between the lookup and the open; an open file stays readable afterwards.
+        """
+        path = self.path(key)
+        with self._lock:
+            try:
+                fp = open(path, 'rb')
+            except FileNotFoundError:
+                return None
+            try:
+                # Recency is tracked in the access time; mtime stays the render time
+                os.utime(fp.fileno(), (time.time(), os.fstat(fp.fileno()).st_mtime))
+            except OSError:
+                pass
+        return fp
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        with self._lock:
+            # A preview rendered twice replaces the first copy, whose size no longer counts
+            try:
+                replaced_size = os.stat(self.path(key)).st_size
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(temp_path, self.path(key))
+            if self._total is None:
+                self._total = sum(entry.stat().st_size for entry in self._entries())
+            else:
+                self._total += len(data) - replaced_size
+            if self._total > self.max_bytes:
+                self._evict()
+        return self.path(key)
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.png')]
+
+    def _evict(self):
+        # Trim to 90% so that every put near the cap does not rescan the directory
+        entries = sorted(
+            (entry.stat().st_atime, entry.stat().st_size, entry.path) for entry in self._entries()
+        )
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+
+preview_cache = PreviewCache(config.PREVIEW_CACHE_DIR, config.PREVIEW_CACHE_MAX_BYTES)
+
+_warm_executor = ThreadPoolExecutor(max_workers=max(1, config.PREVIEW_WORKERS), thread_name_prefix='preview')
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def get_preview(file_path, max_size=None, frame=None):
+    """`(key, binary file object)` of the PNG preview for a file, rendering it on a cache miss"""
+    max_size = max_size or config.THUMBNAIL_SIZE
+    key = preview_cache.key(file_path, max_size, frame)
+    cached = preview_cache.open(key)
+    if cached is not None:
+        metrics.CACHE_REQUESTS.inc('preview', 'hit')
+        return key, cached
+    metrics.CACHE_REQUESTS.inc('preview', 'miss')
+    data = render_png(file_path, max_size, frame)
+    preview_cache.put(key, data)
+    # Served from memory: the new file may already be evicted by a concurrent put
+    return key, BytesIO(data)
+
+
+def _warm_one(file_path, max_size, key):
+    try:
+        if not preview_cache.contains(key):
+            preview_cache.put(key, render_png(file_path, max_size))
+    except Exception as e:
+        logging.debug(f"Could not pre-render preview for '{file_path}': {e}")
+    finally:
+        with _in_flight_lock:
+            _in_flight.discard(key)
+
+
+def warm(file_paths, max_size=None):
+    """Render missing thumbnails for `file_paths` in the background
+
+    Returns at once: checking which thumbnails are missing stats every file,
+    so that scan runs on a preview worker too.
+    """
+    _warm_executor.submit(_queue_missing, list(file_paths), max_size or config.THUMBNAIL_SIZE)
+
+
+def _queue_missing(file_paths, max_size):
+    """Queue a render for each file whose thumbnail is neither cached nor in flight; returns the count"""
+    queued = 0
+    for file_path in file_paths:
+        try:
+            key = preview_cache.key(file_path, max_size)
+        except OSError:
+            continue
+        with _in_flight_lock:
+            if key in _in_flight or preview_cache.contains(key):
+                continue
+            _in_flight.add(key)
+        _warm_executor.submit(_warm_one, file_path, max_size, key)
+        queued += 1
+    return queued
@@ -0,0 +1,131 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+import config
+
+# Request header and query parameter that ask for a profile of one request
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+
+PROFILE_NAME = re.compile(r'^[\w.-]+\.prof$')
+
+
+class ProfileBudget:
+    """Allows at most `limit` profiles per sliding `window` seconds, and one at a time"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._started = deque()
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def acquire(self):
+        """Claim a profiling slot; returns False when the budget is spent or a profile is running"""
+        if not self._active.acquire(blocking=False):
+            return False
+        with self._lock:
+            now = time.monotonic()
+            while self._started and self._started[0] <= now - self.window:
+                self._started.popleft()
+            if len(self._started) >= self.limit:
+                self._active.release()
+                return False
+            self._started.append(now)
+        return True
+
+    def release(self):
+        self._active.release()
+
+    def remaining(self):
+        with self._lock:
+            now = time.monotonic()
+            return max(0, self.limit - sum(1 for started in self._started if started > now - self.window))
+
+
+budget = ProfileBudget(config.PROFILE_BUDGET, config.PROFILE_BUDGET_WINDOW)
+
+
+def is_requested(request):
+    """Whether the request asks to be profiled (header or query parameter)"""
+    value = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM) or ''
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def start():
+    """Start a deterministic profiler if the budget allows; returns it, or None"""
+    if not budget.acquire():
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this interpreter
+        budget.release()
+        return None
+    return profiler
+
+
+def stop(profiler, label, elapsed, directory=None):
+    """Stop a profiler, write its stats as a .prof file and return the file name"""
+    try:
+        profiler.disable()
+    finally:
+        budget.release()
+    directory = directory or config.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    safe_label = re.sub(r'[^\w.-]+', '_', label)[:60]
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{safe_label}-{int(elapsed * 1000)}ms-{uuid.uuid4().hex[:6]}.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+    prune(directory)
+    return name
+
+
+def prune(directory=None, keep=None):
+    """Delete the oldest profiles beyond `keep` (default PROFILE_KEEP)"""
+    keep = config.PROFILE_KEEP if keep is None else keep
+    profiles = list_profiles(directory)
+    for profile in profiles[keep:]:
+        try:
+            os.remove(profile['path'])
+        except OSError:
+            pass
+
+
+def list_profiles(directory=None, limit=None):
+    """Saved profiles, newest first"""
+    directory = directory or config.PROFILE_DIR
+    try:
+        entries = [entry for entry in os.scandir(directory) if PROFILE_NAME.match(entry.name)]
+    except FileNotFoundError:
+        return []
+    profiles = sorted(
+        ({'name': entry.name, 'path': entry.path, 'size': entry.stat().st_size, 'created': entry.stat().st_mtime}
+         for entry in entries),
+        key=lambda profile: profile['created'],
+        reverse=True
+    )
+    return profiles[:limit] if limit else profiles
+
+
+def profile_path(name, directory=None):
+    """Absolute path of a saved profile, or None for unknown or unsafe names"""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.abspath(os.path.join(directory or config.PROFILE_DIR, name))
+    return path if os.path.isfile(path) else None
+
+
+def summarize(path, sort='cumulative', limit=50):
+    """Top functions of a saved profile as pstats text"""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import metrics
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after being stored"""
+
+    def __init__(self, maxsize, ttl, name='query'):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return `(True, value)` for a live entry, `(False, None)` otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.CACHE_REQUESTS.inc(self.name, 'hit')
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            metrics.CACHE_REQUESTS.inc(self.name, 'miss')
+            return False, None
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate):
+        """Drop every entry for which `predicate(key, value)` is true; returns the count"""
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+def make_key(endpoint, kind, params, principal=()):
+    """Normalise query parameters into a hashable cache key
+
+    `principal` identifies the credentials (tenant, client ID) the results were
+    fetched with, so sessions with different credentials never share entries.
+    """
+    normalised = tuple(sorted(
+        (str(name), str(value).strip())
+        for name, value in params.items()
+        if value is not None and str(value).strip() != ''
+    ))
+    return (endpoint.rstrip('/'), tuple(principal), kind, normalised)
+
+
+# Remote study searches (QIDO-RS and study lookups by UID)
+study_search_cache = TTLCache(config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL, 'study_search')
@@ -0,0 +1,205 @@
+import struct
+
+from pydicom.datadict import dictionary_VR, keyword_for_tag
+from pydicom.tag import Tag
+
+# Tags that must not be deleted from a file
+PROTECTED_TAGS = {
+    'SOPClassUID', 'SOPInstanceUID', 'StudyInstanceUID', 'SeriesInstanceUID',
+    'PatientID', 'PatientName', 'Modality', 'TransferSyntaxUID',
+    'MediaStorageSOPClassUID', 'MediaStorageSOPInstanceUID',
+    'ImplementationClassUID', 'SpecificCharacterSet'
+}
+
+# Binary VRs whose values are never converted to text for display
+BULK_VRS = {'OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'UN'}
+
+# Values longer than this (in bytes) are summarised instead of rendered
+MAX_INLINE_LENGTH = 64 * 1024
+
+# Characters shown in the table before a value is truncated
+MAX_DISPLAY_LENGTH = 1000
+
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+# Sequence items returned per request by the items endpoint
+DEFAULT_ITEM_LIMIT = 50
+
+
+def _raw_element(ds, tag):
+    """The stored element, deferred or not; Dataset.get_item() would read a deferred value"""
+    return ds._dict[Tag(tag)]
+
+
+def _element_vr(elem):
+    vr = elem.VR
+    if vr is None:
+        try:
+            vr = dictionary_VR(elem.tag)
+        except KeyError:
+            vr = 'UN'
+    # Ambiguous dictionary VRs such as 'OB or OW' are bulk either way
+    return str(getattr(vr, 'value', vr)).split(' or ')[0]
+
+
+def _element_length(elem):
+    """Value length from the element header, without converting the value"""
+    length = getattr(elem, 'length', None)
+    if length is not None and length != UNDEFINED_LENGTH:
+        return length
+    value = elem.value
+    if isinstance(value, (bytes, bytearray)):
+        # Undefined-length (encapsulated) pixel data is still held as raw bytes
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    return None
+
+
+def _count_items(raw):
+    """Count the items of a still-encoded sequence by walking the item headers
+
+    Returns None when an item has undefined length, since counting would then
+    mean parsing the items.
+    """
+    value = raw.value
+    header = struct.Struct('<HHL' if raw.is_little_endian else '>HHL')
+    count, position = 0, 0
+    while position + header.size <= len(value):
+        group, element, length = header.unpack_from(value, position)
+        if (group, element) == (0xFFFE, 0xE0DD):
+            break
+        if (group, element) != (0xFFFE, 0xE000) or length == UNDEFINED_LENGTH:
+            return None
+        count += 1
+        position += header.size + length
+    return count
+
+
+def _bulk_summary(vr, length):
+    size = 'undefined length' if length is None else f"{length} bytes"
+    return f"[{vr} binary data, {size}]"
+
+
+def render_element(ds, tag, parent_path=''):
+    """Describe one element for the tag table, converting its value only when it is cheap"""
+    raw = _raw_element(ds, tag)
+    tag = Tag(tag)
+    vr = _element_vr(raw)
+    length = _element_length(raw)
+    path = f"{parent_path}/{tag:08X}" if parent_path else f"{tag:08X}"
+    field = {
+        'tag': str(tag),
+        'path': path,
+        'keyword': keyword_for_tag(tag),
+        'VR': vr,
+        'VM': 1,
+        'length': length,
+        'kind': 'text',
+        'value': '',
+        'original_value': '',
+        'item_count': None
+    }
+    field['is_deletable'] = field['keyword'] not in PROTECTED_TAGS
+
+    if vr in BULK_VRS:
+        field['kind'] = 'bulk'
+        field['value'] = _bulk_summary(vr, length)
+        return field
+
+    if vr == 'SQ':
+        # Items are parsed only when fetched from the sequence items endpoint
+        if not getattr(raw, 'is_raw', False):
+            item_count = len(raw.value)
+        elif isinstance(raw.value, bytes):
+            item_count = _count_items(raw)
+        else:
+            item_count = None  # deferred: still on disk
+        field['kind'] = 'sequence'
+        field['item_count'] = item_count
+        field['VM'] = item_count if item_count is not None else ''
+        field['value'] = f"[Sequence of {item_count} item(s)]" if item_count is not None else "[Sequence]"
+        return field
+
+    if length is not None and length > MAX_INLINE_LENGTH:
+        # Summarised before conversion, so a deferred value is never read
+        field['kind'] = 'bulk'
+        field['VM'] = ''
+        field['value'] = f"[{vr} value, {length} bytes]"
+        return field
+
+    elem = ds[tag]
+    field['VM'] = elem.VM
+
+    value_str = str(elem.value)
+    field['original_value'] = value_str
+    field['value'] = value_str[:MAX_DISPLAY_LENGTH] + "... [TRUNCATED]" if len(value_str) > MAX_DISPLAY_LENGTH else value_str
+    if length is None:
+        field['length'] = len(value_str)
+    return field
+
+
+def render_dataset(ds, parent_path=''):
+    """Describe every named element of a dataset (sequences stay collapsed)"""
+    fields = []
+    for tag in sorted(ds.keys()):
+        keyword = keyword_for_tag(tag)
+        if not keyword:
+            continue
+        try:
+            fields.append(render_element(ds, tag, parent_path))
+        except Exception as e:
+            fields.append({
+                'tag': str(Tag(tag)),
+                'path': f"{parent_path}/{Tag(tag):08X}" if parent_path else f"{Tag(tag):08X}",
+                'keyword': keyword,
+                'VR': getattr(_raw_element(ds, tag), 'VR', None) or 'UN',
+                'VM': 1,
+                'length': 0,
+                'kind': 'error',
+                'value': f"[Error reading value: {e}]",
+                'original_value': '',
+                'item_count': None,
+                'is_deletable': keyword not in PROTECTED_TAGS
+            })
+    return fields
+
+
+def resolve_sequence(ds, path):
+    """Find the sequence at `path`, a '/'-separated list of hex tags and item indices
+
+    For example '00081115/0/0008114A' is the Referenced Instance Sequence inside the
+    first item of the Referenced Series Sequence.
+    """
+    parts = path.split('/')
+    if len(parts) % 2 != 1:
+        raise ValueError(f"Invalid sequence path '{path}'")
+    current = ds
+    for position, part in enumerate(parts):
+        if position % 2 == 0:
+            tag = Tag(int(part, 16))
+            if tag not in current:
+                raise KeyError(f"Tag {tag} not found")
+            sequence = current[tag]
+            if sequence.VR != 'SQ':
+                raise ValueError(f"Tag {tag} is not a sequence")
+        else:
+            current = sequence.value[int(part)]
+    return sequence
+
+
+def render_sequence_items(ds, path, offset=0, limit=DEFAULT_ITEM_LIMIT):
+    """Describe one page of items of the sequence at `path`"""
+    sequence = resolve_sequence(ds, path)
+    items = sequence.value
+    end = min(len(items), offset + limit)
+    return {
+        'path': path,
+        'item_count': len(items),
+        'offset': offset,
+        'next_offset': end if end < len(items) else None,
+        'items': [
+            {'index': index, 'fields': render_dataset(items[index], f"{path}/{index}")}
+            for index in range(offset, end)
+        ]
+    }
@@ -0,0 +1,16 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runtime files of modules imported by the tests go to a scratch directory, not the checkout
+_runtime_dir = tempfile.mkdtemp(prefix='dicom-editor-tests-')
+atexit.register(shutil.rmtree, _runtime_dir, ignore_errors=True)
+os.environ.setdefault('LOG_FILE', os.path.join(_runtime_dir, 'dicom_editor.log'))
+os.environ.setdefault('JOB_DB_PATH', os.path.join(_runtime_dir, 'jobs.sqlite'))
+os.environ.setdefault('PREVIEW_CACHE_DIR', os.path.join(_runtime_dir, 'previews'))
+os.environ.setdefault('PROFILE_DIR', os.path.join(_runtime_dir, 'profiles'))
@@ -0,0 +1,98 @@
+import os
+import time
+
+import pydicom
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import batch_edit
+
+
+@pytest.fixture
+def study(tmp_path):
+    series = tmp_path / 'study' / 'series-00001'
+    series.mkdir(parents=True)
+    for number in range(1, 4):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.PatientName = 'Original^Name'
+        ds.InstanceNumber = number
+        pydicom.dcmwrite(str(series / f'image-{number:05d}.dcm'), ds, write_like_original=False)
+    return tmp_path / 'study'
+
+
+def snapshot(study):
+    return {
+        os.path.relpath(os.path.join(root, file), study): open(os.path.join(root, file), 'rb').read()
+        for root, _, files in os.walk(study) for file in files
+    }
+
+
+def dicom_files(study):
+    return sorted(str(path) for path in study.rglob('*.dcm'))
+
+
+def fail_on_replace(monkeypatch, call, error):
+    """Make the `call`-th os.replace of a staged file raise `error`"""
+    real_replace = os.replace
+    calls = []
+
+    def replace(src, dst):
+        if src.endswith('.tmp'):
+            calls.append(src)
+            if len(calls) == call:
+                raise error
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(batch_edit.os, 'replace', replace)
+
+
+def test_failed_commit_restores_every_original(study, monkeypatch):
+    before = snapshot(study)
+    fail_on_replace(monkeypatch, 2, OSError("disk full"))
+
+    summary = batch_edit.apply_study_edits(dicom_files(study), {'PatientName': 'New^Name'}, max_workers=1)
+
+    assert not summary['committed']
+    assert summary['updated'] == 0
+    assert snapshot(study) == before
+
+
+def test_interrupted_commit_is_rolled_back_on_the_next_run(study, monkeypatch):
+    before = snapshot(study)
+    fail_on_replace(monkeypatch, 3, KeyboardInterrupt())
+    with pytest.raises(KeyboardInterrupt):
+        batch_edit.apply_study_edits(
+            dicom_files(study), {'PatientName': 'New^Name'}, max_workers=1, study_path=str(study)
+        )
+    monkeypatch.undo()
+    assert os.path.exists(study / batch_edit.COMMIT_JOURNAL)
+
+    batch_edit.recover_study(str(study))
+
+    assert {path: data for path, data in snapshot(study).items() if not path.endswith('.tmp')} == before
+    summary = batch_edit.apply_study_edits(dicom_files(study), {'PatientName': 'New^Name'}, max_workers=1)
+    assert summary['committed'] and summary['updated'] == 3
+    assert all(str(pydicom.dcmread(path).PatientName) == 'New^Name' for path in dicom_files(study))
+
+
+def test_recover_study_removes_stale_temp_files(study):
+    series = study / 'series-00001'
+    stale = series / '.image-00001.dcm.abc.tmp'
+    fresh = series / '.image-00002.dcm.def.tmp'
+    backup = series / '.image-00003.dcm.orig'
+    for path in (stale, fresh, backup):
+        path.write_bytes(b'partial')
+    old = time.time() - batch_edit.STALE_TEMP_AGE - 60
+    os.utime(stale, (old, old))
+
+    batch_edit.recover_study(str(study))
+
+    assert not stale.exists() and not backup.exists()
+    assert fresh.exists()
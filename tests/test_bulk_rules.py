@@ -0,0 +1,96 @@
+import pydicom
+import pytest
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.multival import MultiValue
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import bulk_rules
+import catalog
+
+
+def rules(*specs):
+    return bulk_rules.parse_rule_set({'rules': list(specs)})['rules']
+
+
+def test_regex_rewrites_each_value_of_a_multi_valued_element():
+    ds = Dataset()
+    ds.ImageType = ['ORIGINAL', 'PRIMARY', 'AXIAL']
+
+    changed = bulk_rules.apply_rules(ds, rules(
+        {'action': 'regex', 'keyword': 'ImageType', 'pattern': '^PRIMARY$', 'replacement': 'SECONDARY'}
+    ))
+
+    assert changed == ['ImageType']
+    assert isinstance(ds.ImageType, MultiValue)
+    assert list(ds.ImageType) == ['ORIGINAL', 'SECONDARY', 'AXIAL']
+
+
+def test_hash_keeps_multiplicity_and_hashes_values_independently():
+    ds = Dataset()
+    ds.OtherPatientIDs = ['A1', 'B2']
+    single = Dataset()
+    single.OtherPatientIDs = 'A1'
+    rule = rules({'action': 'hash', 'keyword': 'OtherPatientIDs', 'salt': 's', 'length': 16})
+
+    bulk_rules.apply_rules(ds, rule)
+    bulk_rules.apply_rules(single, rule)
+
+    assert len(ds.OtherPatientIDs) == 2
+    assert ds.OtherPatientIDs[0] == single.OtherPatientIDs
+    assert ds.OtherPatientIDs[0] != ds.OtherPatientIDs[1]
+    assert all(len(value) == 16 for value in ds.OtherPatientIDs)
+
+
+def test_unchanged_multi_valued_element_is_not_reported():
+    ds = Dataset()
+    ds.ImageType = ['ORIGINAL', 'PRIMARY']
+
+    changed = bulk_rules.apply_rules(ds, rules(
+        {'action': 'regex', 'keyword': 'ImageType', 'pattern': 'MISSING', 'replacement': 'X'}
+    ))
+
+    assert changed == []
+    assert list(ds.ImageType) == ['ORIGINAL', 'PRIMARY']
+
+
+@pytest.mark.parametrize('keyword, limit', [('StationName', 16), ('Modality', 16), ('PatientID', 64)])
+def test_hash_length_is_capped_by_the_vr(keyword, limit):
+    rules({'action': 'hash', 'keyword': keyword, 'length': limit})
+    with pytest.raises(ValueError, match=f"between 1 and {limit}"):
+        rules({'action': 'hash', 'keyword': keyword, 'length': limit + 1})
+
+
+def write_study(root, study, count):
+    series = root / study / 'series-00001'
+    series.mkdir(parents=True)
+    for number in range(1, count + 1):
+        meta = FileMetaDataset()
+        meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+        meta.MediaStorageSOPInstanceUID = generate_uid()
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+        ds.SOPClassUID = meta.MediaStorageSOPClassUID
+        ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+        ds.PatientID = study
+        ds.InstanceNumber = number
+        pydicom.dcmwrite(str(series / f'image-{number:05d}.dcm'), ds, write_like_original=False)
+
+
+def test_studies_filter_leaves_other_studies_in_the_catalog(tmp_path):
+    write_study(tmp_path, 'A', 2)
+    write_study(tmp_path, 'B', 3)
+    catalog.get_studies(str(tmp_path), ['A', 'B'])
+    rule_set = bulk_rules.parse_rule_set({
+        'studies': ['A'],
+        'rules': [{'action': 'set', 'keyword': 'PatientID', 'value': 'X'}]
+    })
+
+    selected = bulk_rules.select_instances(str(tmp_path), rule_set, ['A', 'B'])
+
+    assert {row['study'] for row in selected} == {'A'}
+    conn = catalog.connect(str(tmp_path))
+    try:
+        counts = dict(conn.execute("SELECT study, image_count FROM studies").fetchall())
+    finally:
+        conn.close()
+    assert counts == {'A': 2, 'B': 3}
@@ -0,0 +1,66 @@
+import os
+
+import pydicom
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import catalog
+
+
+def write_instance(path, patient_name):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(str(path), {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = '1.2.3'
+    ds.PatientName = patient_name
+    pydicom.dcmwrite(str(path), ds, write_like_original=False)
+
+
+def test_file_rewritten_in_place_is_rescanned(tmp_path):
+    series = tmp_path / 'study' / 'series-00001'
+    series.mkdir(parents=True)
+    instance = series / 'image-00001.dcm'
+    write_instance(instance, 'Before^Name')
+    assert catalog.get_studies(str(tmp_path), ['study'])['study']['metadata']['PatientName'] == 'Before^Name'
+
+    # Same name and length, so the directory entry and the file size do not change
+    directory_mtimes = [os.stat(path).st_mtime_ns for path in (tmp_path / 'study', series)]
+    write_instance(instance, 'Afters^Name')
+    stat = os.stat(instance)
+    os.utime(instance, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    os.utime(tmp_path / 'study', ns=(directory_mtimes[0], directory_mtimes[0]))
+    os.utime(series, ns=(directory_mtimes[1], directory_mtimes[1]))
+
+    assert catalog.get_studies(str(tmp_path), ['study'])['study']['metadata']['PatientName'] == 'Afters^Name'
+
+
+def test_refreshing_one_study_keeps_the_others(tmp_path):
+    for study in ('A', 'B'):
+        series = tmp_path / study / 'series-00001'
+        series.mkdir(parents=True)
+        write_instance(series / 'image-00001.dcm', f'Patient^{study}')
+    assert set(catalog.get_studies(str(tmp_path), ['A', 'B'])) == {'A', 'B'}
+
+    rows = catalog.get_instances(str(tmp_path), ['A'])
+
+    assert [row['study'] for row in rows] == ['A']
+    conn = catalog.connect(str(tmp_path))
+    try:
+        indexed = {row['study'] for row in conn.execute("SELECT study FROM instances")}
+    finally:
+        conn.close()
+    assert indexed == {'A', 'B'}
+
+
+def test_full_listing_drops_removed_studies(tmp_path):
+    for study in ('A', 'B'):
+        series = tmp_path / study / 'series-00001'
+        series.mkdir(parents=True)
+        write_instance(series / 'image-00001.dcm', f'Patient^{study}')
+    catalog.get_studies(str(tmp_path), ['A', 'B'])
+
+    assert set(catalog.get_studies(str(tmp_path), ['A'])) == {'A'}
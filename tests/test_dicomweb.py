@@ -0,0 +1,84 @@
+import os
+import types
+
+import pytest
+
+import dicomweb
+
+
+class RetryingClient:
+    """Answers 503 to the first POST, then 200; drains each streamed body like a real upload"""
+
+    def __init__(self):
+        self.posts = 0
+
+    def post(self, url, data=None, headers=None):
+        self.posts += 1
+        for _ in data:
+            pass
+        return types.SimpleNamespace(status_code=503 if self.posts == 1 else 200, headers={})
+
+
+def test_retried_upload_batch_is_counted_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(dicomweb.config, 'UPLOAD_RETRY_BACKOFF', 0)
+    file_paths = []
+    for index in range(3):
+        path = tmp_path / f'{index}.dcm'
+        path.write_bytes(b'x' * (100 + index))
+        file_paths.append(str(path))
+    client = RetryingClient()
+    progress = dicomweb.TransferProgress()
+
+    report = dicomweb.upload_in_batches(client, 'http://dicom/studies', {}, file_paths, progress=progress)
+
+    assert report['success']
+    assert client.posts == 2
+    stats = progress.snapshot()
+    assert (stats['instances'], stats['bytes']) == (3, 303)
+    assert (stats['instances_total'], stats['bytes_total']) == (3, 303)
+
+
+BOUNDARY = 'a1b2c3'
+PARTS = [
+    b'DICM' + bytes(range(256)) * 4,
+    b'\r\n--a1b2c',  # looks like the start of a delimiter
+    b'',
+    b'--' + BOUNDARY.encode() + b'x',  # the boundary without the leading CRLF is not a delimiter
+]
+
+
+def multipart_body(parts, boundary=BOUNDARY):
+    body = b'preamble\r\n'
+    for part in parts:
+        body += f'--{boundary}\r\nContent-Type: application/dicom\r\n\r\n'.encode() + part + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode()
+
+
+def chunked(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def read_parts(chunks, directory):
+    parts = []
+    for headers, temp_path in dicomweb.iter_multipart_parts(chunks, BOUNDARY, str(directory)):
+        with open(temp_path, 'rb') as fp:
+            parts.append((headers['content-type'], fp.read()))
+        os.remove(temp_path)
+    return parts
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 11, 64, 1 << 20])
+def test_multipart_parts_across_chunk_edges(tmp_path, chunk_size):
+    chunks = chunked(multipart_body(PARTS), chunk_size)
+
+    assert read_parts(chunks, tmp_path) == [('application/dicom', part) for part in PARTS]
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('cut', [3, 5, 20, 300, 1100])
+def test_truncated_multipart_body_is_an_error(tmp_path, cut):
+    body = multipart_body(PARTS)[:-cut]
+
+    with pytest.raises(ValueError):
+        read_parts(chunked(body, 7), tmp_path)
+    assert os.listdir(tmp_path) == []
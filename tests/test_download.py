@@ -0,0 +1,86 @@
+import io
+
+import pydicom
+import requests
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import app
+import dicomweb
+
+BOUNDARY = 'test-boundary'
+
+
+def instance_bytes(instance_number):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.SeriesNumber = 1
+    ds.InstanceNumber = instance_number
+    buffer = io.BytesIO()
+    pydicom.dcmwrite(buffer, ds, write_like_original=False)
+    return buffer.getvalue()
+
+
+class FakeResponse:
+    """A streamed multipart response that can break after a number of parts"""
+
+    def __init__(self, parts, fail_after=None):
+        self.parts = parts
+        self.fail_after = fail_after
+        self.status_code = 200
+        self.headers = {'Content-Type': dicomweb.multipart_related_content_type(BOUNDARY)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=None):
+        for count, part in enumerate(self.parts):
+            if count == self.fail_after:
+                # The next delimiter completes the parts sent so far before the connection drops
+                yield f'--{BOUNDARY}\r\n'.encode()
+                raise requests.ConnectionError("connection reset")
+            yield f'--{BOUNDARY}\r\nContent-Type: application/dicom\r\n\r\n'.encode() + part + b'\r\n'
+        yield f'--{BOUNDARY}--\r\n'.encode()
+
+
+class FlakyClient:
+    """Breaks the first response for each URL after one part, then serves it whole"""
+
+    def __init__(self, parts_by_url):
+        self.parts_by_url = parts_by_url
+        self.calls = {}
+
+    def get(self, url, **kwargs):
+        self.calls[url] = self.calls.get(url, 0) + 1
+        fail_after = 1 if self.calls[url] == 1 else None
+        return FakeResponse(self.parts_by_url[url], fail_after)
+
+
+def test_retried_item_is_counted_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(app.config, 'DOWNLOAD_RETRY_BACKOFF', 0)
+    parts = {
+        'series-a': [instance_bytes(1), instance_bytes(2)],
+        'series-b': [instance_bytes(3), instance_bytes(4), instance_bytes(5)],
+    }
+    client = FlakyClient(parts)
+    progress = dicomweb.TransferProgress()
+
+    failed = app.retrieve_items_parallel(client, list(parts), {}, str(tmp_path), progress)
+
+    assert failed == []
+    assert client.calls == {'series-a': 2, 'series-b': 2}
+    stats = progress.snapshot()
+    assert stats['instances'] == 5
+    assert stats['bytes'] == sum(len(part) for series in parts.values() for part in series)
+    assert len(list(tmp_path.glob('series-*/*.dcm'))) == 5
@@ -0,0 +1,103 @@
+import os
+from io import BytesIO
+
+import pydicom
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import (
+    DeflatedExplicitVRLittleEndian, ExplicitVRBigEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian,
+    JPEGBaseline8Bit, generate_uid
+)
+
+import header_patch
+
+
+def write_instance(path, transfer_syntax, encapsulated=False, trailing=False):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = transfer_syntax
+    ds = FileDataset(str(path), {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.PatientName = 'Original^Name'
+    ds.PatientID = 'ID-0001'
+    ds.Rows, ds.Columns = 16, 16
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 8, 8, 7
+    ds.SamplesPerPixel, ds.PixelRepresentation = 1, 0
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    if encapsulated:
+        ds.PixelData = encapsulate([bytes(range(200)), bytes(range(100))])
+    else:
+        ds.PixelData = bytes(range(256))
+    if trailing:
+        ds.DataSetTrailingPadding = b'\0' * 32
+    ds.is_little_endian = transfer_syntax != ExplicitVRBigEndian
+    ds.is_implicit_VR = transfer_syntax == ImplicitVRLittleEndian
+    pydicom.dcmwrite(str(path), ds, write_like_original=False)
+    return path
+
+
+def edit(ds):
+    ds.PatientName = 'Patched^Patient^Name'
+    ds.PatientID = 'ID-2'
+
+
+def expected_bytes(path):
+    ds = pydicom.dcmread(str(path), force=True)
+    edit(ds)
+    buffer = BytesIO()
+    pydicom.dcmwrite(buffer, ds, write_like_original=True)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('transfer_syntax, encapsulated, trailing', [
+    (ExplicitVRLittleEndian, False, False),
+    (ImplicitVRLittleEndian, False, False),
+    (ExplicitVRBigEndian, False, False),
+    (DeflatedExplicitVRLittleEndian, False, False),
+    (JPEGBaseline8Bit, True, False),
+    (ExplicitVRLittleEndian, False, True),
+    (ImplicitVRLittleEndian, False, True),
+    (JPEGBaseline8Bit, True, True),
+])
+def test_patched_file_matches_full_rewrite(tmp_path, transfer_syntax, encapsulated, trailing):
+    path = write_instance(tmp_path / 'image.dcm', transfer_syntax, encapsulated, trailing)
+    expected = expected_bytes(path)
+
+    ds, pixel_offset = header_patch.load_header(str(path))
+    assert (pixel_offset is None) == (transfer_syntax == DeflatedExplicitVRLittleEndian)
+    edit(ds)
+    header_patch.save_header(ds, str(path), pixel_offset)
+
+    assert path.read_bytes() == expected
+    assert os.listdir(tmp_path) == ['image.dcm']
+
+
+@pytest.mark.parametrize('transfer_syntax, encapsulated, cut', [
+    (ExplicitVRLittleEndian, False, 10),
+    (ImplicitVRLittleEndian, False, 1),
+    (JPEGBaseline8Bit, True, 8),  # the sequence delimiter
+    (JPEGBaseline8Bit, True, 50),  # inside the last fragment
+])
+def test_truncated_source_is_detected(tmp_path, transfer_syntax, encapsulated, cut):
+    path = write_instance(tmp_path / 'image.dcm', transfer_syntax, encapsulated)
+    original = path.read_bytes()[:-cut]
+    path.write_bytes(original)
+
+    ds, pixel_offset = header_patch.load_header(str(path))
+    edit(ds)
+    with pytest.raises(ValueError):
+        header_patch.save_header(ds, str(path), pixel_offset)
+
+    assert path.read_bytes() == original
+    assert os.listdir(tmp_path) == ['image.dcm']
+
+
+def test_splice_reports_a_short_source(tmp_path):
+    source = tmp_path / 'source'
+    source.write_bytes(b'x' * 100)
+    with open(source, 'rb') as src, open(tmp_path / 'target', 'wb') as dst:
+        with pytest.raises(ValueError):
+            header_patch._splice(src, dst, 40, 100)
@@ -0,0 +1,54 @@
+import threading
+
+import jobs
+
+
+def make_manager(tmp_path):
+    return jobs.JobManager(db_path=str(tmp_path / 'jobs.sqlite'), max_workers=1)
+
+
+def test_queued_job_is_cancelled_immediately(tmp_path):
+    manager = make_manager(tmp_path)
+    release = threading.Event()
+    ran = []
+
+    def blocking(progress=None, cancel=None):
+        release.wait(5)
+        return True, "done"
+
+    def never(progress=None, cancel=None):
+        ran.append(True)
+        return True, "ran"
+
+    first = manager.submit('test', 'blocking', blocking)
+    queued = manager.submit('test', 'queued', never)
+
+    assert manager.cancel(queued.id)
+    assert manager.get(queued.id)['status'] == 'cancelled'
+
+    release.set()
+    manager._executor.shutdown(wait=True)
+    assert not ran
+    assert manager.get(queued.id)['status'] == 'cancelled'
+    assert manager.get(first.id)['status'] == 'succeeded'
+
+
+def test_progress_is_saved_while_running(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs.config, 'JOB_PROGRESS_SAVE_EVERY', 10)
+    manager = make_manager(tmp_path)
+    saved = threading.Event()
+    release = threading.Event()
+
+    def transfer(progress=None, cancel=None):
+        progress.add_instances(25, 2500)
+        saved.set()
+        release.wait(5)
+        return True, "done"
+
+    job = manager.submit('test', 'transfer', transfer)
+    assert saved.wait(5)
+    with manager._lock:
+        row = manager._connect().execute("SELECT instances, bytes FROM jobs WHERE id = ?", (job.id,)).fetchone()
+    release.set()
+    manager._executor.shutdown(wait=True)
+    assert (row['instances'], row['bytes']) == (25, 2500)
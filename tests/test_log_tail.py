@@ -0,0 +1,58 @@
+import threading
+import time
+
+import log_tail
+
+TRACEBACK_RECORD = [
+    '2026-01-02 10:00:00,000 - ERROR - Upload failed',
+    'Traceback (most recent call last):',
+    '  File "dicomweb.py", line 1, in post_batch',
+    'ConnectionResetError: connection reset by peer',
+]
+OTHER_RECORD = ['2026-01-02 10:00:01,000 - INFO - Upload finished']
+
+
+def follow_lines(path, log_filter, append):
+    """Lines follow() yields while `append()` writes to the log"""
+    lines = []
+    done = threading.Event()
+
+    def run():
+        for line in log_tail.follow(str(path), log_filter, poll_interval=0.01, stop=done.is_set):
+            if line is not None:
+                lines.append(line)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.1)  # let follow() open the file at its current end
+    append()
+    time.sleep(0.2)
+    done.set()
+    thread.join(5)
+    return lines
+
+
+def write_records(path, *records):
+    with open(path, 'a', encoding='utf-8') as fp:
+        for record in records:
+            fp.write('\n'.join(record) + '\n')
+
+
+def test_follow_matches_text_in_continuation_lines(tmp_path):
+    path = tmp_path / 'app.log'
+    write_records(path, OTHER_RECORD)
+    log_filter = log_tail.LogFilter(text='connection reset')
+
+    lines = follow_lines(path, log_filter, lambda: write_records(path, OTHER_RECORD, TRACEBACK_RECORD, OTHER_RECORD))
+
+    assert lines == TRACEBACK_RECORD
+    assert log_tail.tail(str(path), 10, log_filter) == TRACEBACK_RECORD
+
+
+def test_follow_yields_last_record_without_waiting_for_the_next(tmp_path):
+    path = tmp_path / 'app.log'
+    path.write_text('')
+
+    lines = follow_lines(path, log_tail.LogFilter(level='ERROR'), lambda: write_records(path, TRACEBACK_RECORD))
+
+    assert lines == TRACEBACK_RECORD
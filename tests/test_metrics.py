@@ -0,0 +1,19 @@
+import threading
+
+import metrics
+
+
+def test_shards_of_finished_threads_are_folded_without_a_scrape(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    counter = metrics.Counter('test_shard_total', 'Test counter', ('result',))
+    try:
+        for _ in range(200):
+            thread = threading.Thread(target=counter.inc, args=('hit',))
+            thread.start()
+            thread.join()
+
+        assert len(counter._shards) <= 1
+        assert counter.collect() == {('hit',): 200}
+    finally:
+        with metrics._registry_lock:
+            metrics._metrics.remove(counter)
@@ -0,0 +1,36 @@
+import pydicom
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import preview
+
+
+def test_overwriting_a_key_does_not_count_it_twice(tmp_path):
+    cache = preview.PreviewCache(str(tmp_path), max_bytes=10_000)
+    cache.put('other', b'x' * 10)
+    for _ in range(5):
+        cache.put('same', b'y' * 3000)
+
+    assert cache._total == 3010
+    assert cache.contains('other') and cache.contains('same')
+
+
+def test_native_frame_without_bits_stored(tmp_path):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = 4, 4
+    ds.BitsAllocated, ds.SamplesPerPixel, ds.PixelRepresentation = 8, 1, 0
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.PixelData = bytes(range(16))
+    path = tmp_path / 'image.dcm'
+    pydicom.dcmwrite(str(path), ds, write_like_original=False)
+
+    _, pixels = preview.load_frame(str(path))
+
+    assert pixels.shape == (4, 4)
+    assert pixels[3, 3] == 15
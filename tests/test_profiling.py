@@ -0,0 +1,31 @@
+import pytest
+
+import app
+import profiling
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling.config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'budget', profiling.ProfileBudget(10, 3600))
+    monkeypatch.setitem(app.app.config, 'PROPAGATE_EXCEPTIONS', True)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['settings'] = {'DICOM_ROOT': str(tmp_path), 'PROFILING': True}
+    return client
+
+
+def test_profile_of_a_failed_request_frees_the_budget(client, monkeypatch, tmp_path):
+    def broken():
+        raise RuntimeError("view failed")
+
+    monkeypatch.setitem(app.app.view_functions, 'view_settings', broken)
+    with pytest.raises(RuntimeError):
+        client.get('/view-settings?profile=1')
+    assert len(profiling.list_profiles(str(tmp_path))) == 1
+
+    monkeypatch.setitem(app.app.view_functions, 'view_settings', lambda: 'ok')
+    response = client.get('/view-settings?profile=1')
+
+    assert response.headers[profiling.PROFILE_HEADER].endswith('.prof')
+    assert len(profiling.list_profiles(str(tmp_path))) == 2
@@ -0,0 +1,23 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('limit=0&offset=-5', (0, 1)),
+    ('limit=-10', (0, 1)),
+    ('limit=100000&offset=20', (20, app.config.QIDO_MAX_PAGE_SIZE)),
+    ('', (0, app.config.QIDO_PAGE_SIZE)),
+])
+def test_study_page_is_clamped(monkeypatch, query, expected):
+    calls = []
+
+    def search_studies(search_params, offset=0, limit=None):
+        calls.append((offset, limit))
+        return True, []
+
+    monkeypatch.setattr(app, 'search_studies', search_studies)
+    response = app.app.test_client().get(f'/api/dicom-studies?{query}')
+
+    assert response.status_code == 200
+    assert calls == [expected]